@@ -0,0 +1,198 @@
+'''
+The running counts of the A/B tests.
+
+Every algorithm of a running A/B test has an ABTestArm with the number of
+its requests, labeled requests and correct responses and the sum of its
+inference durations. The requests are counted by the request writer when
+they are saved and the labels when feedback arrives, with one UPDATE of
+F() expressions for all the arms, so the results of a test are read from
+its arms at any time instead of from a scan of its requests.
+
+The arms are compared with a mixture sequential probability ratio test
+(mSPRT) of their accuracy over the labeled requests. Its p-value stays
+valid however often the results are looked at, so a test can be stopped
+as soon as the difference is significant. The running minimum of the
+p-values of the looks is kept in the ABTest.
+'''
+
+# Imports
+import math
+from collections import defaultdict
+
+from django.db.models import Case, F, Q, Value, When
+
+from apps.endpoints.models import ABTest, ABTestArm
+
+def is_labeled(feedback):
+    return feedback is not None and feedback != ""
+
+def get_increments(lookup, deltas):
+    '''
+    Returns the F() expressions that add the deltas to the counters, deltas
+    maps the value of the lookup field of an arm to a dict of field name 
+    to increment
+    '''
+    fields = {field for delta in deltas.values() for field in delta}
+    return {
+        field: F(field) + Case(
+            *[
+                When(**{lookup: key}, then=Value(delta.get(field, 0)))
+                for key, delta in deltas.items()
+            ],
+            default=Value(0),
+            output_field=ABTestArm._meta.get_field(field)
+        )
+        for field in fields
+    }
+
+def record_predictions(ml_requests):
+    '''
+    Counts the saved MLRequest objects in the arms of the running A/B tests
+    of their algorithms. Only the requests created after the start of a
+    test are counted in its arms. The inference duration is read from the
+    latency attribute set by the views.
+    '''
+    algorithm_ids = {ml_request.parent_mlalgorithm_id for ml_request in ml_requests}
+    if not algorithm_ids:
+        return
+
+    arms = {}
+    for arm_id, algorithm_id, started_at in ABTestArm.objects.filter(
+        parent_mlalgorithm_id__in=algorithm_ids, ab_test__ended_at__isnull=True
+    ).values_list("id", "parent_mlalgorithm_id", "ab_test__created_at"):
+        arms.setdefault(algorithm_id, []).append((arm_id, started_at))
+
+    deltas = defaultdict(lambda: {"requests": 0, "latency_sum": 0.0})
+    for ml_request in ml_requests:
+        latency = getattr(ml_request, "latency", None) or 0.0
+        for arm_id, started_at in arms.get(ml_request.parent_mlalgorithm_id, []):
+            if ml_request.created_at >= started_at:
+                deltas[arm_id]["requests"] += 1
+                deltas[arm_id]["latency_sum"] += latency
+
+    if deltas:
+        ABTestArm.objects.filter(id__in=deltas).update(**get_increments("id", deltas))
+
+def record_feedback(changes):
+    '''
+    Counts the feedback changes in the arms of the running A/B tests,
+    changes is a list of (MLRequest, previous feedback) pairs. Only the
+    requests created after the start of a test are counted in its arms.
+
+    Returns the ids of the A/B tests with changed counters
+    '''
+    algorithm_ids = {ml_request.parent_mlalgorithm_id for ml_request, _ in changes}
+    if not algorithm_ids:
+        return set()
+
+    arms = {}
+    for arm_id, ab_test_id, algorithm_id, started_at in ABTestArm.objects.filter(
+        parent_mlalgorithm_id__in=algorithm_ids, ab_test__ended_at__isnull=True
+    ).values_list("id", "ab_test_id", "parent_mlalgorithm_id", "ab_test__created_at"):
+        arms.setdefault(algorithm_id, []).append((arm_id, ab_test_id, started_at))
+
+    deltas = defaultdict(lambda: {"labeled": 0, "correct": 0})
+    ab_test_ids = set()
+    for ml_request, previous_feedback in changes:
+        labeled = is_labeled(ml_request.feedback) - is_labeled(previous_feedback)
+        correct = (
+            (ml_request.feedback == ml_request.response)
+            - (previous_feedback == ml_request.response)
+        )
+        if not labeled and not correct:
+            continue
+
+        for arm_id, ab_test_id, started_at in arms.get(ml_request.parent_mlalgorithm_id, []):
+            if ml_request.created_at >= started_at:
+                deltas[arm_id]["labeled"] += labeled
+                deltas[arm_id]["correct"] += correct
+                ab_test_ids.add(ab_test_id)
+
+    if deltas:
+        ABTestArm.objects.filter(id__in=deltas).update(**get_increments("id", deltas))
+    return ab_test_ids
+
+def mixture_sprt(correct_1, labeled_1, correct_2, labeled_2, mixture_variance):
+    '''
+    Returns the z score and the always valid p-value of the difference of 
+    the accuracies of two arms, or None and None without labeled requests.
+    The p-value is the inverse of the likelihood ratio of the normal 
+    approximation of the difference, mixed over a normal prior of the 
+    difference with the given variance under the alternative.
+    '''
+    if labeled_1 == 0 or labeled_2 == 0:
+        return None, None
+
+    pooled = (correct_1 + correct_2) / (labeled_1 + labeled_2)
+    variance = pooled * (1.0 - pooled) * (1.0 / labeled_1 + 1.0 / labeled_2)
+    if variance == 0:
+        # Both arms are always right or always wrong
+        return 0.0, 1.0
+
+    difference = correct_1 / labeled_1 - correct_2 / labeled_2
+    log_likelihood_ratio = (
+        0.5 * math.log(variance / (variance + mixture_variance))
+        + difference ** 2 * mixture_variance / (2.0 * variance * (variance + mixture_variance))
+    )
+    return difference / math.sqrt(variance), min(1.0, math.exp(-log_likelihood_ratio))
+
+def get_stats(ab_test, arms, alpha=0.05, min_labeled=100, mixture_variance=0.0025):
+    '''
+    Returns the counts and the accuracy of every arm, and the mSPRT of the 
+    best arm against the second best. Once every arm has min_labeled 
+    labeled requests, the p-value is the running minimum of the p-values
+    of the looks, and the difference is significant when it is at most
+    alpha.
+    '''
+    results = []
+    for arm in arms:
+        results.append({
+            "algorithm": arm.parent_mlalgorithm_id,
+            "requests": arm.requests,
+            "labeled": arm.labeled,
+            "correct": arm.correct,
+            "accuracy": arm.correct / arm.labeled if arm.labeled else 0.0,
+            "mean_latency_ms": 1000.0 * arm.latency_sum / arm.requests if arm.requests else 0.0,
+        })
+
+    ranked = sorted(results, key=lambda result: result["accuracy"], reverse=True)
+
+    z_score, p_value = None, None
+    if len(ranked) >= 2:
+        best, second = ranked[:2]
+        z_score, p_value = mixture_sprt(
+            best["correct"], best["labeled"], second["correct"], second["labeled"],
+            mixture_variance
+        )
+
+    # The normal approximation is only trusted with enough labels
+    enough_labeled = all(result["labeled"] >= min_labeled for result in results)
+    if enough_labeled and p_value is not None and ab_test.p_value is not None:
+        p_value = min(p_value, ab_test.p_value)
+
+    return {
+        "id": ab_test.id,
+        "created_at": ab_test.created_at,
+        "ended_at": ab_test.ended_at,
+        "arms": results,
+        "best_algorithm": ranked[0]["algorithm"] if ranked else None,
+        "z_score": z_score,
+        "p_value": p_value,
+        "significant": enough_labeled and p_value is not None and p_value <= alpha,
+        "enough_labeled": enough_labeled,
+    }
+
+def record_p_value(ab_test, stats):
+    '''
+    Keeps the running minimum of the p-values of the looks at the A/B test 
+    with enough labeled requests
+    '''
+    p_value = stats["p_value"]
+    if not stats["enough_labeled"] or p_value is None:
+        return
+
+    if ab_test.p_value is None or p_value < ab_test.p_value:
+        ABTest.objects.filter(id=ab_test.id).filter(
+            Q(p_value__isnull=True) | Q(p_value__gt=p_value)
+        ).update(p_value=p_value)
+        ab_test.p_value = p_value
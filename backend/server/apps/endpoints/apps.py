@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class EndpointsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.endpoints'
+
+    def ready(self):
+        # Connects the SQLite tuning to the connection_created signal
+        import server.db  # noqa: F401
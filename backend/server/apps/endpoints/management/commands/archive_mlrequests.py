@@ -0,0 +1,131 @@
+import datetime
+import gzip
+import json
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.endpoints.models import MLRequest, MLRequestDailyAggregate
+
+class Command(BaseCommand):
+    '''
+    Keeps the MLRequest table rolling. The requests older than the retention
+    period are archived day by day to gzip compressed NDJSON files, their
+    daily per-algorithm counts are added to MLRequestDailyAggregate, and
+    they are removed from the table.
+
+    A day is written to a part file that is renamed to the archive of the
+    day once its requests are deleted, so that an interrupted run neither
+    loses nor duplicates requests: the part files left by a previous run
+    are renamed if their requests were deleted, and dropped otherwise.
+
+    Run daily, for example from cron:
+        python manage.py archive_mlrequests --days 90 --output-dir /var/archive
+    '''
+    help = "Archives and removes the MLRequests older than the retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=90,
+            help="The number of days of requests kept in the table"
+        )
+        parser.add_argument(
+            "--output-dir", default="archive",
+            help="The directory of the archive files"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=2000,
+            help="The number of requests read from the database at a time"
+        )
+
+    def handle(self, *args, **options):
+        os.makedirs(options["output_dir"], exist_ok=True)
+        self.recover_parts(options["output_dir"])
+
+        # Archive whole days only
+        cutoff = timezone.localtime() - datetime.timedelta(days=options["days"])
+        cutoff = cutoff.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        days = (
+            MLRequest.objects.filter(created_at__lt=cutoff)
+            .annotate(date=TruncDate("created_at"))
+            .values_list("date", flat=True)
+            .distinct()
+            .order_by("date")
+        )
+
+        for date in list(days):
+            archived = self.archive_day(date, options["output_dir"], options["chunk_size"])
+            self.stdout.write("Archived {} requests of {}".format(archived, date))
+
+    def archive_day(self, date, output_dir, chunk_size):
+        start, end = self.get_day_range(date)
+        ml_requests = MLRequest.objects.filter(created_at__gte=start, created_at__lt=end)
+
+        path = os.path.join(output_dir, "mlrequests-{}.ndjson.gz".format(date.isoformat()))
+        archived, last_id = 0, 0
+        with gzip.open(path + ".part", "wt", encoding="utf-8") as archive:
+            for ml_request in ml_requests.values().iterator(chunk_size=chunk_size):
+                archive.write(json.dumps(ml_request, default=str) + "\n")
+                archived += 1
+                last_id = max(last_id, ml_request["id"])
+
+        # Only the archived requests are counted and deleted
+        ml_requests = ml_requests.filter(id__lte=last_id)
+
+        counts = ml_requests.values("parent_mlalgorithm").annotate(
+            requests=Count("id"),
+            labeled=Count("id", filter=Q(feedback__isnull=False) & ~Q(feedback="")),
+            correct=Count("id", filter=Q(response=F("feedback"))),
+        ).order_by()
+
+        with transaction.atomic():
+            for row in counts:
+                aggregate, _ = MLRequestDailyAggregate.objects.select_for_update().get_or_create(
+                    parent_mlalgorithm_id=row["parent_mlalgorithm"], date=date
+                )
+                aggregate.requests = F("requests") + row["requests"]
+                aggregate.labeled = F("labeled") + row["labeled"]
+                aggregate.correct = F("correct") + row["correct"]
+                aggregate.save()
+
+            ml_requests.delete()
+
+        self.publish_part(path)
+        return archived
+
+    def get_day_range(self, date):
+        start = timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+        return start, start + datetime.timedelta(days=1)
+
+    def publish_part(self, path):
+        '''
+        Renames the part file of a day to the archive of the day, or to the
+        next free numbered archive of the day if it already exists
+        '''
+        target, number = path, 0
+        while os.path.exists(target):
+            number += 1
+            target = path.replace(".ndjson.gz", ".{}.ndjson.gz".format(number))
+        os.replace(path + ".part", target)
+
+    def recover_parts(self, output_dir):
+        '''
+        Renames the part files whose requests were deleted by a previous 
+        run, and removes those whose requests are still in the table
+        '''
+        for name in sorted(os.listdir(output_dir)):
+            if not (name.startswith("mlrequests-") and name.endswith(".ndjson.gz.part")):
+                continue
+
+            date = datetime.date.fromisoformat(name[len("mlrequests-"):-len(".ndjson.gz.part")])
+            start, end = self.get_day_range(date)
+            path = os.path.join(output_dir, name[:-len(".part")])
+            if MLRequest.objects.filter(created_at__gte=start, created_at__lt=end).exists():
+                os.remove(path + ".part")
+            else:
+                self.publish_part(path)
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:30
+
+import uuid
+
+from django.db import migrations, models
+
+
+def generate_request_ids(apps, schema_editor):
+    MLRequest = apps.get_model('endpoints', 'MLRequest')
+    for ml_request in MLRequest.objects.filter(request_id__isnull=True).iterator():
+        ml_request.request_id = uuid.uuid4()
+        ml_request.save(update_fields=['request_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('endpoints', '0002_abtest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlrequest',
+            name='request_id',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(generate_request_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='mlrequest',
+            name='request_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('endpoints', '0003_mlrequest_request_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mlrequest',
+            index=models.Index(fields=['parent_mlalgorithm', 'created_at'], name='mlrequest_alg_created_idx'),
+        ),
+    ]
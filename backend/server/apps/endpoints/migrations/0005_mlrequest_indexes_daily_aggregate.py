@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('endpoints', '0004_mlrequest_alg_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MLRequestDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('labeled', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='mlrequest',
+            index=models.Index(fields=['created_at'], name='mlrequest_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mlrequest',
+            index=models.Index(fields=['feedback'], name='mlrequest_feedback_idx'),
+        ),
+        migrations.AddField(
+            model_name='mlrequestdailyaggregate',
+            name='parent_mlalgorithm',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='endpoints.mlalgorithm'),
+        ),
+        migrations.AddConstraint(
+            model_name='mlrequestdailyaggregate',
+            constraint=models.UniqueConstraint(fields=('parent_mlalgorithm', 'date'), name='mlrequestdailyaggregate_alg_date_unique'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, F, Q
+
+
+def create_arms(apps, schema_editor):
+    ABTest = apps.get_model('endpoints', 'ABTest')
+    ABTestArm = apps.get_model('endpoints', 'ABTestArm')
+    MLRequest = apps.get_model('endpoints', 'MLRequest')
+    for ab_test in ABTest.objects.iterator():
+        algorithm_ids = [ab_test.parent_mlalgorithm_1_id, ab_test.parent_mlalgorithm_2_id]
+        ml_requests = MLRequest.objects.filter(
+            parent_mlalgorithm__in=algorithm_ids, created_at__gte=ab_test.created_at
+        )
+        if ab_test.ended_at is not None:
+            ml_requests = ml_requests.filter(created_at__lt=ab_test.ended_at)
+
+        counts = {
+            row['parent_mlalgorithm']: row
+            for row in ml_requests.values('parent_mlalgorithm').annotate(
+                requests=Count('id'),
+                labeled=Count('id', filter=~Q(feedback='') & Q(feedback__isnull=False)),
+                correct=Count('id', filter=Q(response=F('feedback'))),
+            ).order_by()
+        }
+        for algorithm_id in algorithm_ids:
+            row = counts.get(algorithm_id, {})
+            ABTestArm.objects.get_or_create(
+                ab_test=ab_test, parent_mlalgorithm_id=algorithm_id,
+                defaults={
+                    'requests': row.get('requests', 0),
+                    'labeled': row.get('labeled', 0),
+                    'correct': row.get('correct', 0),
+                }
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('endpoints', '0005_mlrequest_indexes_daily_aggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ABTestArm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requests', models.PositiveBigIntegerField(default=0)),
+                ('labeled', models.PositiveBigIntegerField(default=0)),
+                ('correct', models.PositiveBigIntegerField(default=0)),
+                ('latency_sum', models.FloatField(default=0.0)),
+                ('ab_test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='arms', to='endpoints.abtest')),
+                ('parent_mlalgorithm', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='endpoints.mlalgorithm')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='abtestarm',
+            constraint=models.UniqueConstraint(fields=('ab_test', 'parent_mlalgorithm'), name='abtestarm_test_alg_unique'),
+        ),
+        migrations.RunPython(create_arms, migrations.RunPython.noop),
+    ]
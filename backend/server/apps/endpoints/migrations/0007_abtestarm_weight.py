@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('endpoints', '0006_abtestarm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='abtestarm',
+            name='weight',
+            field=models.FloatField(default=1.0),
+        ),
+    ]
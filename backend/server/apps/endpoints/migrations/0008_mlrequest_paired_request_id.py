@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('endpoints', '0007_abtestarm_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mlrequest',
+            name='paired_request_id',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
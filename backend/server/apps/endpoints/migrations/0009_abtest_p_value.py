@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('endpoints', '0008_mlrequest_paired_request_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='abtest',
+            name='p_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
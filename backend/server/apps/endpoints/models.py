@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 
 # Create your models here.
@@ -42,7 +44,8 @@ class MLAlgorithmStatus(models.Model):
     change during the time.
 
     Attributes:
-        status: the status of the algorithm in the endpoint (testing, staging, production, ab_testing).
+        status: the status of the algorithm in the endpoint (testing, staging, production, ab_testing, shadow).
+            A shadow algorithm scores the production requests of its endpoint in the background.
         active: the boolean flag which point to currently active status
         created_by: the name of the creator
         created_at: the date of status creation
@@ -66,6 +69,10 @@ class MLRequest(models.Model):
         feedback: the feedback about the response in JSON format
         created_at: the date when request was created
         parent_mlalgorithm: the reference to ML Algorithm used to compute response
+        request_id: the unique id of the request, it is allocated before the
+            request is saved and returned with the prediction
+        paired_request_id: the request_id of the production request scored 
+            again by a shadow algorithm, None for the other requests
     '''
 
     input_data = models.CharField(max_length=10000)
@@ -74,6 +81,49 @@ class MLRequest(models.Model):
     feedback = models.CharField(max_length=10000, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True, blank=True)
     parent_mlalgorithm = models.ForeignKey(MLAlgorithm, on_delete=models.CASCADE)
+    request_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    paired_request_id = models.UUIDField(blank=True, null=True, db_index=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # A/B test evaluation counts the requests of an algorithm in a 
+            # time window
+            models.Index(
+                fields=["parent_mlalgorithm", "created_at"],
+                name="mlrequest_alg_created_idx"
+            ),
+            # Listing and archiving select the requests by date
+            models.Index(fields=["created_at"], name="mlrequest_created_idx"),
+            # Feedback updates and accuracy filters on the feedback
+            models.Index(fields=["feedback"], name="mlrequest_feedback_idx"),
+        ]
+
+class MLRequestDailyAggregate(models.Model):
+    '''
+    The MLRequestDailyAggregate keeps the daily counts of the requests that 
+    were archived and removed from the MLRequest table.
+
+    Attributes:
+        date: the day of the requests
+        requests: the number of requests
+        labeled: the number of requests with feedback
+        correct: the number of requests with the response equal to the feedback
+        parent_mlalgorithm: the reference to ML Algorithm used to compute responses
+    '''
+
+    date = models.DateField()
+    requests = models.PositiveIntegerField(default=0)
+    labeled = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    parent_mlalgorithm = models.ForeignKey(MLAlgorithm, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["parent_mlalgorithm", "date"],
+                name="mlrequestdailyaggregate_alg_date_unique"
+            ),
+        ]
 
 class ABTest(models.Model):
     '''
@@ -85,8 +135,11 @@ class ABTest(models.Model):
         created_at: the date of test created
         ended_at: the date of test stop
         summary: the description with test summary, created at test stop
+        p_value: the running minimum of the p-values of the sequential test of
+            the best algorithm against the second best, see ab_testing.py
         parent_mlalgorithm_1: The reference to the first corresponding MLAlgorithm.
         parent_mlalgorithm_2: The reference to the second corresponding MLAlgorithm.
+            All the algorithms of the test, with their weights, are in its arms.
     '''
 
     title = models.CharField(max_length=10000)
@@ -94,6 +147,40 @@ class ABTest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, blank=True)
     ended_at = models.DateTimeField(blank=True, null=True)
     summary = models.CharField(max_length=10000, blank=True, null=True)
+    p_value = models.FloatField(blank=True, null=True)
     
     parent_mlalgorithm_1 =models.ForeignKey(MLAlgorithm, on_delete=models.CASCADE, related_name="parent_mlalgorithm_1")
-    parent_mlalgorithm_2 =models.ForeignKey(MLAlgorithm, on_delete=models.CASCADE, related_name="parent_mlalgorithm_2")
\ No newline at end of file
+    parent_mlalgorithm_2 =models.ForeignKey(MLAlgorithm, on_delete=models.CASCADE, related_name="parent_mlalgorithm_2")
+
+class ABTestArm(models.Model):
+    '''
+    The ABTestArm keeps the running counts of one algorithm of an A/B test,
+    they are updated when the requests are saved and when feedback arrives,
+    so the results are read without scanning the requests.
+
+    Attributes:
+        ab_test: the reference to the ABTest
+        parent_mlalgorithm: the reference to the ML Algorithm of the arm
+        requests: the number of requests
+        labeled: the number of requests with feedback
+        correct: the number of requests with the response equal to the feedback
+        latency_sum: the sum of the inference durations of the requests in seconds
+        weight: the share of the traffic of the A/B test routed to the arm,
+            relative to the weights of the other arms
+    '''
+
+    ab_test = models.ForeignKey(ABTest, on_delete=models.CASCADE, related_name="arms")
+    parent_mlalgorithm = models.ForeignKey(MLAlgorithm, on_delete=models.CASCADE)
+    requests = models.PositiveBigIntegerField(default=0)
+    labeled = models.PositiveBigIntegerField(default=0)
+    correct = models.PositiveBigIntegerField(default=0)
+    latency_sum = models.FloatField(default=0.0)
+    weight = models.FloatField(default=1.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ab_test", "parent_mlalgorithm"],
+                name="abtestarm_test_alg_unique"
+            ),
+        ]
@@ -0,0 +1,16 @@
+# backend/server/apps/endpoints/pagination.py file
+
+from rest_framework.pagination import CursorPagination
+
+class IdCursorPagination(CursorPagination):
+    '''
+    Keyset pagination on the primary key, the newest objects first.
+
+    Every page is read with an indexed "id < cursor" query, so its cost 
+    does not depend on the position in the table. The page size can be 
+    set with the page_size query parameter.
+    '''
+    ordering = "-id"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
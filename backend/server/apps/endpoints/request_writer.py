@@ -0,0 +1,224 @@
+'''
+The MLRequest writer saves MLRequest objects outside of the request path.
+
+The requests are buffered in a bounded queue and a background thread saves
+them with bulk_create when the buffer reaches the batch size or when the
+flush interval has passed, and counts them in the arms of the running A/B
+tests. The request ids are allocated as UUIDs when the MLRequest objects
+are created, so they can be returned to the client before the requests
+are saved.
+
+Configured with the ML_REQUEST_LOGGING setting:
+    ASYNC: save the requests in the background thread (default True)
+    BATCH_SIZE: the maximum number of requests saved with one bulk_create
+    FLUSH_INTERVAL: the maximum number of seconds a request is buffered
+    MAX_QUEUE_SIZE: the maximum number of buffered requests
+    ENQUEUE_TIMEOUT: the number of seconds to wait for room in a full queue
+        before the request is saved in the request path
+'''
+
+# Imports
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, connection
+from django.dispatch import receiver
+
+from apps.endpoints.ab_testing import record_predictions
+from apps.endpoints.models import MLRequest
+from apps.ml.metrics import REQUEST_WRITE_ERRORS, REQUEST_WRITES
+
+logger = logging.getLogger(__name__)
+
+# Tells the background thread to save the buffer and exit
+STOP = object()
+
+class MLRequestWriter:
+
+    def __init__(
+        self, batch_size=500, flush_interval=1.0, max_queue_size=10000,
+        enqueue_timeout=1.0, asynchronous=True
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.asynchronous = asynchronous
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, "ML_REQUEST_LOGGING", {})
+        return cls(
+            batch_size=config.get("BATCH_SIZE", 500),
+            flush_interval=config.get("FLUSH_INTERVAL", 1.0),
+            max_queue_size=config.get("MAX_QUEUE_SIZE", 10000),
+            enqueue_timeout=config.get("ENQUEUE_TIMEOUT", 1.0),
+            asynchronous=config.get("ASYNC", True),
+        )
+
+    def save(self, ml_requests):
+        '''
+        Saves the MLRequest objects, in the background if the writer is
+        asynchronous. Blocks for up to enqueue_timeout when the queue is
+        full and then saves the remaining requests in the calling thread.
+        '''
+        if not self.asynchronous:
+            self.write(ml_requests)
+            return
+
+        self.start()
+
+        for index, ml_request in enumerate(ml_requests):
+            try:
+                self.queue.put(ml_request, timeout=self.enqueue_timeout)
+            except queue.Full:
+                # Backpressure, the caller pays for the insert
+                self.write(ml_requests[index:])
+                return
+
+    def save_nowait(self, ml_requests):
+        '''
+        Queues the MLRequest objects without blocking. Returns the requests
+        that were not queued, because the queue is full or the writer is 
+        not asynchronous, they have to be saved with save().
+        '''
+        if not self.asynchronous:
+            return ml_requests
+
+        self.start()
+
+        for index, ml_request in enumerate(ml_requests):
+            try:
+                self.queue.put_nowait(ml_request)
+            except queue.Full:
+                return ml_requests[index:]
+
+        return []
+
+    def write(self, ml_requests):
+        try:
+            with REQUEST_WRITES.time():
+                MLRequest.objects.bulk_create(ml_requests, batch_size=self.batch_size)
+        except Exception:
+            REQUEST_WRITE_ERRORS.inc(amount=len(ml_requests))
+            logger.exception("Failed to save %d ML requests", len(ml_requests))
+            return
+
+        try:
+            record_predictions(ml_requests)
+        except Exception:
+            logger.exception("Failed to count %d ML requests in the A/B tests", len(ml_requests))
+
+    def write_in_thread(self, ml_requests):
+        # The request signals never run in the background thread, so the
+        # connection is recycled here when it is broken or older than
+        # CONN_MAX_AGE
+        close_old_connections()
+        self.write(ml_requests)
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="mlrequest-writer", daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        buffer = []
+        deadline = None
+
+        while True:
+            timeout = self.flush_interval
+            if buffer:
+                timeout = max(0, deadline - time.monotonic())
+
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is STOP:
+                break
+
+            if isinstance(item, threading.Event):
+                # Flush requested by flush()
+                self.write_in_thread(buffer)
+                buffer = []
+                item.set()
+                continue
+
+            if item is not None:
+                if not buffer:
+                    deadline = time.monotonic() + self.flush_interval
+                buffer.append(item)
+
+            if len(buffer) >= self.batch_size or (buffer and time.monotonic() >= deadline):
+                self.write_in_thread(buffer)
+                buffer = []
+
+        if buffer:
+            self.write_in_thread(buffer)
+        connection.close()
+
+    def flush(self, timeout=None):
+        '''
+        Waits until all the requests queued before the call are saved
+        '''
+        if self.thread is None or not self.thread.is_alive():
+            return True
+
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        return flushed.wait(timeout)
+
+    def close(self, timeout=None):
+        '''
+        Saves the queued requests and stops the background thread
+        '''
+        with self.lock:
+            thread, self.thread = self.thread, None
+
+        if thread is not None and thread.is_alive():
+            self.queue.put(STOP)
+            thread.join(timeout)
+
+writer = None
+writer_lock = threading.Lock()
+
+def get_request_writer():
+    '''
+    Returns the process wide MLRequestWriter
+    '''
+    global writer
+
+    if writer is None:
+        with writer_lock:
+            if writer is None:
+                writer = MLRequestWriter.from_settings()
+    return writer
+
+@atexit.register
+def close_request_writer():
+    global writer
+
+    with writer_lock:
+        if writer is not None:
+            writer.close()
+            writer = None
+
+@receiver(setting_changed)
+def reset_request_writer(setting, **kwargs):
+    if setting == "ML_REQUEST_LOGGING":
+        close_request_writer()
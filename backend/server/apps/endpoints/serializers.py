@@ -1,7 +1,7 @@
 # Imports
 
 from rest_framework import serializers
-from apps.endpoints.models import Endpoint, MLAlgorithm, MLAlgorithmStatus, MLRequest, ABTest
+from apps.endpoints.models import Endpoint, MLAlgorithm, MLAlgorithmStatus, MLRequest, ABTest, ABTestArm
 
 '''
 serializers: define how database objects are mapped in requests
@@ -11,6 +11,40 @@ serializers: define how database objects are mapped in requests
   into JSON, XML or other content types. 
 '''
 
+def get_requested_fields(request, available_fields=None):
+    '''
+    Returns the set of field names from the fields query parameter, or None
+    if all the fields are requested. With the available fields, a list of
+    unknown or no field names raises a ValidationError.
+    '''
+    if request is None or not request.query_params.get("fields"):
+        return None
+
+    fields = {
+        field.strip() for field in request.query_params["fields"].split(",") 
+        if field.strip()
+    }
+
+    if available_fields is not None and (not fields or fields - set(available_fields)):
+        raise serializers.ValidationError(
+            {"fields": "Expected a list of fields from {}.".format(", ".join(available_fields))}
+        )
+
+    return fields
+
+class FieldsProjectionMixin:
+    '''
+    Serializes only the fields listed in the fields query parameter,
+    for example ?fields=id,response,feedback
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        fields = get_requested_fields(self.context.get("request"))
+        if fields is not None:
+            for field_name in set(self.fields) - fields:
+                self.fields.pop(field_name)
+
 class EndpointSerializer(serializers.ModelSerializer):
     class Meta:
         '''
@@ -21,11 +55,15 @@ class EndpointSerializer(serializers.ModelSerializer):
         read_only_fields = ("id", "name", "owner", "created_at")
         fields = read_only_fields
 
-class MLAlgorithmSerializer(serializers.ModelSerializer):
+class MLAlgorithmSerializer(FieldsProjectionMixin, serializers.ModelSerializer):
 
     current_status = serializers.SerializerMethodField(read_only=True)
 
     def get_current_status(self, mlalgorithm):
+        # Annotated by MLAlgorithmViewSet, so that listing does not query
+        # the status of every algorithm
+        if hasattr(mlalgorithm, "current_status"):
+            return mlalgorithm.current_status
         return MLAlgorithmStatus.objects.filter(parent_mlalgorithm=mlalgorithm).latest('created_at').status
     
     class Meta:
@@ -54,7 +92,7 @@ class MLAlgorithmStatusSerializer(serializers.ModelSerializer):
             "parent_mlalgorithm"
         )
 
-class MLRequestSerializer(serializers.ModelSerializer):
+class MLRequestSerializer(FieldsProjectionMixin, serializers.ModelSerializer):
     class Meta:
         '''
         feedback field that is left in read and write mode 
@@ -63,24 +101,80 @@ class MLRequestSerializer(serializers.ModelSerializer):
         model = MLRequest
         read_only_fields = (
             "id",
+            "request_id",
             "input_data",
             "full_response",
             "response",
             "created_at",
             "parent_mlalgorithm",
+            "paired_request_id",
         )
 
         fields =  (
             "id",
+            "request_id",
             "input_data",
             "full_response",
             "response",
             "feedback",
             "created_at",
             "parent_mlalgorithm",
+            "paired_request_id",
         )
 
+class ABTestArmSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ABTestArm
+        fields = ("parent_mlalgorithm", "weight")
+        extra_kwargs = {"weight": {"min_value": 0.0}}
+
 class ABTestSerializer(serializers.ModelSerializer):
+    '''
+    An A/B test is created with parent_mlalgorithm_1 and parent_mlalgorithm_2
+    for an even split of two algorithms, or with a list of arms of two or 
+    more algorithms and their weights, for example
+    [{"parent_mlalgorithm": 1, "weight": 3}, {"parent_mlalgorithm": 2, "weight": 1}]
+    '''
+
+    arms = ABTestArmSerializer(many=True, required=False)
+
+    def validate(self, attrs):
+        arms = attrs.get("arms")
+
+        if self.instance is not None:
+            if arms is not None:
+                raise serializers.ValidationError({"arms": "The arms of an A/B test cannot be changed."})
+            return attrs
+
+        if arms is None:
+            if not attrs.get("parent_mlalgorithm_1") or not attrs.get("parent_mlalgorithm_2"):
+                raise serializers.ValidationError(
+                    "Expected parent_mlalgorithm_1 and parent_mlalgorithm_2, or arms."
+                )
+            arms = [
+                {"parent_mlalgorithm": attrs["parent_mlalgorithm_1"], "weight": 1.0},
+                {"parent_mlalgorithm": attrs["parent_mlalgorithm_2"], "weight": 1.0},
+            ]
+
+        algorithms = [arm["parent_mlalgorithm"] for arm in arms]
+        if len(algorithms) < 2 or len(set(algorithms)) != len(algorithms):
+            raise serializers.ValidationError({"arms": "Expected two or more different algorithms."})
+        if sum(arm.get("weight", 1.0) for arm in arms) <= 0:
+            raise serializers.ValidationError({"arms": "At least one weight must be positive."})
+
+        # The first two arms are kept in the test
+        attrs["arms"] = arms
+        attrs["parent_mlalgorithm_1"], attrs["parent_mlalgorithm_2"] = algorithms[:2]
+        return attrs
+
+    def create(self, validated_data):
+        arms = validated_data.pop("arms")
+        ab_test = super().create(validated_data)
+        ABTestArm.objects.bulk_create([
+            ABTestArm(ab_test=ab_test, **arm) for arm in arms
+        ])
+        return ab_test
+
     class Meta:
         model = ABTest
         read_only_fields = (
@@ -98,4 +192,9 @@ class ABTestSerializer(serializers.ModelSerializer):
             "summary",
             "parent_mlalgorithm_1",
             "parent_mlalgorithm_2",
-            )
\ No newline at end of file
+            "arms",
+            )
+        extra_kwargs = {
+            "parent_mlalgorithm_1": {"required": False},
+            "parent_mlalgorithm_2": {"required": False},
+        }
@@ -0,0 +1,104 @@
+'''
+Reads and writes the NDJSON and CSV streams of the streaming endpoints.
+
+The request body is read line by line and the records are yielded one at a
+time, so a stream is never held in memory as a whole.
+'''
+
+# Imports
+import codecs
+import csv
+import itertools
+import json
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+CSV_CONTENT_TYPE = "text/csv"
+
+def parse_csv_value(value):
+    '''
+    Converts a CSV field to the JSON type of the field: empty fields are
+    missing values, and numbers are converted to int or float
+    '''
+    value = value.strip()
+    if value == "":
+        return None
+
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+
+    return value
+
+def read_ndjson_records(lines):
+    '''
+    Yields a (record, error message) pair for every non-empty line of an
+    NDJSON stream of bytes lines
+    '''
+    for line_number, line in enumerate(codecs.iterdecode(lines, "utf-8"), start=1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield None, "Invalid JSON on line {}.".format(line_number)
+            continue
+
+        if not isinstance(record, dict):
+            yield None, "Expected a JSON object on line {}.".format(line_number)
+            continue
+
+        yield record, None
+
+def read_csv_records(lines):
+    '''
+    Yields a (record, error message) pair for every row of a CSV stream of
+    bytes lines, the first row is the header
+    '''
+    reader = csv.reader(codecs.iterdecode(lines, "utf-8"))
+
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [column.strip() for column in header]
+
+    for row in reader:
+        if not row:
+            continue
+
+        if len(row) != len(header):
+            yield None, "Expected {} fields on line {}.".format(len(header), reader.line_num)
+            continue
+
+        yield {column: parse_csv_value(value) for column, value in zip(header, row)}, None
+
+def chunked(iterable, chunk_size):
+    '''
+    Yields lists of up to chunk_size items of the iterable
+    '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def ndjson_lines(objects):
+    for obj in objects:
+        yield json.dumps(obj, default=str) + "\n"
+
+class Echo:
+    '''
+    File-like object that returns the written value, so that csv.writer
+    produces the lines of a streaming response
+    '''
+    def write(self, value):
+        return value
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
@@ -1,7 +1,33 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import io
+import json
+import logging
+import math
+import os
+import random
+import tempfile
+import uuid
+from concurrent.futures import Future
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 from rest_framework.test import APIClient
 
+from apps.endpoints import ab_testing
+from apps.endpoints.models import (
+    ABTest, ABTestArm, Endpoint, MLAlgorithm, MLAlgorithmStatus, MLRequest, MLRequestDailyAggregate
+)
+from apps.endpoints.request_writer import MLRequestWriter
+from server.db import PrimaryReplicaRouter, get_replica_alias
+from server.log import JsonFormatter, QueueStreamHandler, SamplingFilter
+
 # Create your tests here.
+@override_settings(ML_REQUEST_LOGGING={"ASYNC": False})
 class EndpointTests(TestCase):
     def test_predict_view(self):
         
@@ -31,4 +57,959 @@ class EndpointTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['label'], "<=50K")
         self.assertTrue("request_id" in response.data)
-        self.assertTrue("status" in response.data)
\ No newline at end of file
+        self.assertTrue("status" in response.data)
+
+        # The request can be retrieved with the returned request id
+        response = client.get("/api/v1/mlrequests/{}".format(response.data["request_id"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["response"], "<=50K")
+
+        # An empty record is rejected
+        response = client.post(classifier_url, {}, format='json')
+        self.assertEqual(response.data["status"], "Error")
+
+    def test_predict_batch_view(self):
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+
+        classifier_url = "/api/v1/income_classifier/predict_batch"
+
+        response = client.post(classifier_url, [input_data, input_data, input_data], format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 3)
+        for prediction in response.data:
+            self.assertEqual(prediction['label'], "<=50K")
+            self.assertTrue("request_id" in prediction)
+        self.assertEqual(len(set(p["request_id"] for p in response.data)), 3)
+
+        # A single record is not a batch
+        response = client.post(classifier_url, input_data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_status_change_updates_routing(self):
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+
+        classifier_url = "/api/v1/income_classifier/predict"
+
+        response = client.post(classifier_url, input_data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # Move the production algorithm to staging
+        algorithm_id = MLRequest.objects.get(request_id=response.data["request_id"]).parent_mlalgorithm_id
+        response = client.post(
+            "/api/v1/mlalgorithmstatuses",
+            {"status": "staging", "created_by": "TR", "parent_mlalgorithm": algorithm_id},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+
+        # The cached route is invalidated
+        response = client.post(classifier_url, input_data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = client.post(classifier_url + "?status=staging", input_data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_predict_async_view(self):
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+
+        classifier_url = "/api/v1/income_classifier/predict_async"
+
+        response = client.post(classifier_url, input_data, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['label'], "<=50K")
+        self.assertTrue(
+            MLRequest.objects.filter(request_id=response.json()["request_id"]).exists()
+        )
+
+        response = client.post(classifier_url + "?status=staging", input_data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = client.get(classifier_url)
+        self.assertEqual(response.status_code, 405)
+
+        # A disconnected client does not cancel the prediction future
+        from apps.endpoints.views import predict_async, registry
+
+        future = Future()
+        request = RequestFactory().post(classifier_url, input_data, content_type="application/json")
+
+        async def disconnect():
+            task = asyncio.ensure_future(predict_async(request, "income_classifier"))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with patch.object(registry, "submit_prediction", return_value=future):
+            asyncio.run(disconnect())
+        self.assertFalse(future.cancelled())
+
+    def test_readiness_view(self):
+        from server.registry import registry
+
+        client = APIClient()
+
+        registry.warm_up()
+        response = client.get("/api/v1/ready")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["ready"])
+        self.assertTrue(len(response.data["algorithms"]) >= 2)
+
+    def test_metrics_view(self):
+        from server.registry import registry
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+        response = client.post("/api/v1/income_classifier/predict", input_data, format='json')
+        self.assertEqual(response.status_code, 200)
+        client.post("/api/v1/income_classifier/predict?status=unknown", input_data, format='json')
+
+        response = client.get("/api/v1/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        lines = response.content.decode().splitlines()
+        self.assertIn("# TYPE ml_stage_duration_seconds histogram", lines)
+
+        algorithm_id = registry.get_algorithm_ids("income_classifier", "production")[0]
+        for stage in ("routing", "preprocessing", "predict", "postprocessing", "persistence", "serialization"):
+            self.assertTrue(any(
+                line.startswith('ml_stage_duration_seconds_bucket{{algorithm="{}",stage="{}",le="+Inf"}} '.format(algorithm_id, stage))
+                for line in lines
+            ), stage)
+        self.assertTrue(any(
+            line.startswith('ml_predictions_total{{algorithm="{}",status="OK"}} '.format(algorithm_id))
+            for line in lines
+        ))
+        self.assertTrue(any(line.startswith("ml_routing_errors_total ") for line in lines))
+
+    def test_request_logging(self):
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+
+        with self.assertLogs("apps.endpoints.requests", level="DEBUG") as logs:
+            with override_settings(ML_LOG_PAYLOADS=True):
+                response = client.post("/api/v1/income_classifier/predict", input_data, format='json')
+
+        request_record, payload_record = logs.records
+        self.assertEqual(request_record.levelno, logging.INFO)
+        self.assertEqual(request_record.request_id, str(response.data["request_id"]))
+        self.assertEqual(request_record.response, "<=50K")
+        self.assertEqual(payload_record.levelno, logging.DEBUG)
+        self.assertEqual(json.loads(payload_record.input_data), input_data)
+
+        # The payloads are not logged by default, even at DEBUG level
+        with self.assertLogs("apps.endpoints.requests", level="DEBUG") as logs:
+            client.post("/api/v1/income_classifier/predict_batch", [input_data] * 2, format='json')
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].records, 2)
+
+    def test_ab_test(self):
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+
+        algorithm_1 = MLAlgorithm.objects.get(name="random forest")
+        algorithm_2 = MLAlgorithm.objects.get(name="extra trees")
+
+        response = client.post(
+            "/api/v1/abtests",
+            {
+                "title": "Random forest vs extra trees",
+                "created_by": "TR",
+                "parent_mlalgorithm_1": algorithm_1.id,
+                "parent_mlalgorithm_2": algorithm_2.id,
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        ab_test_id = response.data["id"]
+
+        # The requests created before the start of the test are not counted
+        ab_testing.record_predictions([
+            MLRequest(
+                parent_mlalgorithm=algorithm_1,
+                created_at=ABTest.objects.get(id=ab_test_id).created_at - datetime.timedelta(seconds=1)
+            )
+        ])
+
+        for _ in range(10):
+            response = client.post(
+                "/api/v1/income_classifier/predict?status=ab_testing", input_data, format='json'
+            )
+            self.assertEqual(response.status_code, 200)
+
+        # Only the first algorithm gets correct feedback
+        response = client.post(
+            "/api/v1/mlrequests/feedback",
+            [
+                {
+                    "request_id": ml_request.id,
+                    "feedback": ml_request.response if ml_request.parent_mlalgorithm_id == algorithm_1.id else ">50K"
+                }
+                for ml_request in MLRequest.objects.all()
+            ],
+            format="json"
+        )
+        self.assertEqual(response.data["updated"], 10)
+
+        # The live results come from the counters of the arms
+        with self.assertNumQueries(2):
+            response = client.get("/api/v1/abtests/{}/stats".format(ab_test_id))
+        arms = {arm["algorithm"]: arm for arm in response.data["arms"]}
+        self.assertEqual(sum(arm["requests"] for arm in arms.values()), 10)
+        self.assertEqual(sum(arm["labeled"] for arm in arms.values()), 10)
+        self.assertEqual(arms[algorithm_1.id]["accuracy"], 1.0)
+        self.assertEqual(arms[algorithm_2.id]["accuracy"], 0.0)
+        self.assertGreater(arms[algorithm_1.id]["mean_latency_ms"], 0.0)
+        self.assertEqual(response.data["best_algorithm"], algorithm_1.id)
+
+        # Ten labels are not enough for the sequential test
+        self.assertLess(response.data["p_value"], 1.0)
+        self.assertFalse(response.data["significant"])
+
+        with self.assertNumQueries(7):
+            response = client.post("/api/v1/stop_ab_test/{}".format(ab_test_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["message"], "AB Test finished.")
+
+        active_statuses = dict(
+            MLAlgorithmStatus.objects.filter(active=True).values_list("parent_mlalgorithm", "status")
+        )
+        self.assertEqual(active_statuses[algorithm_1.id], "production")
+        self.assertEqual(active_statuses[algorithm_2.id], "testing")
+
+        response = client.post("/api/v1/stop_ab_test/{}".format(ab_test_id))
+        self.assertEqual(response.data["message"], "AB Test already finished.")
+
+    @override_settings(ML_AB_TESTING={
+        "EARLY_STOPPING": True, "ALPHA": 0.01, "MIN_LABELED": 1, "MIXTURE_VARIANCE": 1.0
+    })
+    def test_ab_test_early_stopping(self):
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+
+        algorithm_1 = MLAlgorithm.objects.get(name="random forest")
+        algorithm_2 = MLAlgorithm.objects.get(name="extra trees")
+
+        response = client.post(
+            "/api/v1/abtests",
+            {
+                "title": "Random forest vs extra trees",
+                "created_by": "TR",
+                "parent_mlalgorithm_1": algorithm_1.id,
+                "parent_mlalgorithm_2": algorithm_2.id,
+            },
+            format='json'
+        )
+        ab_test_id = response.data["id"]
+
+        for _ in range(20):
+            client.post(
+                "/api/v1/income_classifier/predict?status=ab_testing", input_data, format='json'
+            )
+
+        # Only the first algorithm gets correct feedback, the test is stopped
+        # when the feedback arrives
+        body = "\n".join(
+            json.dumps({
+                "request_id": str(ml_request.request_id),
+                "feedback": ml_request.response if ml_request.parent_mlalgorithm_id == algorithm_1.id else ">50K"
+            })
+            for ml_request in MLRequest.objects.all()
+        )
+        client.post("/api/v1/mlrequests/feedback", body, content_type="application/x-ndjson")
+
+        response = client.get("/api/v1/abtests/{}".format(ab_test_id))
+        self.assertIsNotNone(response.data["ended_at"])
+        self.assertLessEqual(ABTest.objects.get(id=ab_test_id).p_value, 0.01)
+
+        active_statuses = dict(
+            MLAlgorithmStatus.objects.filter(active=True).values_list("parent_mlalgorithm", "status")
+        )
+        self.assertEqual(active_statuses[algorithm_1.id], "production")
+        self.assertEqual(active_statuses[algorithm_2.id], "testing")
+
+    def test_ab_test_sequential_p_value(self):
+        ab_test = ABTest(p_value=None)
+
+        def get_stats(correct_1, correct_2, labeled, **kwargs):
+            arms = [
+                ABTestArm(parent_mlalgorithm_id=1, labeled=labeled, correct=correct_1),
+                ABTestArm(parent_mlalgorithm_id=2, labeled=labeled, correct=correct_2),
+            ]
+            return ab_testing.get_stats(ab_test, arms, **kwargs)
+
+        # The p-value is the inverse of the mixture likelihood ratio
+        stats = get_stats(90, 80, 100, min_labeled=100, mixture_variance=0.01)
+        variance = 0.85 * 0.15 * 0.02
+        likelihood_ratio = math.sqrt(variance / (variance + 0.01)) * math.exp(
+            0.1 ** 2 * 0.01 / (2 * variance * (variance + 0.01))
+        )
+        self.assertAlmostEqual(stats["p_value"], 1.0 / likelihood_ratio)
+
+        # The difference is significant from a p-value of alpha
+        alpha = stats["p_value"]
+        self.assertTrue(get_stats(90, 80, 100, alpha=alpha, mixture_variance=0.01)["significant"])
+        self.assertFalse(get_stats(90, 80, 100, alpha=alpha * 0.999, mixture_variance=0.01)["significant"])
+        self.assertFalse(
+            get_stats(90, 80, 100, alpha=alpha, min_labeled=101, mixture_variance=0.01)["significant"]
+        )
+
+        # The lowest p-value of the looks is kept once the arms have enough labels
+        ab_test.p_value = alpha / 2
+        self.assertEqual(get_stats(80, 80, 100, min_labeled=100)["p_value"], alpha / 2)
+        self.assertEqual(get_stats(80, 80, 100, min_labeled=101)["p_value"], 1.0)
+
+        # Looking at equally accurate arms after every ten labels rarely
+        # finds a significant difference
+        random_state = random.Random(0)
+        significant = 0
+        for _ in range(100):
+            ab_test.p_value = None
+            correct_1 = correct_2 = 0
+            for labeled in range(10, 1001, 10):
+                correct_1 += sum(random_state.random() < 0.8 for _ in range(10))
+                correct_2 += sum(random_state.random() < 0.8 for _ in range(10))
+                stats = get_stats(correct_1, correct_2, labeled)
+                if stats["significant"]:
+                    significant += 1
+                    break
+                ab_test.p_value = stats["p_value"] if stats["enough_labeled"] else None
+        self.assertLessEqual(significant, 5)
+
+    def test_weighted_ab_test(self):
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+
+        algorithm_1 = MLAlgorithm.objects.get(name="random forest")
+        algorithm_2 = MLAlgorithm.objects.get(name="extra trees")
+
+        response = client.post(
+            "/api/v1/abtests",
+            {
+                "title": "Random forest only",
+                "created_by": "TR",
+                "arms": [{"parent_mlalgorithm": algorithm_1.id}],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = client.post(
+            "/api/v1/abtests",
+            {
+                "title": "Random forest vs extra trees",
+                "created_by": "TR",
+                "arms": [
+                    {"parent_mlalgorithm": algorithm_2.id, "weight": 0},
+                    {"parent_mlalgorithm": algorithm_1.id, "weight": 2},
+                ],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["parent_mlalgorithm_1"], algorithm_2.id)
+        self.assertEqual(len(response.data["arms"]), 2)
+
+        # The arm without weight gets no traffic
+        for _ in range(10):
+            response = client.post(
+                "/api/v1/income_classifier/predict?status=ab_testing", input_data, format='json'
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(MLRequest.objects.values_list("parent_mlalgorithm", flat=True)), {algorithm_1.id}
+        )
+
+        # A client keeps its algorithm
+        algorithm_ids = [
+            MLRequest.objects.get(request_id=client.post(
+                "/api/v1/income_classifier/predict?status=ab_testing", input_data, format='json',
+                HTTP_X_CLIENT_ID="client-{}".format(i % 5)
+            ).data["request_id"]).parent_mlalgorithm_id
+            for i in range(10)
+        ]
+        self.assertEqual(algorithm_ids[:5], algorithm_ids[5:])
+
+    @override_settings(ML_SHADOW={"ASYNC": False})
+    def test_shadow_inference(self):
+        # The views create the registry
+        from server.registry import registry
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+
+        algorithm_1 = MLAlgorithm.objects.get(name="random forest")
+        algorithm_2 = MLAlgorithm.objects.get(name="extra trees")
+
+        response = client.post(
+            "/api/v1/mlalgorithmstatuses",
+            {"status": "shadow", "created_by": "TR", "parent_mlalgorithm": algorithm_2.id},
+            format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+
+        # The production answer is returned, the shadow algorithm scores the
+        # same record in a paired request
+        response = client.post("/api/v1/income_classifier/predict", input_data, format="json")
+        self.assertEqual(response.status_code, 200)
+        production_request = MLRequest.objects.get(request_id=response.data["request_id"])
+        self.assertEqual(production_request.parent_mlalgorithm_id, algorithm_1.id)
+
+        shadow_request = MLRequest.objects.get(paired_request_id=production_request.request_id)
+        self.assertEqual(shadow_request.parent_mlalgorithm_id, algorithm_2.id)
+        self.assertEqual(shadow_request.input_data, production_request.input_data)
+
+        response = client.post(
+            "/api/v1/income_classifier/predict_batch", [input_data] * 3, format="json"
+        )
+        request_ids = {str(prediction["request_id"]) for prediction in response.data}
+        paired_ids = MLRequest.objects.filter(
+            parent_mlalgorithm=algorithm_2, paired_request_id__isnull=False
+        ).values_list("paired_request_id", flat=True)
+        self.assertTrue(request_ids <= {str(request_id) for request_id in paired_ids})
+        self.assertEqual(MLRequest.objects.count(), 8)
+
+        # Only the production requests are scored by the shadow algorithms
+        client.post("/api/v1/income_classifier/predict?status=shadow", input_data, format="json")
+        self.assertEqual(MLRequest.objects.count(), 9)
+
+        # Without shadow algorithms the pool is skipped
+        MLAlgorithmStatus.objects.filter(parent_mlalgorithm=algorithm_2).update(active=False)
+        registry.invalidate_routes()
+        client.post("/api/v1/income_classifier/predict", input_data, format="json")
+        self.assertEqual(MLRequest.objects.count(), 10)
+        self.assertEqual(registry.get_cached_algorithm_ids("income_classifier", "shadow"), ())
+
+    def test_list_pagination_and_projection(self):
+
+        client = APIClient()
+
+        algorithm = MLAlgorithm.objects.get(name="random forest")
+        MLRequest.objects.bulk_create([
+            MLRequest(
+                input_data="{}", full_response="{}", response="<=50K",
+                feedback="", parent_mlalgorithm=algorithm
+            )
+            for _ in range(5)
+        ])
+
+        # Keyset pages, the newest requests first
+        response = client.get("/api/v1/mlrequests?page_size=2&fields=id,response")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertEqual(set(response.data["results"][0].keys()), {"id", "response"})
+        ids = [r["id"] for r in response.data["results"]]
+
+        while response.data["next"] is not None:
+            response = client.get(response.data["next"])
+            ids += [r["id"] for r in response.data["results"]]
+        self.assertEqual(ids, sorted(MLRequest.objects.values_list("id", flat=True), reverse=True))
+
+        # Listing algorithms does not query the status of every algorithm
+        with self.assertNumQueries(1):
+            response = client.get("/api/v1/mlalgorithms?fields=id,name,current_status")
+        self.assertEqual(response.status_code, 200)
+        statuses = {r["name"]: r["current_status"] for r in response.data["results"]}
+        self.assertEqual(statuses["random forest"], "production")
+        self.assertFalse("code" in response.data["results"][0])
+
+        # Unknown or empty field lists are rejected instead of returning empty objects
+        for url in ("/api/v1/mlrequests?fields=,,", "/api/v1/mlalgorithms?fields=colour"):
+            response = client.get(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("fields", response.json())
+
+    def test_predict_stream_and_export(self):
+
+        client = APIClient()
+
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+
+        classifier_url = "/api/v1/income_classifier/predict_stream"
+
+        # NDJSON, the invalid line gets an error line in its place
+        body = "\n".join([json.dumps(input_data), "{not json", json.dumps(input_data)]) + "\n"
+        response = client.post(classifier_url, body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        predictions = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(predictions), 3)
+        self.assertEqual(predictions[0]["label"], "<=50K")
+        self.assertEqual(predictions[1]["status"], "Error")
+        self.assertEqual(predictions[2]["label"], "<=50K")
+
+        # CSV with a header row, the numbers are parsed
+        columns = list(input_data)
+        rows = [",".join(columns)] + [",".join(str(input_data[c]) for c in columns)] * 3
+        response = client.post(classifier_url, "\n".join(rows), content_type="text/csv")
+        self.assertEqual(response.status_code, 200)
+        predictions = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([p["label"] for p in predictions], ["<=50K"] * 3)
+
+        response = client.post(classifier_url, body, content_type="text/plain")
+        self.assertEqual(response.status_code, 415)
+
+        # The scored records are exported in the order of their ids
+        self.assertEqual(MLRequest.objects.count(), 5)
+        response = client.get("/api/v1/mlrequests/export?fields=id,request_id,response")
+        self.assertEqual(response.status_code, 200)
+        exported = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([r["id"] for r in exported], sorted(r["id"] for r in exported))
+        self.assertEqual(set(exported[0].keys()), {"id", "request_id", "response"})
+        self.assertEqual(exported[-1]["request_id"], predictions[-1]["request_id"])
+
+        response = client.get("/api/v1/mlrequests/export?output=csv&fields=id,response")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,response")
+        self.assertEqual(len(lines), 6)
+
+        # Unknown or empty field lists are rejected instead of exporting every column
+        for fields in ("colour", "id,colour", ",,"):
+            response = client.get("/api/v1/mlrequests/export?fields=" + fields)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("fields", response.json())
+
+    def test_bulk_feedback(self):
+        # The views create the registry
+        from apps.endpoints.views import MLRequestViewSet
+
+        client = APIClient()
+
+        endpoint = Endpoint.objects.create(name="feedback_endpoint", owner="TR")
+        algorithm = MLAlgorithm.objects.create(
+            name="algorithm", description="", code="", version="0.0.1",
+            owner="TR", parent_endpoint=endpoint
+        )
+        ml_requests = [
+            MLRequest.objects.create(
+                input_data="{}", full_response="{}", response="<=50K",
+                feedback="", parent_mlalgorithm=algorithm
+            )
+            for _ in range(3)
+        ]
+
+        feedback_url = "/api/v1/mlrequests/feedback"
+
+        # JSON, by request_id or by id, with invalid and unknown rows
+        rows = [
+            {"request_id": str(ml_requests[0].request_id), "feedback": ">50K"},
+            {"request_id": ml_requests[1].id, "feedback": "<=50K"},
+            {"request_id": "not a key", "feedback": ">50K"},
+            {"request_id": str(uuid.uuid4()), "feedback": ">50K"},
+            {"request_id": ml_requests[2].id, "feedback": 1},
+            {"request_id": ml_requests[0].id},
+        ]
+        # One select and one update in a savepoint, and the select of the
+        # arms of the running A/B tests
+        with self.assertNumQueries(5):
+            response = client.post(feedback_url, rows, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["updated"], 2)
+        self.assertEqual([e["index"] for e in response.data["errors"]], [2, 3, 4, 5])
+
+        # A row without feedback does not clear the label, only null does
+        feedbacks = MLRequest.objects.order_by("id").values_list("feedback", flat=True)
+        self.assertEqual(list(feedbacks)[-3:], [">50K", "<=50K", ""])
+
+        response = client.post(feedback_url, [{"request_id": ml_requests[1].id, "feedback": None}], format="json")
+        self.assertEqual(response.data["updated"], 1)
+        ml_requests[1].refresh_from_db()
+        self.assertIsNone(ml_requests[1].feedback)
+
+        # NDJSON in chunks, the invalid line gets an error
+        lines = [
+            json.dumps({"request_id": str(ml_request.request_id), "feedback": "<=50K"})
+            for ml_request in ml_requests
+        ]
+        body = "\n".join(lines[:1] + ["{not json"] + lines[1:]) + "\n"
+        with patch.object(MLRequestViewSet, "feedback_chunk_size", 2):
+            response = client.post(feedback_url, body, content_type="application/x-ndjson")
+        self.assertEqual(response.data["updated"], 3)
+        self.assertEqual([e["index"] for e in response.data["errors"]], [1])
+        self.assertEqual(
+            MLRequest.objects.filter(parent_mlalgorithm=algorithm, feedback="<=50K").count(), 3
+        )
+
+        response = client.post(feedback_url, {"request_id": 1}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def tearDown(self):
+        # The registry is created with the URLconf, after the test database
+        from server.registry import registry
+
+        # The database changes are rolled back after every test
+        registry.invalidate_routes()
+
+class LoggingTests(TestCase):
+    def test_structured_sampled_logging(self):
+        stream = io.StringIO()
+        handler = QueueStreamHandler(stream, max_queue_size=10)
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(SamplingFilter({"sampled": 0.0}))
+
+        loggers = [logging.getLogger("sampled.child"), logging.getLogger("kept")]
+        for logger in loggers:
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+
+        try:
+            loggers[0].info("Dropped by the sampling")
+            loggers[0].warning("Always kept %s", "warnings", extra={"algorithm_id": 1})
+            loggers[1].info("Kept")
+        finally:
+            for logger in loggers:
+                logger.removeHandler(handler)
+            # Writes the queued records
+            handler.close()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([line["message"] for line in lines], ["Always kept warnings", "Kept"])
+        self.assertEqual(lines[0]["level"], "WARNING")
+        self.assertEqual(lines[0]["logger"], "sampled.child")
+        self.assertEqual(lines[0]["algorithm_id"], 1)
+
+class DatabaseTests(TestCase):
+    def test_sqlite_pragmas_and_router(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+        # Without replicas the reads go to the default database
+        self.assertEqual(get_replica_alias(), "default")
+
+        router = PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_write(MLRequest), "default")
+        self.assertTrue(router.allow_migrate("default", "endpoints"))
+        self.assertFalse(router.allow_migrate("replica_0", "endpoints"))
+
+        endpoint = Endpoint.objects.create(name="endpoint", owner="TR")
+        self.assertTrue(router.allow_relation(
+            endpoint, Endpoint.objects.using("default").get(pk=endpoint.pk)
+        ))
+
+class MLRequestWriterTests(TransactionTestCase):
+    def setUp(self):
+        endpoint = Endpoint.objects.create(name="writer_classifier", owner="TR")
+        self.algorithm = MLAlgorithm.objects.create(
+            name="random forest", description="", code="", version="0.0.1",
+            owner="TR", parent_endpoint=endpoint
+        )
+
+    def create_requests(self, count):
+        return [
+            MLRequest(
+                input_data="{}", full_response="{}", response="<=50K",
+                feedback="", parent_mlalgorithm=self.algorithm
+            )
+            for _ in range(count)
+        ]
+
+    def test_flush_on_batch_size(self):
+        writer = MLRequestWriter(batch_size=5, flush_interval=60)
+        ml_requests = self.create_requests(5)
+        writer.save(ml_requests)
+
+        # The full batch is saved without waiting for the flush interval
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(MLRequest.objects.count(), 5)
+        self.assertEqual(
+            set(MLRequest.objects.values_list("request_id", flat=True)),
+            set(r.request_id for r in ml_requests)
+        )
+        writer.close()
+
+    def test_flush_on_close(self):
+        writer = MLRequestWriter(batch_size=100, flush_interval=60)
+        writer.save(self.create_requests(3))
+        writer.close(timeout=5)
+        self.assertEqual(MLRequest.objects.count(), 3)
+
+    def test_recycles_connection(self):
+        writer = MLRequestWriter(batch_size=2, flush_interval=60)
+        with patch("apps.endpoints.request_writer.close_old_connections") as close_old_connections:
+            writer.save(self.create_requests(2))
+            self.assertTrue(writer.flush(timeout=5))
+            writer.close(timeout=5)
+
+        # Checked before every write of the background thread
+        self.assertEqual(close_old_connections.call_count, 2)
+        self.assertEqual(MLRequest.objects.count(), 2)
+
+    def test_backpressure(self):
+        writer = MLRequestWriter(max_queue_size=1, enqueue_timeout=0)
+
+        # The queue is full, so the requests are saved in the calling thread
+        writer.thread = object()
+        writer.queue.put(None)
+        writer.save(self.create_requests(2))
+        self.assertEqual(MLRequest.objects.count(), 2)
+
+class ArchiveMLRequestsTests(TestCase):
+    def test_archive_mlrequests(self):
+        endpoint = Endpoint.objects.create(name="archive_classifier", owner="TR")
+        algorithm = MLAlgorithm.objects.create(
+            name="random forest", description="", code="", version="0.0.1",
+            owner="TR", parent_endpoint=endpoint
+        )
+        for feedback in ["<=50K", ">50K", ""]:
+            MLRequest.objects.create(
+                input_data="{}", full_response="{}", response="<=50K",
+                feedback=feedback, parent_mlalgorithm=algorithm
+            )
+
+        # Two requests are older than the retention period
+        old_date = timezone.now() - datetime.timedelta(days=100)
+        old_ids = list(MLRequest.objects.order_by("id").values_list("id", flat=True)[:2])
+        MLRequest.objects.filter(id__in=old_ids).update(created_at=old_date)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command("archive_mlrequests", days=90, output_dir=output_dir, stdout=open(os.devnull, "w"))
+
+            path = os.path.join(
+                output_dir, "mlrequests-{}.ndjson.gz".format(old_date.date().isoformat())
+            )
+            with gzip.open(path, "rt") as archive:
+                archived = [json.loads(line) for line in archive]
+
+        self.assertEqual(sorted(r["id"] for r in archived), old_ids)
+        self.assertEqual(MLRequest.objects.count(), 1)
+
+        aggregate = MLRequestDailyAggregate.objects.get(parent_mlalgorithm=algorithm)
+        self.assertEqual(aggregate.date, old_date.date())
+        self.assertEqual(
+            (2, 2, 1), (aggregate.requests, aggregate.labeled, aggregate.correct)
+        )
+
+    def test_archive_mlrequests_interrupted(self):
+        from apps.endpoints.management.commands.archive_mlrequests import Command
+
+        endpoint = Endpoint.objects.create(name="archive_classifier", owner="TR")
+        algorithm = MLAlgorithm.objects.create(
+            name="random forest", description="", code="", version="0.0.1",
+            owner="TR", parent_endpoint=endpoint
+        )
+        old_date = timezone.now() - datetime.timedelta(days=100)
+        for _ in range(2):
+            MLRequest.objects.create(
+                input_data="{}", full_response="{}", response="<=50K",
+                feedback="", parent_mlalgorithm=algorithm
+            )
+        old_ids = list(MLRequest.objects.order_by("id").values_list("id", flat=True))
+        MLRequest.objects.update(created_at=old_date)
+
+        def archive(output_dir):
+            call_command("archive_mlrequests", days=90, output_dir=output_dir, stdout=open(os.devnull, "w"))
+
+        def read_archives(output_dir):
+            archived = []
+            for name in sorted(os.listdir(output_dir)):
+                with gzip.open(os.path.join(output_dir, name), "rt") as archive:
+                    archived += [json.loads(line)["id"] for line in archive]
+            return archived
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            name = "mlrequests-{}.ndjson.gz".format(old_date.date().isoformat())
+
+            # A run stopped before the delete leaves a part file that is dropped
+            with patch.object(MLRequestDailyAggregate.objects, "select_for_update", side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    archive(output_dir)
+            self.assertEqual(os.listdir(output_dir), [name + ".part"])
+            self.assertEqual(MLRequest.objects.count(), 2)
+
+            # A run stopped after the delete leaves a part file that is renamed
+            with patch.object(Command, "publish_part", side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    archive(output_dir)
+            self.assertEqual(MLRequest.objects.count(), 0)
+
+            archive(output_dir)
+            self.assertEqual(os.listdir(output_dir), [name])
+            self.assertEqual(read_archives(output_dir), old_ids)
+
+            # Later requests of an archived day go to a numbered archive
+            MLRequest.objects.create(
+                input_data="{}", full_response="{}", response="<=50K",
+                feedback="", parent_mlalgorithm=algorithm
+            )
+            MLRequest.objects.update(created_at=old_date)
+            archive(output_dir)
+            self.assertEqual(sorted(os.listdir(output_dir)), [name.replace(".ndjson", ".1.ndjson"), name])
+            self.assertEqual(len(read_archives(output_dir)), 3)
+
+        aggregate = MLRequestDailyAggregate.objects.get(parent_mlalgorithm=algorithm)
+        self.assertEqual(aggregate.requests, 3)
@@ -8,7 +8,7 @@ from apps.endpoints.views import MLAlgorithmViewSet
 from apps.endpoints.views import MLAlgorithmStatusViewSet
 from apps.endpoints.views import MLRequestViewSet
 from apps.endpoints.views import ABTestViewSet, StopABTestView
-from .views import PredictView
+from .views import PredictView, PredictBatchView, PredictStreamView, ReadinessView, MetricsView, predict_async
 
 router = DefaultRouter(trailing_slash=False)
 router.register(r"endpoints", EndpointViewSet, basename="endpoints")
@@ -20,7 +20,12 @@ router.register(r"abtests", ABTestViewSet, basename="abtests")
 urlpatterns = [
     path("api/v1/", include(router.urls)),
     re_path(r"^api/v1/(?P<endpoint_name>.+)/predict$", PredictView.as_view(), name="predict"),
+    re_path(r"^api/v1/(?P<endpoint_name>.+)/predict_batch$", PredictBatchView.as_view(), name="predict_batch"),
+    re_path(r"^api/v1/(?P<endpoint_name>.+)/predict_stream$", PredictStreamView.as_view(), name="predict_stream"),
+    re_path(r"^api/v1/(?P<endpoint_name>.+)/predict_async$", predict_async, name="predict_async"),
     re_path(r"^api/v1/stop_ab_test/(?P<ab_test_id>.+)", StopABTestView.as_view(), name="stop_ab"),
+    path("api/v1/ready", ReadinessView.as_view(), name="ready"),
+    path("api/v1/metrics", MetricsView.as_view(), name="metrics"),
 ]
 
 '''
@@ -1,25 +1,93 @@
+import asyncio
 import json
-from numpy.random import rand
-import datetime
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from django.shortcuts import render
-from django.db import transaction
-from django.db.models import F
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db import close_old_connections, transaction
+from django.db.models import OuterRef, Q, Subquery
 from rest_framework import viewsets, mixins, exceptions, views, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from multiprocessing import parent_process
 # from .models import ABTest
 # from .models import MLAlgorithm, MLRequest, ABTest
 
-from server.wsgi import registry
+from server.registry import registry
 from apps.endpoints import models
 from apps.endpoints import serializers
+from apps.endpoints.pagination import IdCursorPagination
+from apps.endpoints.request_writer import get_request_writer
+from apps.endpoints import streaming
+from apps.endpoints import ab_testing
 from apps.ml.registry import MLRegistry
+from apps.ml.traffic import AliasTable
+from server.db import get_replica_alias
+from apps.ml.metrics import (
+    AB_TEST_SELECTIONS, ROUTING_ERRORS, SHADOW_DROPPED, SHADOW_PREDICTIONS, metrics,
+    observe_stage, time_stage
+)
+
+logger = logging.getLogger(__name__)
+
+# One record per prediction request, sampled by the LOGGING setting, and
+# the payloads at DEBUG level with the ML_LOG_PAYLOADS setting
+request_logger = logging.getLogger("apps.endpoints.requests")
+
+def log_request(endpoint_name, algorithm_id, ml_requests):
+    '''
+    Logs the prediction request with its MLRequests
+    '''
+    if not request_logger.isEnabledFor(logging.INFO):
+        return
+
+    fields = {
+        "endpoint": endpoint_name,
+        "algorithm_id": algorithm_id,
+        "records": len(ml_requests),
+        "errors": sum(1 for ml_request in ml_requests if ml_request.response == "error"),
+    }
+    if len(ml_requests) == 1:
+        fields["request_id"] = str(ml_requests[0].request_id)
+        fields["response"] = ml_requests[0].response
+    request_logger.info("Prediction request", extra=fields)
+
+    if getattr(settings, "ML_LOG_PAYLOADS", False) and request_logger.isEnabledFor(logging.DEBUG):
+        for ml_request in ml_requests:
+            request_logger.debug("Prediction payload", extra={
+                "request_id": str(ml_request.request_id),
+                "input_data": ml_request.input_data,
+                "full_response": ml_request.full_response,
+            })
+
+class ReplicaReadMixin:
+    '''
+    Lists the objects from a read replica, the other actions use the 
+    default database so that they see their own writes
+    '''
+    replica_actions = ("list", "export")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        if self.action in self.replica_actions:
+            queryset = queryset.using(get_replica_alias())
+
+        return queryset
 
 # Create your views here.
 class EndpointViewSet(
-    mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet
+    ReplicaReadMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, 
+    viewsets.GenericViewSet
 ):
     '''
     Create a view where user can retrieve an Endpoint object.
@@ -27,15 +95,43 @@ class EndpointViewSet(
     serializer_class = serializers.EndpointSerializer
     queryset = models.Endpoint.objects.all()
 
+class FieldsProjectionViewMixin:
+    '''
+    Loads only the model fields listed in the fields query parameter, so 
+    large fields are not read from the database when they are not requested
+    '''
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        fields = serializers.get_requested_fields(
+            self.request, self.get_serializer_class().Meta.fields
+        )
+        if fields is not None:
+            model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+            queryset = queryset.only(*((fields & model_fields) | {"id"}))
+
+        return queryset
+
 class MLAlgorithmViewSet(
-    mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet
+    ReplicaReadMixin, FieldsProjectionViewMixin, mixins.RetrieveModelMixin, 
+    mixins.ListModelMixin, viewsets.GenericViewSet
 ):
     '''
     Create a view where user can retrieve the MLAlgorithm used and view it
     '''
 
     serializer_class = serializers.MLAlgorithmSerializer
-    queryset = models.MLAlgorithm.objects.all()
+    pagination_class = IdCursorPagination
+
+    # The current status is annotated with a subquery instead of a query 
+    # per algorithm in the serializer
+    queryset = models.MLAlgorithm.objects.annotate(
+        current_status=Subquery(
+            models.MLAlgorithmStatus.objects.filter(
+                parent_mlalgorithm=OuterRef("pk")
+            ).order_by("-created_at").values("status")[:1]
+        )
+    )
 
 def deactivate_other_statuses(instance):
     old_statuses = models.MLAlgorithmStatus.objects.filter(
@@ -49,7 +145,7 @@ def deactivate_other_statuses(instance):
     models.MLAlgorithmStatus.objects.bulk_update(old_statuses, ['active'])
 
 class MLAlgorithmStatusViewSet(
-    mixins.RetrieveModelMixin, mixins.ListModelMixin,
+    ReplicaReadMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
     viewsets.GenericViewSet, mixins.CreateModelMixin
 ):
     serializer_class = serializers.MLAlgorithmStatusSerializer
@@ -64,22 +160,294 @@ class MLAlgorithmStatusViewSet(
         except Exception as e:
             raise exceptions.APIException(str(e))
 
+        # The routing depends on the active statuses
+        registry.invalidate_routes()
+
 class MLRequestViewSet(
-    mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet,
-    mixins.UpdateModelMixin
+    ReplicaReadMixin, FieldsProjectionViewMixin, mixins.RetrieveModelMixin, 
+    mixins.ListModelMixin, viewsets.GenericViewSet, mixins.UpdateModelMixin
 ):
     serializer_class = serializers.MLRequestSerializer
+    pagination_class = IdCursorPagination
     queryset = models.MLRequest.objects.all()
 
+    def perform_update(self, serializer):
+        previous_feedback = serializer.instance.feedback
+
+        with transaction.atomic():
+            ml_request = serializer.save()
+            ab_test_ids = ab_testing.record_feedback([(ml_request, previous_feedback)])
+
+        stop_significant_ab_tests(ab_test_ids)
+
+    def get_object(self):
+        '''
+        MLRequests can be retrieved by id or by the request_id returned 
+        with the prediction
+        '''
+        try:
+            request_id = uuid.UUID(self.kwargs[self.lookup_field])
+        except ValueError:
+            return super().get_object()
+
+        ml_request = get_object_or_404(self.get_queryset(), request_id=request_id)
+        self.check_object_permissions(self.request, ml_request)
+        return ml_request
+
+    # The number of requests read from the database at a time by export
+    export_chunk_size = 2000
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        '''
+        Streams the MLRequests in the order of their ids as NDJSON, or as 
+        CSV with ?output=csv, without loading them into memory.
+        Available at https://<server_ip/>api/v1/mlrequests/export
+
+        The fields query parameter selects the fields, and the requests are 
+        filtered with the optional parent_mlalgorithm, created_after and 
+        created_before query parameters.
+        '''
+        output = request.query_params.get("output", "ndjson")
+        if output not in ("ndjson", "csv"):
+            raise exceptions.ValidationError({"output": "Expected ndjson or csv."})
+
+        # Keep the order of the serializer fields
+        fields = self.get_serializer_class().Meta.fields
+        requested_fields = serializers.get_requested_fields(request, fields)
+        if requested_fields is not None:
+            fields = [field for field in fields if field in requested_fields]
+
+        queryset = self.get_queryset()
+
+        if request.query_params.get("parent_mlalgorithm"):
+            queryset = queryset.filter(
+                parent_mlalgorithm_id=request.query_params["parent_mlalgorithm"]
+            )
+
+        for parameter, lookup in (("created_after", "created_at__gte"), ("created_before", "created_at__lt")):
+            if request.query_params.get(parameter):
+                created_at = parse_datetime(request.query_params[parameter])
+                if created_at is None:
+                    raise exceptions.ValidationError({parameter: "Expected an ISO 8601 datetime."})
+                if timezone.is_naive(created_at):
+                    created_at = timezone.make_aware(created_at)
+                queryset = queryset.filter(**{lookup: created_at})
+
+        rows = queryset.order_by("id").values_list(*fields).iterator(
+            chunk_size=self.export_chunk_size
+        )
+
+        if output == "csv":
+            response = StreamingHttpResponse(
+                streaming.csv_lines(fields, rows), content_type=streaming.CSV_CONTENT_TYPE
+            )
+            response["Content-Disposition"] = 'attachment; filename="mlrequests.csv"'
+            return response
+
+        return StreamingHttpResponse(
+            streaming.ndjson_lines(dict(zip(fields, row)) for row in rows),
+            content_type=streaming.NDJSON_CONTENT_TYPE
+        )
+
+    # The number of feedback rows applied at a time by feedback
+    feedback_chunk_size = 1000
+
+    feedback_readers = {
+        streaming.NDJSON_CONTENT_TYPE: streaming.read_ndjson_records,
+        "application/ndjson": streaming.read_ndjson_records,
+        "application/jsonl": streaming.read_ndjson_records,
+    }
+
+    @action(detail=False, methods=["post"])
+    def feedback(self, request):
+        '''
+        Sets the feedback of many MLRequests at once. The body is a JSON list
+        or an NDJSON (application/x-ndjson) stream of objects like 
+        {"request_id": "<request_id or id>", "feedback": ">50K"}.
+        Available at https://<server_ip/>api/v1/mlrequests/feedback
+
+        The rows are applied in chunks of feedback_chunk_size rows with one 
+        query and one bulk_update per chunk. Returns the number of updated 
+        requests and an error with the index of every row that was not 
+        applied, for example a request that is not saved yet.
+        '''
+        read_records = self.feedback_readers.get(request.content_type.split(";")[0].strip())
+        if read_records is not None:
+            # The stream is None when the body is empty
+            rows = read_records(request.stream or [])
+        else:
+            if not isinstance(request.data, list):
+                raise exceptions.ValidationError("Expected a list of feedback objects.")
+            rows = (
+                (row, None) if isinstance(row, dict) else (None, "Expected a JSON object.")
+                for row in request.data
+            )
+
+        updated = 0
+        errors = []
+        ab_test_ids = set()
+        for chunk_number, chunk in enumerate(streaming.chunked(rows, self.feedback_chunk_size)):
+            offset = chunk_number * self.feedback_chunk_size
+            feedbacks, chunk_errors = parse_feedback_rows(chunk, offset)
+            errors.extend(chunk_errors)
+            updated += self.apply_feedback(feedbacks, errors, ab_test_ids)
+
+        stop_significant_ab_tests(ab_test_ids)
+
+        errors.sort(key=lambda error: error["index"])
+        return Response({"updated": updated, "errors": errors})
+
+    def apply_feedback(self, feedbacks, errors, ab_test_ids):
+        '''
+        Saves the feedback of the rows of a chunk and counts it in the A/B 
+        tests, feedbacks is a list of (index, lookup, key, feedback) tuples. 
+        Returns the number of updated requests and adds the ids of the 
+        A/B tests with new feedback to ab_test_ids.
+        '''
+        if not feedbacks:
+            return 0
+
+        keys = {lookup: set() for lookup in ("id", "request_id")}
+        for index, lookup, key, feedback in feedbacks:
+            keys[lookup].add(key)
+
+        # Read from the primary database, a replica may lag behind it
+        ml_requests = models.MLRequest.objects.using("default").filter(
+            Q(id__in=keys["id"]) | Q(request_id__in=keys["request_id"])
+        ).only("id", "request_id", "feedback", "response", "created_at", "parent_mlalgorithm_id")
+
+        by_key = {}
+        for ml_request in ml_requests:
+            by_key[("id", ml_request.id)] = ml_request
+            by_key[("request_id", ml_request.request_id)] = ml_request
+
+        # The last feedback of a request in the chunk wins
+        changed = {}
+        previous_feedbacks = {}
+        for index, lookup, key, feedback in feedbacks:
+            ml_request = by_key.get((lookup, key))
+            if ml_request is None:
+                errors.append({"index": index, "message": "MLRequest not found."})
+                continue
+            previous_feedbacks.setdefault(ml_request.id, ml_request.feedback)
+            ml_request.feedback = feedback
+            changed[ml_request.id] = ml_request
+
+        with transaction.atomic(using="default"):
+            models.MLRequest.objects.bulk_update(changed.values(), ["feedback"])
+            ab_test_ids.update(ab_testing.record_feedback([
+                (ml_request, previous_feedbacks[ml_request.id])
+                for ml_request in changed.values()
+            ]))
+
+        return len(changed)
+
+def parse_feedback_rows(rows, offset=0):
+    '''
+    Validates the (row, error message) pairs of the bulk feedback.
+
+    Returns a list of (index, lookup, key, feedback) tuples, where lookup 
+    is "request_id" for a UUID and "id" for an integer key, and a list of 
+    the errors
+    '''
+    max_length = models.MLRequest._meta.get_field("feedback").max_length
+
+    feedbacks = []
+    errors = []
+    for index, (row, error) in enumerate(rows, start=offset):
+        if error is None:
+            key = row.get("request_id")
+            feedback = row.get("feedback")
+
+            if isinstance(key, str) and key.isdigit():
+                key = int(key)
+
+            if isinstance(key, int) and not isinstance(key, bool):
+                lookup = "id"
+            else:
+                lookup = "request_id"
+                try:
+                    key = uuid.UUID(key)
+                except (TypeError, ValueError, AttributeError):
+                    error = "Expected a request_id or an id."
+
+            # Only an explicit null clears the label
+            if error is None and "feedback" not in row:
+                error = "Expected a feedback, null clears it."
+            elif error is None and feedback is not None and not isinstance(feedback, str):
+                error = "Expected a string or null feedback."
+            elif error is None and feedback is not None and len(feedback) > max_length:
+                error = "The feedback is longer than {} characters.".format(max_length)
+
+        if error is not None:
+            errors.append({"index": index, "message": error})
+            continue
+
+        feedbacks.append((index, lookup, key, feedback))
+
+    return feedbacks, errors
+
+def choose_algorithm(algorithm_ids, algorithm_status, split=None, client_key=None):
+    '''
+    Chooses one of the algorithms routed for the request. The algorithms of
+    an A/B test are chosen with the weighted split of the route, at random
+    or by the client key so that a client keeps its algorithm.
+
+    Returns the id of the chosen algorithm and None, or None and an error 
+    message
+    '''
+    
+    # Check to see if there are algorithms
+    if len(algorithm_ids) == 0:
+        return None, "ML algorithm is not available."
+    
+    # Check to see if there are more than one algorithms
+    if len(algorithm_ids) != 1 and algorithm_status != "ab_testing":
+        return None, "ML algorithm selection is ambiguous. Please specify algorithm version."
+
+    if algorithm_status != "ab_testing":
+        return algorithm_ids[0], None
+
+    # The split may be from an older route
+    if split is None or split.items != tuple(algorithm_ids):
+        split = AliasTable(algorithm_ids)
+
+    if client_key:
+        algorithm_id = split.choose_sticky(client_key)
+    else:
+        algorithm_id = split.choose_random()
+    AB_TEST_SELECTIONS.inc(str(algorithm_id))
+
+    return algorithm_id, None
+
 class PredictView(views.APIView):
     '''
     Only accepts POST requests.
     Available at https://<server_ip/>api/v1/<endpoint_name>/predict
 
     Based on the endpoint name, status, and version, there is a routing 
-    of the request to correct ML algorithm
+    of the request to correct ML algorithm. The requests of an A/B test 
+    with the same X-Client-Id header are routed to the same algorithm.
+
+    The durations of the routing, the persistence and the serialization of
+    the request are observed in the stage histograms of the algorithm.
     '''
-    def post(self, request, endpoint_name, format=None):
+
+    # The algorithm and the status of the request, set by select_algorithm
+    algorithm_id = None
+    algorithm_status = None
+
+    def select_algorithm(self, endpoint_name):
+        '''
+        Selects the MLAlgorithm for the request based on the endpoint name 
+        and the status and version query parameters.
+
+        Returns the id of the selected algorithm and None, or None and an 
+        error Response
+        '''
+
+        started_at = time.perf_counter()
 
         # Getting the status
         algorithm_status = self.request.query_params.get("status", "production")
@@ -87,69 +455,383 @@ class PredictView(views.APIView):
         # Getting the version
         algorithm_version = self.request.query_params.get("version")
 
-        # Getting the id
-        algorithm_id = self.request.query_params.get("id")
+        # Getting the ids of the matching algorithms from the routing table
+        algorithm_ids = registry.get_algorithm_ids(
+            endpoint_name, algorithm_status, algorithm_version
+        )
+        
+        algorithm_id, error_message = choose_algorithm(
+            algorithm_ids, algorithm_status,
+            split=registry.get_split(endpoint_name, algorithm_status, algorithm_version),
+            client_key=self.request.headers.get("X-Client-Id")
+        )
+        if error_message is not None:
+            ROUTING_ERRORS.inc()
+            return None, Response(
+                {"status": "Error", "message": error_message},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        observe_stage(algorithm_id, "routing", time.perf_counter() - started_at)
+        self.algorithm_id = algorithm_id
+        self.algorithm_status = algorithm_status
+
+        return algorithm_id, None
 
-        algs = models.MLAlgorithm.objects.filter(
-            parent_endpoint__name=endpoint_name,
-            status__status=algorithm_status,
-            status__active=True 
+    @staticmethod
+    def create_ml_request(algorithm_id, input_data, prediction, latency=None):
+        '''
+        Returns the unsaved MLRequest of the prediction, the request id is 
+        allocated before the request is written in the background. The 
+        inference duration is kept for the A/B test counters. Also used by
+        predict_async, so that both views save the same rows.
+        '''
+        ml_request = models.MLRequest(
+            input_data=json.dumps(input_data),
+            full_response=prediction,
+            response=prediction["label"] if "label" in prediction else "error",
+            feedback="",
+            parent_mlalgorithm_id=algorithm_id
         )
+        ml_request.latency = latency
+        return ml_request
 
-        # Get the algorithm that matches the version
-        if algorithm_version is not None:
-            algs = algs.filter(version=algorithm_version)
-        
-        # Check to see if there are algorithms
-        if len(algs) == 0:
+    def save_ml_requests(self, algorithm_id, ml_requests):
+        with time_stage(algorithm_id, "persistence"):
+            get_request_writer().save(ml_requests)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        # Render the prediction here to observe the serialization
+        if self.algorithm_id is not None and isinstance(response, Response):
+            with time_stage(self.algorithm_id, "serialization"):
+                response.render()
+
+        return response
+
+    def post(self, request, endpoint_name, format=None):
+
+        algorithm_id, error_response = self.select_algorithm(endpoint_name)
+        if error_response is not None:
+            return error_response
+
+        # Get the prediction of the given data
+        started_at = time.perf_counter()
+        prediction = registry.compute_prediction(algorithm_id, request.data)
+        latency = time.perf_counter() - started_at
+
+        # Save the request to apply ML algorithm
+        ml_request = self.create_ml_request(algorithm_id, request.data, prediction, latency)
+        self.save_ml_requests(algorithm_id, [ml_request])
+        log_request(endpoint_name, algorithm_id, [ml_request])
+        submit_shadow(endpoint_name, self.algorithm_status, [request.data], [ml_request])
+
+        return Response(dict(prediction, request_id=ml_request.request_id))
+
+class PredictBatchView(PredictView):
+    '''
+    Only accepts POST requests with a JSON array of records.
+    Available at https://<server_ip/>api/v1/<endpoint_name>/predict_batch
+
+    The whole batch is routed to one ML algorithm and is computed with one 
+    DataFrame and one predict_proba call. The requests are saved with 
+    bulk inserts.
+    '''
+
+    # The maximum number of records accepted in one request
+    max_batch_size = 10000
+
+    def post(self, request, endpoint_name, format=None):
+
+        input_data = request.data
+
+        # Check to see if the data is a non-empty list of records
+        if (
+            not isinstance(input_data, list) or len(input_data) == 0
+            or not all(isinstance(record, dict) for record in input_data)
+        ):
             return Response(
                 {
                     "status":"Error",
-                    "message":"ML algorithm is not available."
+                    "message":"Expected a non-empty JSON array of records."
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Check to see if there are more than one algorithms
-        if len(algs) != 1 and algorithm_status != "ab_testing":
+
+        if len(input_data) > self.max_batch_size:
             return Response(
-                {"status": "Error", "message": "ML algorithm selection is ambiguous. Please specify algorithm version."},
-                status=status.HTTP_400_BAD_REQUEST,
+                {
+                    "status":"Error",
+                    "message":"Batch size exceeds the limit of {} records.".format(self.max_batch_size)
+                },
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        alg_index = 0
+        algorithm_id, error_response = self.select_algorithm(endpoint_name)
+        if error_response is not None:
+            return error_response
 
-        if algorithm_status == "ab_testing":
-            alg_index = 0 if rand() < 0.5 else 1
+        # Get the predictions for all the records at once
+        started_at = time.perf_counter()
+        predictions = registry.compute_batch_prediction(algorithm_id, input_data)
+        latency = (time.perf_counter() - started_at) / len(input_data)
 
-        print(f"This is {algs[alg_index].id}")
-        # Extracting the algorithm
-        algorithm_object = registry.endpoints[algs[alg_index].id]
+        # Save all the requests with bulk inserts
+        ml_requests = [
+            self.create_ml_request(algorithm_id, record, prediction, latency)
+            for record, prediction in zip(input_data, predictions)
+        ]
+        self.save_ml_requests(algorithm_id, ml_requests)
+        log_request(endpoint_name, algorithm_id, ml_requests)
+        submit_shadow(endpoint_name, self.algorithm_status, input_data, ml_requests)
 
-        # Get the prediction of the given data
-        print(request.data)
-        prediction = algorithm_object.compute_prediction(request.data)
+        return Response([
+            dict(prediction, request_id=ml_request.request_id)
+            for ml_request, prediction in zip(ml_requests, predictions)
+        ])
 
-        # Extracting the label from prediction object
-        label = prediction["label"] if "label" in prediction else "error"
+class PredictStreamView(PredictView):
+    '''
+    Only accepts POST requests with an NDJSON (application/x-ndjson) or CSV 
+    (text/csv, with a header row) body.
+    Available at https://<server_ip/>api/v1/<endpoint_name>/predict_stream
 
-        # Save the request to apply ML algorithm
-        ml_request = models.MLRequest(
-            input_data=json.dumps(request.data),
-            full_response=prediction,
-            response=label,
-            feedback="",
-            parent_mlalgorithm=algs[alg_index]
+    The body is read line by line and the records are scored in chunks of 
+    chunk_size records with one compute_batch_prediction call per chunk. 
+    The predictions are streamed back as NDJSON, one line per record in 
+    the order of the records, and the requests are saved chunk by chunk, 
+    so neither the server nor the client holds the whole stream in memory.
+    A record that cannot be parsed gets an error line.
+    '''
+
+    # The number of records scored at a time
+    chunk_size = 1000
+
+    readers = {
+        streaming.NDJSON_CONTENT_TYPE: streaming.read_ndjson_records,
+        "application/ndjson": streaming.read_ndjson_records,
+        "application/jsonl": streaming.read_ndjson_records,
+        streaming.CSV_CONTENT_TYPE: streaming.read_csv_records,
+    }
+
+    def post(self, request, endpoint_name, format=None):
+
+        read_records = self.readers.get(request.content_type.split(";")[0].strip())
+        if read_records is None:
+            return Response(
+                {
+                    "status":"Error",
+                    "message":"Expected an NDJSON or CSV body."
+                },
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+
+        algorithm_id, error_response = self.select_algorithm(endpoint_name)
+        if error_response is not None:
+            return error_response
+
+        # The stream is None when the body is empty
+        records = read_records(request.stream or [])
+
+        return StreamingHttpResponse(
+            self.score(endpoint_name, algorithm_id, records),
+            content_type=streaming.NDJSON_CONTENT_TYPE
         )
-        ml_request.save()
 
-        prediction["request_id"] = ml_request.id
+    def score(self, endpoint_name, algorithm_id, records):
+        for chunk in streaming.chunked(records, self.chunk_size):
+            valid_records = [record for record, error in chunk if error is None]
+            started_at = time.perf_counter()
+            predictions = iter(
+                registry.compute_batch_prediction(algorithm_id, valid_records)
+                if valid_records else []
+            )
+            latency = (time.perf_counter() - started_at) / max(len(valid_records), 1)
+
+            ml_requests = []
+            results = []
+            for record, error in chunk:
+                if error is not None:
+                    results.append({"status": "Error", "message": error})
+                    continue
+
+                prediction = next(predictions)
+                ml_request = self.create_ml_request(algorithm_id, record, prediction, latency)
+                ml_requests.append(ml_request)
+                results.append(dict(prediction, request_id=ml_request.request_id))
+
+            self.save_ml_requests(algorithm_id, ml_requests)
+            log_request(endpoint_name, algorithm_id, ml_requests)
+            submit_shadow(endpoint_name, self.algorithm_status, valid_records, ml_requests)
+
+            yield "".join(streaming.ndjson_lines(results))
+
+# Bounded thread pool that scores the production requests with the shadow
+# algorithms, and the number of requests that may wait for it
+shadow_executor = ThreadPoolExecutor(
+    max_workers=settings.ML_SHADOW.get("MAX_WORKERS", 2),
+    thread_name_prefix="shadow-inference"
+)
+shadow_slots = threading.BoundedSemaphore(settings.ML_SHADOW.get("MAX_PENDING", 1000))
+
+def submit_shadow(endpoint_name, algorithm_status, records, ml_requests, asynchronous=None):
+    '''
+    Scores the records of production requests with the shadow algorithms 
+    of the endpoint, in the shadow pool unless ML_SHADOW disables ASYNC. 
+    The requests are dropped when too many are waiting for the pool.
+    '''
+    if algorithm_status != "production" or not ml_requests:
+        return
+
+    # Skip the pool when the endpoint is known to have no shadow algorithms,
+    # the route is loaded by the pool otherwise
+    if registry.get_cached_algorithm_ids(endpoint_name, "shadow") == ():
+        return
 
-        return Response(prediction)
+    if asynchronous is None:
+        asynchronous = settings.ML_SHADOW.get("ASYNC", True)
+
+    if not asynchronous:
+        score_shadow(endpoint_name, records, ml_requests)
+        return
+
+    if not shadow_slots.acquire(blocking=False):
+        SHADOW_DROPPED.inc()
+        return
+
+    shadow_executor.submit(score_shadow_in_pool, endpoint_name, records, ml_requests)
+
+def score_shadow_in_pool(endpoint_name, records, ml_requests):
+    # The pool threads keep their connections between the tasks
+    close_old_connections()
+    try:
+        score_shadow(endpoint_name, records, ml_requests)
+    finally:
+        shadow_slots.release()
+
+def score_shadow(endpoint_name, records, ml_requests):
+    '''
+    Computes the predictions of the shadow algorithms for the records of
+    the production requests and saves them with the request_id of the 
+    production request as their paired_request_id
+    '''
+    for algorithm_id in registry.get_algorithm_ids(endpoint_name, "shadow"):
+        try:
+            started_at = time.perf_counter()
+            if len(records) == 1:
+                predictions = [registry.compute_prediction(algorithm_id, records[0])]
+            else:
+                predictions = registry.compute_batch_prediction(algorithm_id, records)
+            latency = (time.perf_counter() - started_at) / len(records)
+
+            shadow_requests = []
+            for paired_request, prediction in zip(ml_requests, predictions):
+                shadow_request = models.MLRequest(
+                    input_data=paired_request.input_data,
+                    full_response=prediction,
+                    response=prediction["label"] if "label" in prediction else "error",
+                    feedback="",
+                    parent_mlalgorithm_id=algorithm_id,
+                    paired_request_id=paired_request.request_id
+                )
+                shadow_request.latency = latency
+                shadow_requests.append(shadow_request)
+
+            get_request_writer().save(shadow_requests)
+            SHADOW_PREDICTIONS.inc(str(algorithm_id), "ok", amount=len(records))
+        except Exception:
+            SHADOW_PREDICTIONS.inc(str(algorithm_id), "error", amount=len(records))
+            logger.exception("Shadow algorithm %s failed", algorithm_id)
+
+# Bounded thread pool that runs the inference of the async predict view
+inference_executor = ThreadPoolExecutor(
+    max_workers=settings.ML_ASYNC_PREDICT.get("MAX_WORKERS", 4),
+    thread_name_prefix="inference"
+)
+
+async def predict_async(request, endpoint_name):
+    '''
+    Only accepts POST requests.
+    Available at https://<server_ip/>api/v1/<endpoint_name>/predict_async
+
+    The async version of PredictView for the ASGI application. The event 
+    loop never blocks: the inference runs in a bounded thread pool, the 
+    routing comes from the registry and the request is queued to the
+    background writer. The database is only used on a routing cache miss 
+    or when the writer queue is full.
+    '''
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    try:
+        input_data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse(
+            {"status": "Error", "message": "Invalid JSON."}, status=400
+        )
+
+    started_at = time.perf_counter()
+
+    # Getting the status and version
+    algorithm_status = request.GET.get("status", "production")
+    algorithm_version = request.GET.get("version")
+
+    # Getting the ids of the matching algorithms from the routing table
+    algorithm_ids = registry.get_cached_algorithm_ids(
+        endpoint_name, algorithm_status, algorithm_version
+    )
+    if algorithm_ids is None:
+        algorithm_ids = await sync_to_async(registry.get_algorithm_ids)(
+            endpoint_name, algorithm_status, algorithm_version
+        )
+
+    algorithm_id, error_message = choose_algorithm(
+        algorithm_ids, algorithm_status,
+        split=registry.get_split(endpoint_name, algorithm_status, algorithm_version),
+        client_key=request.headers.get("X-Client-Id")
+    )
+    if error_message is not None:
+        ROUTING_ERRORS.inc()
+        return JsonResponse(
+            {"status": "Error", "message": error_message}, status=400
+        )
+
+    observe_stage(algorithm_id, "routing", time.perf_counter() - started_at)
+
+    # Get the prediction of the given data from the prediction cache, the
+    # micro-batcher if it is configured, otherwise in the thread pool. The
+    # future is shielded, a disconnected client must not cancel the 
+    # future shared with the micro-batcher.
+    started_at = time.perf_counter()
+    prediction = await asyncio.shield(asyncio.wrap_future(
+        registry.submit_prediction(algorithm_id, input_data, inference_executor)
+    ))
+    latency = time.perf_counter() - started_at
+
+    # Save the request to apply ML algorithm without waiting for the insert
+    ml_request = PredictView.create_ml_request(algorithm_id, input_data, prediction, latency)
+    started_at = time.perf_counter()
+    writer = get_request_writer()
+    remaining = writer.save_nowait([ml_request])
+    if remaining:
+        await sync_to_async(writer.save)(remaining)
+    observe_stage(algorithm_id, "persistence", time.perf_counter() - started_at)
+    log_request(endpoint_name, algorithm_id, [ml_request])
+
+    # Always in the pool, the event loop cannot query the database
+    submit_shadow(endpoint_name, algorithm_status, [input_data], [ml_request], asynchronous=True)
+
+    with time_stage(algorithm_id, "serialization"):
+        return JsonResponse(dict(prediction, request_id=ml_request.request_id))
+
+# Same as the csrf_exempt decorator, which does not wrap async views before
+# Django 5.0
+predict_async.csrf_exempt = True
 
 class ABTestViewSet(
-    mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet,
-    mixins.CreateModelMixin, mixins.UpdateModelMixin
+    ReplicaReadMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, 
+    viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.UpdateModelMixin
 ):
     # Unpacking request into JSON format
     serializer_class = serializers.ABTestSerializer
@@ -159,43 +841,122 @@ class ABTestViewSet(
 
     def perform_create(self, serializer):
         '''
-        Creates an ABTest object and two new statuses ("ab_testing") 
-        for ML Algorithms
+        Creates an ABTest object with its arms and new statuses 
+        ("ab_testing") for the ML Algorithms of the arms
         '''
         try:
             with transaction.atomic():
                 instance = serializer.save()
 
-                # Update status for first algorithm
-                status_1 = models.MLAlgorithmStatus(
-                    status='ab_testing',
-                    created_by=instance.created_by,
-                    parent_mlalgorithm=instance.parent_mlalgorithm_1,
-                    active=True
-                )
-
-                status_1.save()
-                deactivate_other_statuses(status_1)
-                
-                # Update status for second algorithm
-                status_2 = models.MLAlgorithmStatus(
-                    status='ab_testing',
-                    created_by=instance.created_by,
-                    parent_mlalgorithm=instance.parent_mlalgorithm_2,
-                    active=True
-                )
+                # Update the status of every algorithm
+                for arm in instance.arms.order_by("id").select_related("parent_mlalgorithm"):
+                    ab_testing_status = models.MLAlgorithmStatus(
+                        status='ab_testing',
+                        created_by=instance.created_by,
+                        parent_mlalgorithm=arm.parent_mlalgorithm,
+                        active=True
+                    )
 
-                status_2.save()
-                deactivate_other_statuses(status_2)
+                    ab_testing_status.save()
+                    deactivate_other_statuses(ab_testing_status)
         
         except Exception as e:
             raise exceptions.APIException(str(e))
 
+        # The routing depends on the active statuses
+        registry.invalidate_routes()
+
+    @action(detail=True, methods=["get"])
+    def stats(self, request, pk=None):
+        '''
+        Returns the live results of the A/B test from the counters of its 
+        arms: the counts, the accuracy over the labeled requests and the 
+        mean inference latency of every algorithm, and the sequential test 
+        of the best algorithm against the second best.
+        Available at https://<server_ip/>api/v1/abtests/<id>/stats
+        '''
+        return Response(get_ab_test_stats(self.get_object()))
+
+def get_ab_test_stats(ab_test):
+    '''
+    Returns the results of the A/B test from the counters of its arms
+    '''
+    config = getattr(settings, "ML_AB_TESTING", {})
+    return ab_testing.get_stats(
+        ab_test, ab_test.arms.order_by("id"),
+        alpha=config.get("ALPHA", 0.05), min_labeled=config.get("MIN_LABELED", 100),
+        mixture_variance=config.get("MIXTURE_VARIANCE", 0.0025)
+    )
+
+def stop_ab_test(ab_test, stats):
+    '''
+    Stops the A/B test, the algorithm of the most accurate arm is set as
+    production while the other algorithms are saved as testing. Returns
+    the summary of the test.
+    '''
+    summary = ", ".join(
+        "Algorithm #{} accuracy: {}".format(number, arm["accuracy"])
+        for number, arm in enumerate(stats["arms"], start=1)
+    )
+    algorithm_ids = [arm["algorithm"] for arm in stats["arms"]]
+
+    with transaction.atomic():
+        # Deactivate the ab_testing statuses of all the algorithms
+        models.MLAlgorithmStatus.objects.filter(
+            parent_mlalgorithm__in=algorithm_ids, active=True
+        ).update(active=False)
+
+        # The selected algorithm goes to production and the other ones to 
+        # testing
+        models.MLAlgorithmStatus.objects.bulk_create([
+            models.MLAlgorithmStatus(
+                status="production" if algorithm_id == stats["best_algorithm"] else "testing",
+                created_by=ab_test.created_by,
+                parent_mlalgorithm_id=algorithm_id,
+                active=True
+            )
+            for algorithm_id in algorithm_ids
+        ])
+
+        ab_test.ended_at = timezone.now()
+        ab_test.summary = summary
+        ab_test.save()
+
+    # The routing depends on the active statuses
+    registry.invalidate_routes()
+
+    return summary
+
+def stop_significant_ab_tests(ab_test_ids):
+    '''
+    Records the p-values of the running A/B tests with new feedback, and
+    stops those whose best arm is significantly better than the second 
+    best, if early stopping is enabled
+    '''
+    if not ab_test_ids:
+        return
+
+    early_stopping = getattr(settings, "ML_AB_TESTING", {}).get("EARLY_STOPPING")
+    for ab_test in models.ABTest.objects.filter(id__in=ab_test_ids, ended_at__isnull=True):
+        stats = get_ab_test_stats(ab_test)
+        ab_testing.record_p_value(ab_test, stats)
+        if early_stopping and stats["significant"]:
+            summary = stop_ab_test(ab_test, stats)
+            logger.info(
+                "Stopped A/B test %s early: %s", ab_test.id, summary,
+                extra={
+                    "ab_test_id": ab_test.id,
+                    "algorithm_id": stats["best_algorithm"],
+                    "p_value": stats["p_value"],
+                }
+            )
+
 class StopABTestView(views.APIView):
     '''
-    Stops the A/B test, computes the accuracy of the two algorithms, and 
-    compares the two algorithms. The algorithm with the higher accuracy
-    is set as production while the other algorithm is saved as testing 
+    Stops the A/B test, reads the accuracy of the algorithms from the 
+    counters of the arms, and compares the algorithms. The algorithm with 
+    the higher accuracy is set as production while the other algorithm is 
+    saved as testing 
     '''
     def post(self, request, ab_test_id, format=None):
         
@@ -203,79 +964,27 @@ class StopABTestView(views.APIView):
             # Get the ABTest object that matches the id
             ab_test = models.ABTest.objects.get(pk=ab_test_id)
 
-            if ab_test.ended_at is None:
+            if ab_test.ended_at is not None:
                 return Response({
                     "message":"AB Test already finished."
                 })
-            
-            date_now = datetime.datetime.now()
-
-            # Algorithm 1
-            
-            all_responses_1 = models.MLRequest.objects.filter(
-                parent_algorithm=ab_test.parent_mlalgorithm_1,
-                created_at__gt=ab_test.created_at,
-                created_at__lt=date_now,
-            ).count()
-
-            correct_responses_1 = models.MLRequest.objects.filter(
-                parent_algorithm=ab_test.parent_mlalgorithm_1,
-                created_at__gt=ab_test.created_at,
-                created_at__lt=date_now,
-                response=F('feedback')
-            ).count()
-
-            accuracy_1 = correct_responses_1 / float(all_responses_1)
-
-            print(all_responses_1, correct_responses_1, accuracy_1)
-
-            # Algorithm 2
-
-            all_responses_2 = models.MLRequest.objects.filter(
-                parent_mlalgorithm=ab_test.parent_mlalgorithm_2, 
-                created_at__gt = ab_test.created_at, 
-                created_at__lt = date_now
-            ).count()
-
-            correct_responses_2 = models.MLRequest.objects.filter(
-                parent_mlalgorithm=ab_test.parent_mlalgorithm_2, 
-                created_at__gt = ab_test.created_at, 
-                created_at__lt = date_now, 
-                response=F('feedback')
-            ).count()
-
-            accuracy_2 = correct_responses_2 / float(all_responses_2)
-            
-            print(all_responses_2, correct_responses_2, accuracy_2)
-
-            # Select the algorithm with higher accuracy
-            
-            alg_id_1, alg_id_2 = ab_test.parent_mlalgorithm_1, ab_test.parent_mlalgorithm_2
-            
-            # Swap
-            if accuracy_1 < accuracy_2:
-                alg_id_1, alg_id_2 = alg_id_2, alg_id_1
-            
-            # Update status of selected algorithm
-            status_1 = models.MLAlgorithmStatus(status = "production",
-                            created_by=ab_test.created_by,
-                            parent_mlalgorithm = alg_id_1,
-                            active=True)
-            status_1.save()
-            deactivate_other_statuses(status_1)
-            
-            # Update status for second algorithm
-            status_2 = models.MLAlgorithmStatus(status = "testing",
-                            created_by=ab_test.created_by,
-                            parent_mlalgorithm = alg_id_2,
-                            active=True)
-            status_2.save()
-            deactivate_other_statuses(status_2)
-
-            summary = "Algorithm #1 accuracy: {}, Algorithm #2 accuracy: {}".format(accuracy_1, accuracy_2)
-            ab_test.ended_at = date_now
-            ab_test.summary = summary
-            ab_test.save()
+
+            stats = get_ab_test_stats(ab_test)
+
+            for arm in stats["arms"]:
+                logger.info(
+                    "A/B test %s algorithm %s accuracy %s", ab_test.id, arm["algorithm"], arm["accuracy"],
+                    extra={
+                        "ab_test_id": ab_test.id,
+                        "algorithm_id": arm["algorithm"],
+                        "all_responses": arm["requests"],
+                        "labeled_responses": arm["labeled"],
+                        "correct_responses": arm["correct"],
+                        "accuracy": arm["accuracy"],
+                    }
+                )
+
+            summary = stop_ab_test(ab_test, stats)
 
         except Exception as e:
             return Response(
@@ -289,4 +998,33 @@ class StopABTestView(views.APIView):
         return Response({
             "message":"AB Test finished.",
             "summary":summary
-        })
\ No newline at end of file
+        })
+
+class ReadinessView(views.APIView):
+    '''
+    Only accepts GET requests.
+    Available at https://<server_ip/>api/v1/ready
+
+    Reports which algorithms are loaded, responds with 503 until all the 
+    registered algorithms are loaded
+    '''
+    def get(self, request, format=None):
+        registry_status = registry.get_status()
+
+        return Response(
+            registry_status,
+            status=status.HTTP_200_OK if registry_status["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+class MetricsView(views.APIView):
+    '''
+    Only accepts GET requests.
+    Available at https://<server_ip/>api/v1/metrics
+
+    Reports the stage latency histograms and the counters of this process 
+    in the Prometheus text format
+    '''
+    def get(self, request, format=None):
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
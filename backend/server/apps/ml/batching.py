@@ -0,0 +1,111 @@
+'''
+Dynamic micro-batching of single record predictions.
+
+Concurrent requests to the same algorithm are queued, and a background
+thread collects them for up to max_latency_ms or until max_batch_size
+records are queued. The batch is computed with one compute_batch_prediction
+call (one DataFrame and one predict_proba) and every caller gets its own
+prediction through a future.
+'''
+
+# Imports
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    '''
+    Attributes:
+        load_algorithm: returns the algorithm object, it is called in the
+            batching thread so that the algorithm can be loaded lazily
+        max_batch_size: the maximum number of records in one batch
+        max_latency_ms: the maximum number of milliseconds the first record
+            of a batch waits for other records
+    '''
+
+    def __init__(self, load_algorithm, max_batch_size=32, max_latency_ms=5):
+        self.load_algorithm = load_algorithm
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, input_data):
+        '''
+        Queues the record and returns the future of its prediction
+        '''
+        self.start()
+
+        future = Future()
+        self.queue.put((input_data, future))
+        return future
+
+    def compute_prediction(self, input_data):
+        return self.submit(input_data).result()
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="micro-batcher", daemon=True
+                )
+                self.thread.start()
+
+    def collect(self):
+        '''
+        Waits for the first record and collects the batch around it
+        '''
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_latency
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+        while True:
+            # The futures cancelled by their callers are dropped, the other
+            # ones can no longer be cancelled
+            batch = [
+                (input_data, future) for input_data, future in self.collect()
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+
+            # The thread is the only one of the algorithm, it must not end
+            try:
+                self.compute_batch(batch)
+            except Exception as e:
+                logger.exception("Failed to answer a batch of %d records", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result({"status": "Error", "message": str(e)})
+
+    def compute_batch(self, batch):
+        records = [input_data for input_data, _ in batch]
+
+        try:
+            predictions = self.load_algorithm().compute_batch_prediction(records)
+        except Exception as e:
+            logger.exception("Failed to compute a batch of %d records", len(batch))
+            predictions = [{"status": "Error", "message": str(e)} for _ in batch]
+
+        for (_, future), prediction in zip(batch, predictions):
+            future.set_result(prediction)
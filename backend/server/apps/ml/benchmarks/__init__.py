@@ -0,0 +1,7 @@
+'''
+Benchmarks of the prediction stack.
+
+Run them with the benchmark_predictions command, which writes the results
+to a JSON file and compares them with a stored baseline:
+    python manage.py benchmark_predictions --output results.json --baseline baseline.json
+'''
@@ -0,0 +1,137 @@
+'''
+Measures the latency percentiles and the throughput of the prediction
+stack: the algorithms alone, the predict view through the Django test
+client, and a running server under concurrent load.
+'''
+
+# Imports
+import json
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.db import transaction
+from django.test import Client, override_settings
+
+def summarize(latencies, elapsed, records_per_call=1):
+    '''
+    Returns the latency percentiles in milliseconds and the throughput in
+    records per second of the calls
+    '''
+    latencies = np.asarray(latencies) * 1000.0
+    return {
+        "calls": len(latencies),
+        "records": len(latencies) * records_per_call,
+        "seconds": elapsed,
+        "throughput": len(latencies) * records_per_call / elapsed if elapsed else 0.0,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+def measure(function, inputs, warm_up=10):
+    '''
+    Calls the function with every input one after the other and returns
+    the latencies and the total time
+    '''
+    for input_data in inputs[:warm_up]:
+        function(input_data)
+
+    latencies = []
+    started_at = time.perf_counter()
+    for input_data in inputs:
+        call_started_at = time.perf_counter()
+        function(input_data)
+        latencies.append(time.perf_counter() - call_started_at)
+
+    return latencies, time.perf_counter() - started_at
+
+def benchmark_single(algorithm_object, records):
+    latencies, elapsed = measure(algorithm_object.compute_prediction, records)
+    return summarize(latencies, elapsed)
+
+def benchmark_batch(algorithm_object, records, batch_size):
+    batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+    batches = [batch for batch in batches if len(batch) == batch_size] or [records]
+
+    latencies, elapsed = measure(algorithm_object.compute_batch_prediction, batches, warm_up=1)
+    return summarize(latencies, elapsed, records_per_call=len(batches[0]))
+
+def benchmark_predict_view(records, endpoint_name="income_classifier", query_params=None):
+    '''
+    Posts the records to the predict view with the Django test client. The
+    requests are saved in the request path and rolled back at the end, so
+    the database is not changed.
+    '''
+    client = Client()
+    url = "/api/v1/{}/predict".format(endpoint_name)
+    if query_params:
+        url += "?" + urllib.parse.urlencode(query_params)
+
+    def post(record):
+        response = client.post(url, json.dumps(record), content_type="application/json")
+        if response.status_code != 200:
+            raise RuntimeError("Predict view returned {}: {}".format(
+                response.status_code, response.content[:200]
+            ))
+
+    with override_settings(ML_REQUEST_LOGGING={"ASYNC": False}, ALLOWED_HOSTS=["testserver"]):
+        with transaction.atomic():
+            latencies, elapsed = measure(post, records)
+            transaction.set_rollback(True)
+
+    return summarize(latencies, elapsed)
+
+def benchmark_load(url, records, concurrency=8, timeout=10.0):
+    '''
+    Posts the records to the predict URL of a running server from
+    concurrency threads. The requests are saved by the server.
+    '''
+
+    def post(record):
+        request = urllib.request.Request(
+            url, data=json.dumps(record).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        started_at = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+        return time.perf_counter() - started_at
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(post, records[:concurrency]))
+
+        started_at = time.perf_counter()
+        latencies = list(executor.map(post, records))
+        elapsed = time.perf_counter() - started_at
+
+    result = summarize(latencies, elapsed)
+    result["concurrency"] = concurrency
+    return result
+
+def compare(results, baseline, tolerance=0.1):
+    '''
+    Compares the benchmarks with the baseline. Returns one row for every
+    benchmark in both, with the relative changes of the p50 latency and
+    the throughput, and whether one of them is worse than the tolerance.
+    '''
+    rows = []
+    for name, result in sorted(results["benchmarks"].items()):
+        baseline_result = baseline.get("benchmarks", {}).get(name)
+        if baseline_result is None:
+            continue
+
+        p50_change = result["p50_ms"] / baseline_result["p50_ms"] - 1.0
+        throughput_change = result["throughput"] / baseline_result["throughput"] - 1.0
+        rows.append({
+            "name": name,
+            "p50_change": p50_change,
+            "throughput_change": throughput_change,
+            "regression": p50_change > tolerance or throughput_change < -tolerance,
+        })
+
+    return rows
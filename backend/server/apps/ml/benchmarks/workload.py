@@ -0,0 +1,74 @@
+'''
+The records of the benchmark workloads, read from a JSONL file with one
+record per line (the input_data of the predict requests) or generated from
+the training artifacts with a fixed seed.
+'''
+
+# Imports
+import json
+
+import numpy as np
+from django.core.management.base import CommandError
+
+from apps.ml.income_classifier.base import load_artifact
+
+# The ranges of the numeric columns of the adult income dataset
+NUMERIC_RANGES = {
+    "age": (17, 90),
+    "fnlwgt": (12285, 1484705),
+    "education-num": (1, 16),
+    "capital-gain": (0, 99999),
+    "capital-loss": (0, 4356),
+    "hours-per-week": (1, 99),
+}
+
+# The share of the records with a capital gain or loss
+CAPITAL_SHARE = 0.1
+
+def load_workload(path, limit=None):
+    '''
+    Returns the records of the JSONL file, a line can be a record or an 
+    object with the record in input_data. Raises a CommandError on a line
+    that is not a JSON object.
+    '''
+    records = []
+    with open(path, encoding="utf-8") as workload_file:
+        for line_number, line in enumerate(workload_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise CommandError("Invalid JSON on line {} of {}: {}".format(line_number, path, e))
+            if not isinstance(record, dict):
+                raise CommandError("Expected a JSON object on line {} of {}".format(line_number, path))
+            if isinstance(record.get("input_data"), dict):
+                record = record["input_data"]
+            records.append(record)
+            if limit is not None and len(records) >= limit:
+                break
+    return records
+
+def synthetic_workload(size, seed=0):
+    '''
+    Returns size records with the categories of the label encoders and 
+    numbers in the ranges of the dataset
+    '''
+    random_state = np.random.RandomState(seed)
+    encoders = load_artifact("encoders.joblib")
+    columns = load_artifact("train_mode.joblib")
+
+    records = []
+    for _ in range(size):
+        record = {}
+        for column in columns:
+            if column in encoders:
+                record[column] = str(random_state.choice(encoders[column].classes_))
+            else:
+                low, high = NUMERIC_RANGES[column]
+                if column.startswith("capital") and random_state.rand() >= CAPITAL_SHARE:
+                    low = high = 0
+                record[column] = int(random_state.randint(low, high + 1))
+        records.append(record)
+
+    return records
@@ -0,0 +1,144 @@
+'''
+Caches the predictions of repeated records.
+
+The predictions are kept in a size bounded LRU dictionary with a time to
+live, keyed by the algorithm id and a hash of the canonical input of the
+record (the record after the categorical encoding and the filling of
+missing values), so a hit skips both the DataFrame construction and the
+forest traversal. Only successful predictions are cached.
+
+An optional second level in a Django cache (for example a FileBasedCache
+or Memcached configured in CACHES) is shared by the worker processes.
+'''
+
+# Imports
+import collections
+import hashlib
+import threading
+import time
+
+from django.core.cache import caches
+
+def hash_input(canonical_input):
+    if isinstance(canonical_input, str):
+        canonical_input = canonical_input.encode("utf-8")
+    return hashlib.blake2b(canonical_input, digest_size=16).hexdigest()
+
+class SharedPredictionCache:
+    '''
+    Prediction cache in a Django cache shared by the worker processes.
+    Clearing it increments a generation number stored in the same cache,
+    which is part of every key, so the old entries are no longer read and
+    expire with their ttl.
+
+    Attributes:
+        cache_alias: the alias of the Django cache in the CACHES setting
+        ttl: the number of seconds a prediction is kept
+    '''
+
+    generation_key = "ml-prediction-cache-generation"
+
+    def __init__(self, cache_alias, ttl=300):
+        self.cache = caches[cache_alias]
+        self.ttl = ttl
+
+    def get_generation(self):
+        generation = self.cache.get(self.generation_key)
+        if generation is None:
+            self.cache.add(self.generation_key, 0, timeout=None)
+            generation = self.cache.get(self.generation_key, 0)
+        return generation
+
+    def make_key(self, key):
+        return "ml-prediction:{}:{}:{}".format(self.get_generation(), *key)
+
+    def get(self, key):
+        return self.cache.get(self.make_key(key))
+
+    def set(self, key, prediction):
+        self.cache.set(self.make_key(key), prediction, timeout=self.ttl)
+
+    def clear(self):
+        try:
+            self.cache.incr(self.generation_key)
+        except ValueError:
+            # The generation expired or was evicted, starting over from 0
+            # would hit the entries of an old generation
+            self.cache.set(self.generation_key, int(time.time()), timeout=None)
+
+class PredictionCache:
+    '''
+    Attributes:
+        max_size: the maximum number of predictions kept in the process,
+            the least recently used prediction is evicted first
+        ttl: the number of seconds a prediction is kept, None keeps it
+            until it is evicted or the cache is cleared
+        shared: the optional SharedPredictionCache used on local misses
+        hits, misses: the number of lookups that found or did not find a
+            prediction
+    '''
+
+    def __init__(self, max_size=10000, ttl=300, shared=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+
+        # Maps (algorithm id, input hash) to (prediction, stored time)
+        self.predictions = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        Returns a copy of the cached prediction, or None
+        '''
+        with self.lock:
+            entry = self.predictions.get(key)
+            if entry is not None:
+                prediction, stored_at = entry
+                if self.ttl is None or time.monotonic() - stored_at < self.ttl:
+                    self.predictions.move_to_end(key)
+                    self.hits += 1
+                    return dict(prediction)
+                del self.predictions[key]
+
+        prediction = self.shared.get(key) if self.shared is not None else None
+
+        with self.lock:
+            if prediction is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        self.set(key, prediction, shared=False)
+        return dict(prediction)
+
+    def set(self, key, prediction, shared=True):
+        if prediction.get("status") != "OK":
+            return
+
+        with self.lock:
+            self.predictions[key] = (dict(prediction), time.monotonic())
+            self.predictions.move_to_end(key)
+            while len(self.predictions) > self.max_size:
+                self.predictions.popitem(last=False)
+
+        if shared and self.shared is not None:
+            self.shared.set(key, prediction)
+
+    def clear(self):
+        with self.lock:
+            self.predictions.clear()
+
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.predictions),
+            "max_size": self.max_size,
+        }
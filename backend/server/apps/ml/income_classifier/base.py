@@ -0,0 +1,277 @@
+import os
+import threading
+import time
+import warnings
+
+import joblib
+'''
+Joblib is a set of tools to provide lightweight pipelining in Python
+    1. transparent disk-caching of functions and lazy re-evaluation (memoize pattern)
+    2. easy simple parallel computing
+'''
+import numpy as np
+import pandas as pd
+
+from apps.ml.forest_engine import PackedForest
+from apps.ml.income_classifier.encoding import CategoricalEncoder
+
+# The engines that evaluate the forests, "packed" evaluates small inputs 
+# with the PackedForest of the model and large ones with sklearn
+INFERENCE_ENGINES = ("sklearn", "packed")
+
+# The directory with the artifacts saved in research/adult_income.ipynb
+PATH_TO_ARTIFACTS = "../../research/"
+
+# The directory with the uncompressed copies of the artifacts created by 
+# the convert_artifacts command at deploy time. The copies are loaded with 
+# mmap_mode="r", so their arrays are backed by the page cache and shared 
+# by all the worker processes instead of being copied to each heap.
+PATH_TO_MMAP_ARTIFACTS = PATH_TO_ARTIFACTS + "mmap/"
+
+# Single records are passed to the model as NumPy rows in the training 
+# column order, sklearn warns on every call that they have no feature names
+warnings.filterwarnings(
+    "ignore", message="X does not have valid feature names", category=UserWarning
+)
+
+# Process wide cache of the loaded artifacts and the objects built from them
+artifacts = {}
+artifacts_lock = threading.Lock()
+
+def read_artifact(file_name):
+    '''
+    Reads the artifact from the memory-mapped copy if it is up to date, 
+    otherwise from the compressed file
+    '''
+    path = PATH_TO_ARTIFACTS + file_name
+    mmap_path = PATH_TO_MMAP_ARTIFACTS + file_name
+
+    if (
+        os.path.exists(mmap_path)
+        and os.path.getmtime(mmap_path) >= os.path.getmtime(path)
+    ):
+        return joblib.load(mmap_path, mmap_mode="r")
+
+    return joblib.load(path)
+
+def convert_artifact(file_name):
+    '''
+    Writes the uncompressed copy of the artifact that can be memory-mapped
+    '''
+    os.makedirs(PATH_TO_MMAP_ARTIFACTS, exist_ok=True)
+    mmap_path = PATH_TO_MMAP_ARTIFACTS + file_name
+
+    # Write to a temporary file first, so running workers never load a
+    # partially written copy
+    joblib.dump(joblib.load(PATH_TO_ARTIFACTS + file_name), mmap_path + ".tmp")
+    os.replace(mmap_path + ".tmp", mmap_path)
+
+    return mmap_path
+
+def load_artifact(file_name):
+    '''
+    Loads the joblib artifact once per process, every classifier gets the
+    same object
+    '''
+    artifact = artifacts.get(file_name)
+    if artifact is None:
+        with artifacts_lock:
+            artifact = artifacts.get(file_name)
+            if artifact is None:
+                artifact = read_artifact(file_name)
+                artifacts[file_name] = artifact
+    return artifact
+
+def get_categorical_encoder(unseen_category):
+    '''
+    Builds the encoding tables once per process for every unseen category
+    policy
+    '''
+    key = ("categorical_encoder", unseen_category)
+    encoder = artifacts.get(key)
+    if encoder is None:
+        encoder = CategoricalEncoder(
+            load_artifact("encoders.joblib"),
+            load_artifact("train_mode.joblib"),
+            unseen_category
+        )
+        with artifacts_lock:
+            encoder = artifacts.setdefault(key, encoder)
+    return encoder
+
+def get_packed_forest(model_file):
+    '''
+    Packs the trees of the model once per process
+    '''
+    key = ("packed_forest", model_file)
+    packed_forest = artifacts.get(key)
+    if packed_forest is None:
+        packed_forest = PackedForest(load_artifact(model_file))
+        with artifacts_lock:
+            packed_forest = artifacts.setdefault(key, packed_forest)
+    return packed_forest
+
+class IncomeClassifierBase:
+    '''
+    The pre- and post-processing shared by the income classifiers. The 
+    subclasses set the file name of the trained model.
+
+    Attributes:
+        model_file: the file name of the trained model in the artifacts directory
+        packed_max_records: the maximum number of records evaluated by the 
+            packed engine, sklearn evaluates larger batches faster with its
+            compiled trees
+        stage_observer: called with the name and the duration in seconds of
+            every preprocessing, predict and postprocessing stage, it is set
+            by the registry
+    '''
+
+    model_file = None
+    packed_max_records = 128
+    stage_observer = None
+
+    def __init__(self, unseen_category="error", inference_engine="sklearn"):
+        if inference_engine not in INFERENCE_ENGINES:
+            raise ValueError(
+                "Unknown inference engine {}, expected one of {}".format(
+                    inference_engine, INFERENCE_ENGINES
+                )
+            )
+
+        # the fill-in values and the label encoders are shared by all 
+        # the classifiers in the process
+        self.values_fill_missing = load_artifact("train_mode.joblib")
+        self.encoders = load_artifact("encoders.joblib")
+        self.model = load_artifact(self.model_file)
+        # lookup tables built from the label encoders, missing and unseen
+        # categories raise or are encoded as the training mode depending on
+        # the policy
+        self.categorical_encoder = get_categorical_encoder(unseen_category)
+        # the fill-in values of the numerical columns
+        self.numerical_fill_missing = {
+            column: value for column, value in self.values_fill_missing.items()
+            if column not in self.categorical_encoder.encoding_tables
+        }
+        # the column order of the training data
+        self.columns = list(getattr(self.model, "feature_names_in_", self.values_fill_missing))
+        self.fill_values = [self.values_fill_missing[column] for column in self.columns]
+        # the trees packed into NumPy arrays, they give the same 
+        # probabilities as predict_proba
+        self.packed_forest = None
+        if inference_engine == "packed":
+            self.packed_forest = get_packed_forest(self.model_file)
+
+    def encode_row(self, record):
+        '''
+        Converts one record to a contiguous float32 row of the model input
+        without pandas, the categoricals are encoded and the missing 
+        numerical values are filled with the training mode
+        '''
+        unknown_columns = record.keys() - self.values_fill_missing.keys()
+        if unknown_columns:
+            raise ValueError("Unknown fields {}".format(sorted(unknown_columns)))
+
+        record = self.categorical_encoder.encode_record(record)
+
+        row = [
+            fill_value if record.get(column) is None else record[column]
+            for column, fill_value in zip(self.columns, self.fill_values)
+        ]
+
+        # The trees compare float32 features, so sklearn does not copy the row
+        return np.array([row], dtype=np.float32)
+
+    def preprocessing(self, input_data):
+        if isinstance(input_data, dict):
+            # one record to a NumPy row, building a DataFrame costs more 
+            # than the prediction
+            input_data = self.encode_row(input_data)
+        else:
+            unknown_columns = set().union(*input_data) - self.values_fill_missing.keys()
+            if unknown_columns:
+                raise ValueError("Unknown fields {}".format(sorted(unknown_columns)))
+
+            # list of records to pandas DataFrame, in the column order of 
+            # the training data whatever the key order of the records
+            input_data = pd.DataFrame(input_data, columns=self.columns)
+            # fill missing numerical values, the missing categoricals 
+            # follow the unseen category policy
+            input_data = input_data.fillna(self.numerical_fill_missing)
+            # convert categoricals with one mapping per column
+            self.categorical_encoder.encode_frame(input_data)
+
+        return input_data
+
+    def canonical_input(self, input_data):
+        '''
+        Returns the bytes of the model input row of the record. The records 
+        that are preprocessed into the same model input have the same 
+        canonical input, it is used as the key of the prediction cache.
+        '''
+        return self.encode_row(input_data).tobytes()
+
+    def predict(self, input_data):
+        if self.packed_forest is not None and len(input_data) <= self.packed_max_records:
+            return self.packed_forest.predict_proba(input_data)
+        return self.model.predict_proba(input_data)
+
+    def postprocessing(self, input_data):
+        '''
+        Converts the probabilities into values. 
+        If the probability is greater than or equal to 50k, set label to >=50k.
+        If probability is less than 50k, set label to <50k
+        '''
+        
+        label = "<=50K"
+        if input_data[1] > 0.5:
+            label = ">50K"
+        return {"probability": input_data[1], "label": label, "status": "OK"}
+
+    def run_stage(self, stage, function, input_data):
+        if self.stage_observer is None:
+            return function(input_data)
+
+        started_at = time.perf_counter()
+        output_data = function(input_data)
+        self.stage_observer(stage, time.perf_counter() - started_at)
+        return output_data
+
+    def compute_prediction(self, input_data):
+        try:
+            # Process the raw data
+            input_data = self.run_stage("preprocessing", self.preprocessing, input_data)
+            
+            # Predict one sample
+            prediction = self.run_stage("predict", self.predict, input_data)[0]  # only one sample
+            
+            # Postprocess the prediction
+            prediction = self.run_stage("postprocessing", self.postprocessing, prediction)
+        
+        except Exception as e:
+            return {"status": "Error", "message": str(e)}
+
+        return prediction
+
+    def compute_batch_prediction(self, input_data):
+        '''
+        Computes predictions for a list of records with one DataFrame and 
+        one predict_proba call. If the batch cannot be processed as a whole,
+        every record is computed on its own so that each one gets its own
+        status.
+        '''
+        try:
+            # Process all the raw records at once
+            processed_data = self.run_stage("preprocessing", self.preprocessing, input_data)
+
+            # Predict all the samples
+            predictions = self.run_stage("predict", self.predict, processed_data)
+
+            # Postprocess every prediction
+            predictions = self.run_stage(
+                "postprocessing", lambda ps: [self.postprocessing(p) for p in ps], predictions
+            )
+
+        except Exception:
+            return [self.compute_prediction(record) for record in input_data]
+
+        return predictions
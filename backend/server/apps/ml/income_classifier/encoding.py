@@ -0,0 +1,86 @@
+'''
+Converts the categorical columns to the labels used in training.
+
+The LabelEncoder objects from encoders.joblib are compiled once into plain
+dictionaries, so encoding a record is one dictionary lookup per column
+instead of a LabelEncoder.transform call with input validation and
+np.searchsorted.
+'''
+
+# Policies for categories that were not seen in training
+UNSEEN_CATEGORY_POLICIES = ("mode", "error")
+
+class CategoricalEncoder:
+    '''
+    Attributes:
+        encoding_tables: maps column to a dictionary from category to label
+        mode_labels: maps column to the label of the most frequent training
+            category, it is used for missing and unseen categories
+        unseen_category: the policy for missing and unseen categories, 
+            "error" raises a ValueError and "mode" uses the label of the 
+            most frequent training category
+    '''
+
+    def __init__(self, encoders, values_fill_missing, unseen_category="error"):
+
+        if unseen_category not in UNSEEN_CATEGORY_POLICIES:
+            raise ValueError(
+                "Unknown unseen category policy {}, expected one of {}".format(
+                    unseen_category, UNSEEN_CATEGORY_POLICIES
+                )
+            )
+
+        self.unseen_category = unseen_category
+
+        # Build the lookup tables from the classes of the label encoders
+        self.encoding_tables = {
+            column: {str(category): label for label, category in enumerate(encoder.classes_)}
+            for column, encoder in encoders.items()
+        }
+
+        self.mode_labels = {
+            column: table[str(values_fill_missing[column])]
+            for column, table in self.encoding_tables.items()
+        }
+
+    def unseen(self, column, category):
+        if self.unseen_category == "error":
+            if category is None or category != category:
+                raise ValueError("Missing category in column {}".format(column))
+            raise ValueError(
+                "Unseen category {!r} in column {}".format(category, column)
+            )
+        return self.mode_labels[column]
+
+    def encode_record(self, record):
+        '''
+        Returns a copy of the record with the categorical columns encoded
+        '''
+        record = dict(record)
+
+        for column, table in self.encoding_tables.items():
+            category = record.get(column)
+            label = None if category is None else table.get(category)
+            if label is None:
+                label = self.unseen(column, category)
+            record[column] = label
+
+        return record
+
+    def encode_frame(self, data_frame):
+        '''
+        Encodes the categorical columns of the DataFrame in place with one
+        vectorized mapping per column
+        '''
+        for column, table in self.encoding_tables.items():
+            labels = data_frame[column].map(table)
+
+            unseen = labels.isna()
+            if unseen.any():
+                if self.unseen_category == "error":
+                    self.unseen(column, data_frame[column][unseen].iloc[0])
+                labels = labels.fillna(self.mode_labels[column])
+
+            data_frame[column] = labels.astype("int64")
+
+        return data_frame
@@ -0,0 +1,173 @@
+import datetime
+import json
+import platform
+
+import numpy as np
+import sklearn
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ml.benchmarks import runner
+from apps.ml.benchmarks.workload import load_workload, synthetic_workload
+from apps.ml.income_classifier.base import INFERENCE_ENGINES
+from apps.ml.income_classifier.extra_trees import ExtraTreesClassifier
+from apps.ml.income_classifier.random_forest import RandomForestClassifier
+
+CLASSIFIERS = {
+    "random_forest": RandomForestClassifier,
+    "extra_trees": ExtraTreesClassifier,
+}
+
+class Command(BaseCommand):
+    '''
+    Benchmarks the single record and batch predictions of the income
+    classifiers and the predict view, and optionally a running server
+    under concurrent load. The results are written to a JSON file and
+    compared with a baseline written by an earlier run.
+
+    For example:
+        python manage.py benchmark_predictions --workload requests.jsonl --output after.json --baseline before.json
+    '''
+    help = "Benchmarks the prediction stack and compares the results with a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workload",
+            help="A JSONL file of records, synthetic records are generated by default"
+        )
+        parser.add_argument(
+            "--records", type=int, default=1000,
+            help="The number of records of the workload"
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0,
+            help="The seed of the synthetic records"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, action="append",
+            help="The batch sizes, 100 and 1000 by default"
+        )
+        parser.add_argument(
+            "--engine", choices=INFERENCE_ENGINES, action="append",
+            help="The inference engines, all by default"
+        )
+        parser.add_argument(
+            "--skip-view", action="store_true",
+            help="Do not benchmark the predict view"
+        )
+        parser.add_argument(
+            "--endpoint", default="income_classifier",
+            help="The endpoint of the predict view"
+        )
+        parser.add_argument(
+            "--status", default="production",
+            help="The algorithm status of the predict view requests"
+        )
+        parser.add_argument(
+            "--algorithm-version",
+            help="The algorithm version of the predict view requests"
+        )
+        parser.add_argument(
+            "--url",
+            help="The predict URL of a running server to load test, for example "
+                 "http://127.0.0.1:8000/api/v1/income_classifier/predict"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=8,
+            help="The number of concurrent clients of the load test"
+        )
+        parser.add_argument(
+            "--output", default="benchmark.json",
+            help="The JSON file of the results"
+        )
+        parser.add_argument(
+            "--baseline",
+            help="The JSON file of the results to compare with"
+        )
+        parser.add_argument(
+            "--tolerance", type=float, default=0.1,
+            help="The relative change of the p50 latency or the throughput reported as a regression"
+        )
+        parser.add_argument(
+            "--fail-on-regression", action="store_true",
+            help="Exit with an error if there is a regression"
+        )
+
+    def handle(self, *args, **options):
+        if options["workload"]:
+            records = load_workload(options["workload"], limit=options["records"])
+        else:
+            records = synthetic_workload(options["records"], seed=options["seed"])
+
+        if not records:
+            raise CommandError("The workload has no records")
+
+        batch_sizes = options["batch_size"] or [100, 1000]
+        engines = options["engine"] or list(INFERENCE_ENGINES)
+
+        benchmarks = {}
+        for classifier_name, classifier in CLASSIFIERS.items():
+            for engine in engines:
+                algorithm_object = classifier(inference_engine=engine)
+                prefix = "{}.{}".format(classifier_name, engine)
+
+                benchmarks[prefix + ".single"] = runner.benchmark_single(algorithm_object, records)
+                for batch_size in batch_sizes:
+                    benchmarks["{}.batch_{}".format(prefix, batch_size)] = runner.benchmark_batch(
+                        algorithm_object, records, batch_size
+                    )
+
+        if not options["skip_view"]:
+            query_params = {"status": options["status"]}
+            if options["algorithm_version"]:
+                query_params["version"] = options["algorithm_version"]
+            try:
+                benchmarks["predict_view"] = runner.benchmark_predict_view(
+                    records, options["endpoint"], query_params
+                )
+            except RuntimeError as e:
+                raise CommandError(str(e))
+
+        if options["url"]:
+            benchmarks["load"] = runner.benchmark_load(
+                options["url"], records, concurrency=options["concurrency"]
+            )
+
+        results = {
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "sklearn": sklearn.__version__,
+                "machine": platform.machine(),
+            },
+            "workload": {
+                "file": options["workload"],
+                "records": len(records),
+                "seed": None if options["workload"] else options["seed"],
+            },
+            "benchmarks": benchmarks,
+        }
+
+        with open(options["output"], "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+        for name, result in sorted(benchmarks.items()):
+            self.stdout.write("{:40} p50 {:9.3f} ms  p99 {:9.3f} ms  {:11.1f} records/s".format(
+                name, result["p50_ms"], result["p99_ms"], result["throughput"]
+            ))
+        self.stdout.write("Wrote the results to {}".format(options["output"]))
+
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as baseline_file:
+                baseline = json.load(baseline_file)
+
+            rows = runner.compare(results, baseline, tolerance=options["tolerance"])
+            for row in rows:
+                self.stdout.write("{:40} p50 {:+7.1%}  throughput {:+7.1%}{}".format(
+                    row["name"], row["p50_change"], row["throughput_change"],
+                    "  REGRESSION" if row["regression"] else ""
+                ))
+
+            regressions = [row["name"] for row in rows if row["regression"]]
+            if regressions and options["fail_on_regression"]:
+                raise CommandError("Regressions in {}".format(", ".join(regressions)))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from apps.ml.income_classifier import base
+from apps.ml.income_classifier.extra_trees import ExtraTreesClassifier
+from apps.ml.income_classifier.random_forest import RandomForestClassifier
+
+class Command(BaseCommand):
+    '''
+    Converts the compressed joblib artifacts to uncompressed copies that are
+    loaded with mmap_mode="r" and shared by the worker processes.
+
+    Run at deploy time, before the workers start:
+        python manage.py convert_artifacts
+    '''
+    help = "Writes memory-mappable copies of the ML artifacts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "file_names", nargs="*",
+            help="The artifacts to convert, all the income classifier artifacts by default"
+        )
+
+    def handle(self, *args, **options):
+        file_names = options["file_names"] or [
+            "train_mode.joblib",
+            "encoders.joblib",
+            RandomForestClassifier.model_file,
+            ExtraTreesClassifier.model_file,
+        ]
+
+        for file_name in file_names:
+            mmap_path = base.convert_artifact(file_name)
+            self.stdout.write("Converted {} to {}".format(file_name, mmap_path))
@@ -0,0 +1,209 @@
+'''
+Latency histograms and counters of the prediction stack, rendered in the
+Prometheus text exposition format by the /api/v1/metrics view.
+
+The metrics are kept per process, every worker process reports its own
+values (with several worker processes, scrape them one by one or sum them
+with the instance label).
+'''
+
+# Imports
+import contextlib
+import threading
+import time
+
+# The upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+)
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(
+        '{}="{}"'.format(
+            name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        )
+        for name, value in pairs
+    ) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    '''
+    Attributes:
+        name: the metric name, it ends with _total
+        documentation: the HELP text
+        labelnames: the names of the labels, the values are given to inc
+    '''
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        # Maps label values to the count
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues):
+        return self.values.get(labelvalues, 0)
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+
+        for labelvalues, value in values:
+            yield self.name + format_labels(self.labelnames, labelvalues), value
+
+class Histogram:
+    '''
+    Attributes:
+        name: the metric name
+        documentation: the HELP text
+        labelnames: the names of the labels, the values are given to observe
+        buckets: the upper bounds of the buckets, the +Inf bucket is added
+    '''
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+        # Maps label values to [bucket counts, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self.lock:
+            counts = self.values.get(labelvalues)
+            if counts is None:
+                counts = self.values[labelvalues] = [[0] * len(self.buckets), 0.0]
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][index] += 1
+                    break
+            counts[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labelvalues):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, *labelvalues)
+
+    def get_count(self, *labelvalues):
+        counts = self.values.get(labelvalues)
+        return sum(counts[0]) if counts is not None else 0
+
+    def samples(self):
+        with self.lock:
+            values = sorted(
+                (labelvalues, list(bucket_counts), total)
+                for labelvalues, (bucket_counts, total) in self.values.items()
+            )
+
+        for labelvalues, bucket_counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, bucket_counts):
+                cumulative += count
+                yield self.name + "_bucket" + format_labels(
+                    self.labelnames, labelvalues, [("le", format_value(bound))]
+                ), cumulative
+            yield self.name + "_sum" + format_labels(self.labelnames, labelvalues), total
+            yield self.name + "_count" + format_labels(self.labelnames, labelvalues), cumulative
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        '''
+        Returns the metrics in the Prometheus text format
+        '''
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for sample, value in metric.samples():
+                lines.append("{} {}".format(sample, format_value(value)))
+        return "\n".join(lines) + "\n"
+
+# Process wide metrics
+metrics = MetricsRegistry()
+
+STAGE_DURATION = metrics.histogram(
+    "ml_stage_duration_seconds",
+    "Duration of the stages of a prediction request",
+    ["algorithm", "stage"]
+)
+PREDICTIONS = metrics.counter(
+    "ml_predictions_total",
+    "Number of computed predictions by status",
+    ["algorithm", "status"]
+)
+ROUTING_ERRORS = metrics.counter(
+    "ml_routing_errors_total",
+    "Number of requests that could not be routed to an algorithm"
+)
+CACHE_LOOKUPS = metrics.counter(
+    "ml_prediction_cache_lookups_total",
+    "Number of prediction cache lookups by result",
+    ["algorithm", "result"]
+)
+AB_TEST_SELECTIONS = metrics.counter(
+    "ml_ab_test_selections_total",
+    "Number of requests routed to every algorithm of an A/B test",
+    ["algorithm"]
+)
+REQUEST_WRITES = metrics.histogram(
+    "ml_request_write_duration_seconds",
+    "Duration of the bulk inserts of the MLRequest writer"
+)
+REQUEST_WRITE_ERRORS = metrics.counter(
+    "ml_request_write_errors_total",
+    "Number of MLRequests that could not be saved"
+)
+SHADOW_PREDICTIONS = metrics.counter(
+    "ml_shadow_predictions_total",
+    "Number of production records scored by the shadow algorithms by result",
+    ["algorithm", "result"]
+)
+SHADOW_DROPPED = metrics.counter(
+    "ml_shadow_dropped_total",
+    "Number of production requests not scored by the shadow algorithms because the pool was full"
+)
+
+def observe_stage(algorithm_id, stage, seconds):
+    STAGE_DURATION.observe(seconds, str(algorithm_id), stage)
+
+def time_stage(algorithm_id, stage):
+    '''
+    Context manager that observes the duration of the stage
+    '''
+    return STAGE_DURATION.time(str(algorithm_id), stage)
@@ -0,0 +1,175 @@
+'''
+Runs the inference of an algorithm in a pool of worker processes.
+
+Every worker process creates its own algorithm object with the algorithm
+factory when it starts, and the records and predictions are sent over the
+pipes of a ProcessPoolExecutor. The CPU-bound forest evaluation then scales
+across cores independently of the number of HTTP workers and threads.
+
+If the pool cannot be started, breaks or does not answer within timeout
+seconds, the predictions are computed in the calling process with the
+fallback algorithm, and the pool is started again after retry_interval
+seconds.
+'''
+
+# Imports
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# The algorithm object of the worker process
+worker_algorithm = None
+
+def initialize_worker(algorithm_factory):
+    global worker_algorithm
+    worker_algorithm = algorithm_factory()
+
+def worker_compute_prediction(input_data):
+    return worker_algorithm.compute_prediction(input_data)
+
+def worker_compute_batch_prediction(input_data):
+    return worker_algorithm.compute_batch_prediction(input_data)
+
+def worker_ping():
+    return True
+
+class ProcessPoolBackend:
+    '''
+    Attributes:
+        algorithm_factory: creates the algorithm object in the worker
+            processes, it has to be picklable (a class or a module level
+            function)
+        processes: the number of worker processes
+        fallback: returns the algorithm object used in the calling process
+            when the pool is not available, by default it is created once
+            with the algorithm factory
+        retry_interval: the number of seconds the fallback is used after a
+            pool failure before the pool is started again
+        start_method: the multiprocessing start method, "spawn" does not
+            copy the threads and connections of the web worker
+        timeout: the number of seconds a prediction waits for the pool, 
+            a pool that does not answer in time has failed
+        loaded: whether a worker process has created its algorithm object,
+            it is set when a worker answers
+    '''
+
+    def __init__(
+        self, algorithm_factory, processes=2, fallback=None,
+        retry_interval=30, start_method="spawn", timeout=10
+    ):
+        self.algorithm_factory = algorithm_factory
+        self.processes = processes
+        self.retry_interval = retry_interval
+        self.start_method = start_method
+        self.timeout = timeout
+
+        self.fallback = fallback if fallback is not None else self.create_fallback_algorithm
+        self.fallback_algorithm = None
+
+        self.executor = None
+        self.failed_at = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def create_fallback_algorithm(self):
+        if self.fallback_algorithm is None:
+            with self.lock:
+                if self.fallback_algorithm is None:
+                    self.fallback_algorithm = self.algorithm_factory()
+        return self.fallback_algorithm
+
+    def get_executor(self):
+        '''
+        Returns the process pool, or None while the fallback is used
+        '''
+        if self.executor is not None:
+            return self.executor
+
+        if self.failed_at is not None and time.monotonic() - self.failed_at < self.retry_interval:
+            return None
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=initialize_worker,
+                    initargs=(self.algorithm_factory,)
+                )
+                self.failed_at = None
+
+        return self.executor
+
+    def fail(self, executor):
+        '''
+        Shuts down the failed pool, the fallback is used until the retry
+        interval has passed
+        '''
+        logger.exception("Process pool inference failed, using the fallback")
+
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+                self.failed_at = time.monotonic()
+                self.loaded = False
+
+        # A stuck worker process would never exit by itself
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, function, input_data, fallback_method):
+        executor = self.get_executor()
+
+        if executor is not None:
+            try:
+                prediction = executor.submit(function, input_data).result(timeout=self.timeout)
+                self.loaded = True
+                return prediction
+            except Exception:
+                # The worker functions catch the errors of the algorithm, so
+                # this is a failure of the pool: a broken or stuck worker 
+                # process or data that cannot be sent to it
+                self.fail(executor)
+
+        return getattr(self.fallback(), fallback_method)(input_data)
+
+    def compute_prediction(self, input_data):
+        return self.run(worker_compute_prediction, input_data, "compute_prediction")
+
+    def compute_batch_prediction(self, input_data):
+        return self.run(worker_compute_batch_prediction, input_data, "compute_batch_prediction")
+
+    def warm_up(self):
+        '''
+        Starts the worker processes, which create their algorithm objects
+        '''
+        executor = self.get_executor()
+        if executor is None:
+            return False
+
+        try:
+            for future in [executor.submit(worker_ping) for _ in range(self.processes)]:
+                future.result()
+        except Exception:
+            self.fail(executor)
+            return False
+
+        self.loaded = True
+        return True
+
+    @property
+    def started(self):
+        return self.executor is not None
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+
+        self.loaded = False
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -2,35 +2,129 @@
 This ML Registry app keeps information about available algorithms 
 and corresponding endpoints.
 
-Keeps simple dictionary object that maps algorithm id to algorithm object
+Keeps simple dictionary object that maps algorithm id to algorithm object,
+the factories of the algorithms that are loaded on first use or by the 
+warm-up, and a routing table that maps (endpoint name, status, version) to the ids
+of the matching algorithms, so that requests can be routed without 
+querying the database. The A/B testing routes also keep the weighted 
+split of their algorithms. The predictions of repeated records can be served
+from an optional prediction cache.
 '''
 
 # Imports
-from apps.endpoints.models import Endpoint, MLAlgorithm, MLAlgorithmStatus
+import functools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from apps.endpoints.models import ABTestArm, Endpoint, MLAlgorithm, MLAlgorithmStatus
+from apps.ml.batching import MicroBatcher
+from apps.ml.cache import hash_input
+from apps.ml.metrics import CACHE_LOOKUPS, PREDICTIONS, observe_stage
+from apps.ml.process_backend import ProcessPoolBackend
+from apps.ml.traffic import AliasTable
+
+logger = logging.getLogger(__name__)
 
 class MLRegistry:
 
-    def __init__(self):
+    def __init__(self, route_ttl=None, prediction_cache=None):
+        # Maps algorithm id to the loaded algorithm object
         self.endpoints = {}
+
+        # Maps algorithm id to the factory that creates the algorithm object
+        self.factories = {}
+        self.load_lock = threading.Lock()
+
+        # Maps algorithm id to the name of its endpoint
+        self.algorithm_endpoints = {}
+
+        # Maps endpoint name to the micro-batching configuration and 
+        # algorithm id to the micro-batcher of the algorithm. The batchers
+        # have their own lock because the load lock is held for the whole
+        # loading of an algorithm, and batchers are looked up by the event 
+        # loop of the async view.
+        self.micro_batching = {}
+        self.batchers = {}
+        self.batchers_lock = threading.Lock()
+
+        # Maps algorithm id to the process pool that runs its inference
+        self.backends = {}
+
+        # Maps (endpoint_name, status, version) to (algorithm ids, load time)
+        self.routes = {}
+
+        # Maps the A/B testing routes to the AliasTable of their algorithms
+        self.splits = {}
+
+        # The number of seconds after which a route is reloaded from the 
+        # database, None keeps routes until they are invalidated. A ttl 
+        # lets other processes pick up status changes made in this one.
+        self.route_ttl = route_ttl
+
+        # Incremented on every invalidation, so that a route loaded while
+        # statuses were changing is not stored in the routing table
+        self.routes_generation = 0
+        self.routes_lock = threading.Lock()
+
+        # The optional PredictionCache, it is cleared with the routes
+        self.prediction_cache = prediction_cache
     
     def add_algorithm(
         self, endpoint_name, algorithm_object, algorithm_name,
         algorithm_status, algorithm_version, owner, algorithm_description,
-        algorithm_code
+        algorithm_code, algorithm_factory=None, inference_backend=None,
+        inference_processes=2, inference_timeout=10
     ):
+        '''
+        Registers the algorithm in the database and in the registry. Either
+        the algorithm object or the algorithm factory has to be given, the
+        factory is called without arguments on first use or by warm_up.
+
+        The inference runs in the calling thread by default. With the 
+        "process" inference backend it runs in a pool of inference_processes
+        worker processes that create the algorithm with the factory, which 
+        has to be picklable. The algorithm is only created in this process 
+        if the pool fails or does not answer within inference_timeout 
+        seconds.
+        '''
+        if algorithm_object is None and algorithm_factory is None:
+            raise ValueError("Either algorithm_object or algorithm_factory is required")
+
+        if inference_backend not in (None, "process"):
+            raise ValueError("Unknown inference backend {}".format(inference_backend))
+
+        if inference_backend == "process" and algorithm_factory is None:
+            raise ValueError("The process inference backend requires algorithm_factory")
         
         # Create an endpoint
         endpoint, _ = Endpoint.objects.get_or_create(name=endpoint_name, owner=owner)
 
-        # Create an algorithm
-        database_object, algorithm_created = MLAlgorithm.objects.get_or_create(
+        # Create an algorithm, an algorithm is identified by its endpoint, 
+        # name and version, so that a change of its code does not register
+        # a second algorithm next to it
+        database_object = MLAlgorithm.objects.filter(
             name=algorithm_name,
-            description=algorithm_description,
-            code=algorithm_code,
             version=algorithm_version,
-            owner=owner,
             parent_endpoint=endpoint
-        )
+        ).order_by("id").first()
+        algorithm_created = database_object is None
+
+        if algorithm_created:
+            database_object = MLAlgorithm.objects.create(
+                name=algorithm_name,
+                description=algorithm_description,
+                code=algorithm_code,
+                version=algorithm_version,
+                owner=owner,
+                parent_endpoint=endpoint
+            )
+        elif (database_object.code, database_object.description) != (algorithm_code, algorithm_description):
+            database_object.code = algorithm_code
+            database_object.description = algorithm_description
+            database_object.save(update_fields=["code", "description"])
 
         # If algorithm is created successfully
         if algorithm_created:
@@ -46,5 +140,366 @@ class MLRegistry:
             # Save the status
             status.save()
 
+            # The new status can change the routing
+            self.invalidate_routes()
+
         # Store the id and algorithm in the endpoint object
-        self.endpoints[database_object.id] = algorithm_object
\ No newline at end of file
+        self.algorithm_endpoints[database_object.id] = endpoint_name
+        if algorithm_object is not None:
+            self.endpoints[database_object.id] = self.instrument(database_object.id, algorithm_object)
+        else:
+            self.factories[database_object.id] = algorithm_factory
+
+        if inference_backend == "process":
+            algorithm_id = database_object.id
+            self.backends[algorithm_id] = ProcessPoolBackend(
+                algorithm_factory, processes=inference_processes,
+                fallback=lambda: self.get_algorithm(algorithm_id), timeout=inference_timeout
+            )
+
+    def get_algorithm(self, algorithm_id):
+        '''
+        Returns the algorithm object, it is created by its factory if it is 
+        not loaded yet
+        '''
+        algorithm_object = self.endpoints.get(algorithm_id)
+        if algorithm_object is not None:
+            return algorithm_object
+
+        with self.load_lock:
+            algorithm_object = self.endpoints.get(algorithm_id)
+            if algorithm_object is None:
+                started_at = time.monotonic()
+                algorithm_object = self.factories[algorithm_id]()
+                self.endpoints[algorithm_id] = self.instrument(algorithm_id, algorithm_object)
+                logger.info(
+                    "Loaded algorithm %s in %.2f s",
+                    algorithm_id, time.monotonic() - started_at
+                )
+
+        return algorithm_object
+
+    def instrument(self, algorithm_id, algorithm_object):
+        '''
+        Reports the stage durations of the algorithm to the metrics
+        '''
+        if hasattr(algorithm_object, "stage_observer"):
+            algorithm_object.stage_observer = functools.partial(observe_stage, algorithm_id)
+        return algorithm_object
+
+    def count_predictions(self, algorithm_id, predictions):
+        for prediction in predictions:
+            PREDICTIONS.inc(str(algorithm_id), prediction.get("status", "Error"))
+
+    def configure_micro_batching(self, endpoint_name, max_batch_size=32, max_latency_ms=5):
+        '''
+        Coalesces the concurrent single record predictions of the endpoint's
+        algorithms into batches of up to max_batch_size records, collected
+        for up to max_latency_ms
+        '''
+        self.micro_batching[endpoint_name] = {
+            "max_batch_size": max_batch_size,
+            "max_latency_ms": max_latency_ms,
+        }
+
+    def get_batcher(self, algorithm_id):
+        '''
+        Returns the micro-batcher of the algorithm, or None if micro-batching
+        is not configured for its endpoint
+        '''
+        batcher = self.batchers.get(algorithm_id)
+        if batcher is not None:
+            return batcher
+
+        config = self.micro_batching.get(self.algorithm_endpoints.get(algorithm_id))
+        if config is None:
+            return None
+
+        with self.batchers_lock:
+            batcher = self.batchers.get(algorithm_id)
+            if batcher is None:
+                batcher = MicroBatcher(lambda: self.get_runner(algorithm_id), **config)
+                self.batchers[algorithm_id] = batcher
+
+        return batcher
+
+    def get_runner(self, algorithm_id):
+        '''
+        Returns the object that computes the predictions of the algorithm,
+        its process pool backend or the algorithm object
+        '''
+        backend = self.backends.get(algorithm_id)
+        if backend is not None:
+            return backend
+
+        return self.get_algorithm(algorithm_id)
+
+    def get_cache_key(self, algorithm_id, input_data, load=True):
+        '''
+        Returns the prediction cache key of the record, or None if the 
+        record is not cached. The key is built from the canonical input of
+        the algorithm, or from the sorted JSON of the record when the 
+        algorithm runs in a process pool. Without load the record is not 
+        cached while the algorithm is not loaded.
+        '''
+        if not isinstance(input_data, dict):
+            return None
+
+        if not load and algorithm_id not in self.backends and algorithm_id not in self.endpoints:
+            return None
+
+        try:
+            canonical_input = None
+            if algorithm_id not in self.backends:
+                canonical_input = getattr(self.get_algorithm(algorithm_id), "canonical_input", None)
+
+            if canonical_input is not None:
+                canonical_input = canonical_input(input_data)
+            else:
+                canonical_input = json.dumps(input_data, sort_keys=True)
+        except Exception:
+            # The record is invalid, its error is not cached
+            return None
+
+        return (algorithm_id, hash_input(canonical_input))
+
+    def get_cached_prediction(self, algorithm_id, input_data, load=True):
+        '''
+        Returns the prediction cache key of the record and its cached 
+        prediction, or None
+        '''
+        if self.prediction_cache is None:
+            return None, None
+
+        key = self.get_cache_key(algorithm_id, input_data, load=load)
+        if key is None:
+            return None, None
+
+        prediction = self.prediction_cache.get(key)
+        CACHE_LOOKUPS.inc(str(algorithm_id), "miss" if prediction is None else "hit")
+        return key, prediction
+
+    def store_prediction(self, algorithm_id, key, prediction):
+        '''
+        Counts the computed prediction and caches it under the key
+        '''
+        self.count_predictions(algorithm_id, [prediction])
+
+        if key is not None:
+            self.prediction_cache.set(key, prediction)
+
+    def compute_prediction(self, algorithm_id, input_data):
+        '''
+        Computes the prediction for one record, from the prediction cache if
+        it is configured, and through the micro-batcher if it is configured 
+        for the algorithm's endpoint
+        '''
+        key, prediction = self.get_cached_prediction(algorithm_id, input_data)
+        if prediction is not None:
+            return prediction
+
+        batcher = self.get_batcher(algorithm_id)
+        if batcher is not None:
+            prediction = batcher.compute_prediction(input_data)
+        else:
+            prediction = self.get_runner(algorithm_id).compute_prediction(input_data)
+
+        self.store_prediction(algorithm_id, key, prediction)
+        return prediction
+
+    def submit_prediction(self, algorithm_id, input_data, executor):
+        '''
+        Returns the future of the prediction for one record without blocking:
+        a cached prediction is returned at once, the other records go to the
+        micro-batcher if it is configured, or to the executor. The algorithm 
+        is loaded in the executor, and the records are not cached until 
+        it is loaded.
+        '''
+        key, prediction = self.get_cached_prediction(algorithm_id, input_data, load=False)
+        if prediction is not None:
+            future = Future()
+            future.set_result(prediction)
+            return future
+
+        batcher = self.get_batcher(algorithm_id)
+        if batcher is not None:
+            future = batcher.submit(input_data)
+        else:
+            future = executor.submit(
+                lambda: self.get_runner(algorithm_id).compute_prediction(input_data)
+            )
+
+        def store(future):
+            if not future.cancelled() and future.exception() is None:
+                self.store_prediction(algorithm_id, key, future.result())
+
+        future.add_done_callback(store)
+        return future
+
+    def compute_batch_prediction(self, algorithm_id, input_data):
+        '''
+        Computes the predictions for a list of records, only the records
+        that are not in the prediction cache are computed
+        '''
+        if self.prediction_cache is None:
+            predictions = self.get_runner(algorithm_id).compute_batch_prediction(input_data)
+            self.count_predictions(algorithm_id, predictions)
+            return predictions
+
+        keys = [self.get_cache_key(algorithm_id, record) for record in input_data]
+        predictions = [
+            self.prediction_cache.get(key) if key is not None else None
+            for key in keys
+        ]
+
+        for key, prediction in zip(keys, predictions):
+            if key is not None:
+                CACHE_LOOKUPS.inc(str(algorithm_id), "miss" if prediction is None else "hit")
+
+        missing = [index for index, prediction in enumerate(predictions) if prediction is None]
+        if missing:
+            computed = self.get_runner(algorithm_id).compute_batch_prediction(
+                [input_data[index] for index in missing]
+            )
+            self.count_predictions(algorithm_id, computed)
+            for index, prediction in zip(missing, computed):
+                predictions[index] = prediction
+                if keys[index] is not None:
+                    self.prediction_cache.set(keys[index], prediction)
+
+        return predictions
+
+    def warm_up(self, background=False):
+        '''
+        Loads all the algorithms that are not loaded yet. With background
+        the algorithms are loaded in a daemon thread, which is returned.
+        '''
+        if background:
+            thread = threading.Thread(target=self.warm_up, name="mlregistry-warm-up", daemon=True)
+            thread.start()
+            return thread
+
+        for algorithm_id in list(self.factories):
+            try:
+                if algorithm_id in self.backends:
+                    # Start the worker processes, the algorithm is only 
+                    # created here if the pool fails
+                    self.backends[algorithm_id].warm_up()
+                else:
+                    self.get_algorithm(algorithm_id)
+            except Exception:
+                # The algorithm is loaded again on first use
+                logger.exception("Failed to load algorithm %s", algorithm_id)
+
+    def get_status(self):
+        '''
+        Returns whether all the registered algorithms are loaded and the 
+        loaded flag of every algorithm
+        '''
+        algorithm_ids = sorted(set(self.endpoints) | set(self.factories))
+        algorithms = [
+            {
+                "id": algorithm_id,
+                "loaded": algorithm_id in self.endpoints or (
+                    algorithm_id in self.backends and self.backends[algorithm_id].loaded
+                )
+            }
+            for algorithm_id in algorithm_ids
+        ]
+        return {
+            "ready": all(algorithm["loaded"] for algorithm in algorithms),
+            "algorithms": algorithms,
+        }
+
+    def get_algorithm_ids(self, endpoint_name, algorithm_status, algorithm_version=None):
+        '''
+        Returns the ids of the algorithms with the active status for the 
+        endpoint, optionally filtered by version. The database is only 
+        queried the first time a route is used after an invalidation.
+        '''
+        algorithm_ids = self.get_cached_algorithm_ids(
+            endpoint_name, algorithm_status, algorithm_version
+        )
+        if algorithm_ids is not None:
+            return algorithm_ids
+
+        key = (endpoint_name, algorithm_status, algorithm_version)
+        generation = self.routes_generation
+
+        algs = MLAlgorithm.objects.filter(
+            parent_endpoint__name=endpoint_name,
+            status__status=algorithm_status,
+            status__active=True
+        )
+
+        # Get the algorithms that match the version
+        if algorithm_version is not None:
+            algs = algs.filter(version=algorithm_version)
+
+        algorithm_ids = tuple(algs.order_by("id").values_list("id", flat=True).distinct())
+
+        split = None
+        if algorithm_status == "ab_testing" and algorithm_ids:
+            split = self.load_split(algorithm_ids)
+
+        # Store the route only if no status changed in the meantime
+        with self.routes_lock:
+            if generation == self.routes_generation:
+                self.routes[key] = (algorithm_ids, time.monotonic())
+                if split is not None:
+                    self.splits[key] = split
+
+        return algorithm_ids
+
+    def load_split(self, algorithm_ids):
+        '''
+        Returns the AliasTable of the algorithms with the weights of their
+        arms in the running A/B tests, an algorithm without an arm has the 
+        weight 1
+        '''
+        # The arm of the latest test wins
+        weights = dict(
+            ABTestArm.objects.filter(
+                parent_mlalgorithm_id__in=algorithm_ids, ab_test__ended_at__isnull=True
+            ).order_by("ab_test_id").values_list("parent_mlalgorithm_id", "weight")
+        )
+
+        try:
+            return AliasTable(algorithm_ids, [weights.get(i, 1.0) for i in algorithm_ids])
+        except ValueError:
+            logger.warning("Invalid A/B test weights %s, splitting evenly", weights)
+            return AliasTable(algorithm_ids)
+
+    def get_split(self, endpoint_name, algorithm_status, algorithm_version=None):
+        '''
+        Returns the AliasTable of a loaded A/B testing route, or None
+        '''
+        return self.splits.get((endpoint_name, algorithm_status, algorithm_version))
+
+    def get_cached_algorithm_ids(self, endpoint_name, algorithm_status, algorithm_version=None):
+        '''
+        Returns the ids of the algorithms from the routing table without 
+        querying the database, or None if the route is not loaded
+        '''
+        route = self.routes.get((endpoint_name, algorithm_status, algorithm_version))
+        if route is None:
+            return None
+
+        algorithm_ids, loaded_at = route
+        if self.route_ttl is not None and time.monotonic() - loaded_at >= self.route_ttl:
+            return None
+
+        return algorithm_ids
+
+    def invalidate_routes(self):
+        '''
+        Clears the routing table and the prediction cache, it has to be 
+        called whenever the status of an algorithm changes
+        '''
+        with self.routes_lock:
+            self.routes_generation += 1
+            self.routes = {}
+            self.splits = {}
+
+        if self.prediction_cache is not None:
+            self.prediction_cache.clear()
@@ -1,7 +1,26 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
+import functools
 import inspect
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 from apps.ml.registry import MLRegistry
+from apps.ml.batching import MicroBatcher
+from apps.ml.process_backend import ProcessPoolBackend
+from apps.ml.cache import PredictionCache
+from apps.ml.metrics import PREDICTIONS
+from apps.ml.traffic import AliasTable
+from apps.ml.benchmarks.workload import load_workload, synthetic_workload
+from apps.endpoints.models import MLAlgorithm, MLAlgorithmStatus, MLRequest
 
+from apps.ml.income_classifier import base
 from apps.ml.income_classifier.random_forest import RandomForestClassifier
 from apps.ml.income_classifier.extra_trees import ExtraTreesClassifier
 
@@ -92,4 +111,620 @@ class MLTests(TestCase):
         response = my_alg.compute_prediction(input_data)
         self.assertEqual('OK', response['status'])
         self.assertTrue('label' in response)
-        self.assertEqual('<=50K', response['label'])
\ No newline at end of file
+        self.assertEqual('<=50K', response['label'])
+
+    def test_rf_batch_algorithm(self):
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+        my_alg = RandomForestClassifier()
+        single_response = my_alg.compute_prediction(input_data)
+        responses = my_alg.compute_batch_prediction([input_data, input_data])
+        self.assertEqual(2, len(responses))
+        for response in responses:
+            self.assertEqual('OK', response['status'])
+            self.assertEqual('<=50K', response['label'])
+            self.assertAlmostEqual(single_response['probability'], response['probability'])
+
+        # An invalid record gets its own error status
+        responses = my_alg.compute_batch_prediction([input_data, dict(input_data, age="unknown")])
+        self.assertEqual('OK', responses[0]['status'])
+        self.assertEqual('Error', responses[1]['status'])
+
+        # The records are reordered to the training columns, the batch is not
+        # computed record by record
+        records = synthetic_workload(50)
+        shuffled = [dict(reversed(list(record.items()))) for record in records]
+        expected = my_alg.compute_batch_prediction(records)
+        with mock.patch.object(my_alg, "compute_prediction", side_effect=AssertionError):
+            self.assertEqual(expected, my_alg.compute_batch_prediction(shuffled))
+
+        # An unknown field is only an error of its record
+        responses = my_alg.compute_batch_prediction([input_data, dict(input_data, color="red")])
+        self.assertEqual('OK', responses[0]['status'])
+        self.assertIn('Unknown fields', responses[1]['message'])
+
+    def test_registry_routes(self):
+        registry = MLRegistry()
+        registry.add_algorithm(
+            "routing_classifier", RandomForestClassifier(), "random forest",
+            "production", "0.0.1", "TR",
+            "Random Forest with simple pre- and post-processing",
+            inspect.getsource(RandomForestClassifier)
+        )
+        algorithm_id = list(registry.endpoints.keys())[0]
+
+        # The route is loaded from the database once and then cached
+        self.assertEqual(
+            (algorithm_id,), registry.get_algorithm_ids("routing_classifier", "production")
+        )
+        with self.assertNumQueries(0):
+            registry.get_algorithm_ids("routing_classifier", "production")
+            registry.get_algorithm_ids("routing_classifier", "production")
+
+        self.assertEqual(
+            (), registry.get_algorithm_ids("routing_classifier", "production", "0.0.2")
+        )
+
+        # Changing the status is only visible after an invalidation
+        MLAlgorithmStatus.objects.filter(parent_mlalgorithm_id=algorithm_id).update(active=False)
+        self.assertEqual(
+            (algorithm_id,), registry.get_algorithm_ids("routing_classifier", "production")
+        )
+        registry.invalidate_routes()
+        self.assertEqual(
+            (), registry.get_algorithm_ids("routing_classifier", "production")
+        )
+
+    def test_registry_code_change(self):
+        # A new version of the code updates the registered algorithm
+        for code in ("def first(): pass", "def second(): pass"):
+            registry = MLRegistry()
+            registry.add_algorithm(
+                "code_classifier", RandomForestClassifier(), "random forest",
+                "production", "0.0.1", "TR", "Random Forest", code
+            )
+
+        algorithms = MLAlgorithm.objects.filter(parent_endpoint__name="code_classifier")
+        self.assertEqual(algorithms.count(), 1)
+        self.assertEqual(algorithms.get().code, "def second(): pass")
+        self.assertEqual(
+            MLAlgorithmStatus.objects.filter(parent_mlalgorithm__in=algorithms, active=True).count(), 1
+        )
+        self.assertEqual(
+            (algorithms.get().id,), registry.get_algorithm_ids("code_classifier", "production")
+        )
+
+    def test_unseen_category(self):
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+        unseen_data = dict(input_data, **{"native-country": "Atlantis"})
+
+        # The mode policy encodes unseen categories as the training mode
+        my_alg = RandomForestClassifier(unseen_category="mode")
+        response = my_alg.compute_prediction(unseen_data)
+        self.assertEqual('OK', response['status'])
+        self.assertAlmostEqual(
+            my_alg.compute_prediction(input_data)['probability'], response['probability']
+        )
+        responses = my_alg.compute_batch_prediction([input_data, unseen_data])
+        self.assertEqual(['OK', 'OK'], [r['status'] for r in responses])
+
+        # The default error policy rejects them, and the missing categories
+        my_alg = RandomForestClassifier()
+        response = my_alg.compute_prediction(unseen_data)
+        self.assertEqual('Error', response['status'])
+        self.assertTrue('Atlantis' in response['message'])
+        for missing_data in ({}, dict(input_data, workclass=None)):
+            self.assertEqual('Error', my_alg.compute_prediction(missing_data)['status'])
+        responses = my_alg.compute_batch_prediction([input_data, unseen_data, {}])
+        self.assertEqual(['OK', 'Error', 'Error'], [r['status'] for r in responses])
+
+    def test_shared_artifacts(self):
+        rf = RandomForestClassifier()
+        et = ExtraTreesClassifier()
+
+        # The preprocessing state is loaded once per process
+        self.assertIs(rf.values_fill_missing, et.values_fill_missing)
+        self.assertIs(rf.encoders, et.encoders)
+        self.assertIs(rf.categorical_encoder, et.categorical_encoder)
+        self.assertIs(rf.model, RandomForestClassifier().model)
+        self.assertIsNot(rf.model, et.model)
+
+    def test_mmap_artifacts(self):
+        with tempfile.TemporaryDirectory() as mmap_dir:
+            with mock.patch.object(base, "PATH_TO_MMAP_ARTIFACTS", mmap_dir + "/"):
+                mmap_path = base.convert_artifact("train_mode.joblib")
+                self.assertTrue(os.path.exists(mmap_path))
+
+                with mock.patch.object(base.joblib, "load", wraps=base.joblib.load) as load:
+                    values_fill_missing = base.read_artifact("train_mode.joblib")
+                load.assert_called_once_with(mmap_path, mmap_mode="r")
+                self.assertEqual(values_fill_missing, base.load_artifact("train_mode.joblib"))
+
+                # A copy older than the artifact is not used
+                os.utime(mmap_path, (0, 0))
+                with mock.patch.object(base.joblib, "load", wraps=base.joblib.load) as load:
+                    base.read_artifact("train_mode.joblib")
+                load.assert_called_once_with(base.PATH_TO_ARTIFACTS + "train_mode.joblib")
+
+    def test_registry_lazy_loading(self):
+        registry = MLRegistry()
+        factory = mock.Mock(side_effect=RandomForestClassifier)
+        registry.add_algorithm(
+            "lazy_classifier", None, "random forest",
+            "production", "0.0.1", "TR",
+            "Random Forest with simple pre- and post-processing",
+            inspect.getsource(RandomForestClassifier),
+            algorithm_factory=factory
+        )
+        algorithm_id = list(registry.factories.keys())[0]
+
+        # The algorithm is not created until it is used
+        factory.assert_not_called()
+        self.assertEqual(len(registry.endpoints), 0)
+        self.assertFalse(registry.get_status()["ready"])
+
+        algorithm_object = registry.get_algorithm(algorithm_id)
+        self.assertIsInstance(algorithm_object, RandomForestClassifier)
+        self.assertIs(algorithm_object, registry.get_algorithm(algorithm_id))
+        factory.assert_called_once_with()
+        self.assertEqual(
+            {"ready": True, "algorithms": [{"id": algorithm_id, "loaded": True}]},
+            registry.get_status()
+        )
+
+    def test_registry_warm_up(self):
+        registry = MLRegistry()
+        registry.add_algorithm(
+            "warm_up_classifier", None, "random forest",
+            "production", "0.0.1", "TR",
+            "Random Forest with simple pre- and post-processing",
+            inspect.getsource(RandomForestClassifier),
+            algorithm_factory=RandomForestClassifier
+        )
+        registry.add_algorithm(
+            "warm_up_classifier", None, "broken",
+            "testing", "0.0.1", "TR", "Fails to load", "",
+            algorithm_factory=mock.Mock(side_effect=IOError("missing artifact"))
+        )
+
+        # A failing algorithm does not stop the warm-up of the others
+        with self.assertLogs("apps.ml.registry", level="ERROR"):
+            registry.warm_up(background=True).join()
+        loaded = [algorithm["loaded"] for algorithm in registry.get_status()["algorithms"]]
+        self.assertEqual([True, False], loaded)
+
+    def test_micro_batching(self):
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+        my_alg = RandomForestClassifier()
+        batch_sizes = []
+
+        def compute_batch_prediction(records):
+            batch_sizes.append(len(records))
+            return RandomForestClassifier.compute_batch_prediction(my_alg, records)
+
+        my_alg.compute_batch_prediction = compute_batch_prediction
+
+        # The queued records are computed in batches of up to four
+        batcher = MicroBatcher(lambda: my_alg, max_batch_size=4, max_latency_ms=200)
+        records = [dict(input_data, age=age) for age in range(30, 40)]
+        futures = [batcher.submit(record) for record in records]
+        predictions = [future.result(timeout=10) for future in futures]
+
+        self.assertEqual([4, 4, 2], batch_sizes)
+        for record, prediction in zip(records, predictions):
+            self.assertEqual(my_alg.compute_prediction(record), prediction)
+
+        # The batcher is created while an algorithm is being loaded
+        registry = MLRegistry()
+        registry.add_algorithm(
+            "batched_classifier", my_alg, "random forest",
+            "production", "0.0.1", "TR", "Random Forest", "code"
+        )
+        registry.configure_micro_batching("batched_classifier")
+        algorithm_id = list(registry.endpoints.keys())[0]
+        with registry.load_lock:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                batcher = executor.submit(registry.get_batcher, algorithm_id).result(timeout=5)
+        self.assertIsInstance(batcher, MicroBatcher)
+
+    def test_micro_batching_error(self):
+        broken_alg = mock.Mock()
+        broken_alg.compute_batch_prediction.side_effect = ValueError("broken model")
+        batcher = MicroBatcher(lambda: broken_alg, max_batch_size=2, max_latency_ms=1)
+
+        with self.assertLogs("apps.ml.batching", level="ERROR"):
+            prediction = batcher.compute_prediction({"age": 37})
+        self.assertEqual({"status": "Error", "message": "broken model"}, prediction)
+
+    def test_micro_batching_cancel(self):
+        algorithm = mock.Mock()
+        algorithm.compute_batch_prediction.side_effect = lambda records: records
+        released = threading.Event()
+
+        def load_algorithm():
+            released.wait(timeout=5)
+            return algorithm
+
+        # The second record is cancelled while the first batch is computed
+        batcher = MicroBatcher(load_algorithm, max_batch_size=1, max_latency_ms=1)
+        first = batcher.submit(1)
+        cancelled = batcher.submit(2)
+        self.assertTrue(cancelled.cancel())
+        released.set()
+
+        self.assertEqual(1, first.result(timeout=5))
+        self.assertEqual(3, batcher.submit(3).result(timeout=5))
+        self.assertTrue(batcher.thread.is_alive())
+
+        # A failure to answer a batch does not end the thread
+        algorithm.compute_batch_prediction.side_effect = lambda records: None
+        with self.assertLogs("apps.ml.batching", level="ERROR"):
+            self.assertEqual("Error", batcher.submit(4).result(timeout=5)["status"])
+
+        algorithm.compute_batch_prediction.side_effect = lambda records: records
+        self.assertEqual(5, batcher.submit(5).result(timeout=5))
+
+    def test_process_backend(self):
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+        expected = RandomForestClassifier().compute_prediction(input_data)
+
+        fallback = mock.Mock(side_effect=RandomForestClassifier)
+        backend = ProcessPoolBackend(RandomForestClassifier, processes=1, fallback=fallback)
+        try:
+            # The pool is only loaded once a worker has created its algorithm
+            backend.get_executor()
+            self.assertFalse(backend.loaded)
+            self.assertTrue(backend.warm_up())
+            self.assertTrue(backend.loaded)
+            self.assertEqual(expected, backend.compute_prediction(input_data))
+            self.assertEqual([expected], backend.compute_batch_prediction([input_data]))
+        finally:
+            backend.close()
+        fallback.assert_not_called()
+
+    def test_process_backend_fallback(self):
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+        expected = RandomForestClassifier().compute_prediction(input_data)
+
+        # The worker process dies while it starts, so the pool breaks
+        backend = ProcessPoolBackend(
+            functools.partial(os._exit, 1), processes=1,
+            fallback=RandomForestClassifier
+        )
+        with self.assertLogs("apps.ml.process_backend", level="ERROR"):
+            self.assertEqual(expected, backend.compute_prediction(input_data))
+        self.assertFalse(backend.started)
+
+        # The fallback is used until the retry interval has passed
+        self.assertEqual(expected, backend.compute_prediction(input_data))
+        self.assertFalse(backend.started)
+
+        # A factory that cannot be sent to the worker processes
+        backend = ProcessPoolBackend(lambda: RandomForestClassifier(), processes=1)
+        with self.assertLogs("apps.ml.process_backend", level="ERROR"):
+            self.assertEqual(expected, backend.compute_prediction(input_data))
+
+        # The worker process is stuck while it starts, the pool times out
+        backend = ProcessPoolBackend(
+            functools.partial(time.sleep, 60), processes=1,
+            fallback=RandomForestClassifier, timeout=1
+        )
+        with self.assertLogs("apps.ml.process_backend", level="ERROR"):
+            self.assertEqual(expected, backend.compute_prediction(input_data))
+        self.assertFalse(backend.started)
+        self.assertFalse(backend.loaded)
+
+    def test_prediction_cache(self):
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+        algorithm_object = RandomForestClassifier(unseen_category="mode")
+        expected = algorithm_object.compute_prediction(input_data)
+
+        cache = PredictionCache(max_size=2)
+        registry = MLRegistry(prediction_cache=cache)
+        registry.add_algorithm(
+            "cached_classifier", algorithm_object, "random forest",
+            "production", "0.0.1", "TR",
+            "Random Forest with simple pre- and post-processing",
+            inspect.getsource(RandomForestClassifier)
+        )
+        algorithm_id = list(registry.endpoints.keys())[0]
+
+        self.assertEqual(expected, registry.compute_prediction(algorithm_id, input_data))
+
+        # A record with the same preprocessed input is served from the cache
+        same_input = dict(input_data, workclass=None)
+        same_input["native-country"] = "Atlantis"
+        with mock.patch.object(algorithm_object, "predict") as predict:
+            self.assertEqual(expected, registry.compute_prediction(algorithm_id, same_input))
+            self.assertEqual([expected] * 2, registry.compute_batch_prediction(algorithm_id, [input_data] * 2))
+            predict.assert_not_called()
+        self.assertEqual(cache.stats()["hits"], 3)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+        # Errors are not cached, and the least recently used entry is evicted
+        registry.compute_prediction(algorithm_id, dict(input_data, age="unknown"))
+        registry.compute_prediction(algorithm_id, dict(input_data, age=38))
+        registry.compute_prediction(algorithm_id, dict(input_data, age=39))
+        self.assertEqual(cache.stats()["size"], 2)
+        self.assertIsNone(cache.get(registry.get_cache_key(algorithm_id, input_data)))
+
+        # Status changes clear the cache
+        registry.invalidate_routes()
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_submit_prediction_cache(self):
+        input_data = synthetic_workload(1)[0]
+        algorithm_object = RandomForestClassifier()
+        expected = algorithm_object.compute_prediction(input_data)
+
+        cache = PredictionCache()
+        registry = MLRegistry(prediction_cache=cache)
+        registry.add_algorithm(
+            "submitted_classifier", algorithm_object, "random forest",
+            "production", "0.0.1", "TR", "Random Forest", "code"
+        )
+        algorithm_id = list(registry.endpoints.keys())[0]
+        predictions = lambda: PREDICTIONS.get(str(algorithm_id), "OK")
+        counted = predictions()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # The executor path fills the cache and counts the prediction
+            self.assertEqual(expected, registry.submit_prediction(algorithm_id, input_data, executor).result())
+
+            # The micro-batcher path reads the cache
+            registry.configure_micro_batching("submitted_classifier")
+            with mock.patch.object(algorithm_object, "predict") as predict:
+                future = registry.submit_prediction(algorithm_id, input_data, executor)
+                self.assertTrue(future.done())
+                self.assertEqual(expected, future.result())
+                predict.assert_not_called()
+
+            # A computed prediction of the micro-batcher is counted and cached
+            other_input = dict(input_data, age=input_data["age"] + 1)
+            registry.submit_prediction(algorithm_id, other_input, executor).result()
+
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["size"], 2)
+        self.assertEqual(predictions() - counted, 2)
+
+    def test_single_row_preprocessing(self):
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": None
+        }
+        my_alg = RandomForestClassifier(unseen_category="mode")
+
+        # The NumPy row matches the DataFrame of the batch path
+        row = my_alg.preprocessing(input_data)
+        frame = my_alg.preprocessing([input_data])
+        self.assertEqual(row.shape, (1, 14))
+        self.assertTrue(row.flags["C_CONTIGUOUS"])
+        self.assertEqual(list(frame.columns), my_alg.columns)
+        self.assertTrue((row == frame.to_numpy(dtype="float32")).all())
+        self.assertEqual(
+            my_alg.compute_prediction(input_data),
+            my_alg.compute_batch_prediction([input_data])[0]
+        )
+
+        response = my_alg.compute_prediction(dict(input_data, color="blue"))
+        self.assertEqual("Error", response["status"])
+
+    def test_packed_forest(self):
+        input_data = {
+            "age": 37,
+            "workclass": "Private",
+            "fnlwgt": 34146,
+            "education": "HS-grad",
+            "education-num": 9,
+            "marital-status": "Married-civ-spouse",
+            "occupation": "Craft-repair",
+            "relationship": "Husband",
+            "race": "White",
+            "sex": "Male",
+            "capital-gain": 0,
+            "capital-loss": 0,
+            "hours-per-week": 68,
+            "native-country": "United-States"
+        }
+        records = [
+            dict(
+                input_data, age=age, fnlwgt=34146 + 997 * age,
+                education=education, sex=sex,
+                **{"hours-per-week": age % 60 + 10, "capital-gain": 50 * age % 7000}
+            )
+            for age in range(17, 90)
+            for education, sex in [("HS-grad", "Male"), ("Bachelors", "Female"), ("Masters", "Male")]
+        ]
+
+        for classifier in (RandomForestClassifier, ExtraTreesClassifier):
+            my_alg = classifier(inference_engine="packed")
+            packed_forest = my_alg.packed_forest
+
+            # The packed trees give the probabilities of predict_proba
+            input_frame = my_alg.preprocessing(records)
+            expected = my_alg.model.predict_proba(input_frame)
+            self.assertTrue((expected == packed_forest.predict_proba(input_frame)).all())
+            self.assertTrue(
+                (my_alg.model.apply(input_frame) == packed_forest.apply(input_frame) - packed_forest.roots).all()
+            )
+
+            sklearn_alg = classifier()
+            self.assertEqual(
+                sklearn_alg.compute_prediction(input_data), my_alg.compute_prediction(input_data)
+            )
+            self.assertEqual(
+                sklearn_alg.compute_batch_prediction(records[:100]),
+                my_alg.compute_batch_prediction(records[:100])
+            )
+
+        with self.assertRaises(ValueError):
+            RandomForestClassifier(inference_engine="treelite")
+
+    def test_benchmark_predictions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            workload = os.path.join(directory, "requests.jsonl")
+            with open(workload, "w") as workload_file:
+                for record in synthetic_workload(30):
+                    workload_file.write(json.dumps({"input_data": record}) + "\n")
+
+            baseline = os.path.join(directory, "baseline.json")
+            call_command(
+                "benchmark_predictions", workload=workload, batch_size=[10],
+                engine=["packed"], output=baseline, stdout=io.StringIO()
+            )
+            with open(baseline) as baseline_file:
+                results = json.load(baseline_file)
+            self.assertEqual(results["workload"]["records"], 30)
+            self.assertEqual(
+                set(results["benchmarks"]),
+                {
+                    "random_forest.packed.single", "random_forest.packed.batch_10",
+                    "extra_trees.packed.single", "extra_trees.packed.batch_10",
+                    "predict_view",
+                }
+            )
+            self.assertEqual(results["benchmarks"]["predict_view"]["calls"], 30)
+
+            stdout = io.StringIO()
+            call_command(
+                "benchmark_predictions", workload=workload, batch_size=[10],
+                engine=["packed"], skip_view=True, baseline=baseline,
+                output=os.path.join(directory, "results.json"), stdout=stdout
+            )
+            self.assertEqual(stdout.getvalue().count("throughput"), 4)
+
+        # The requests of the predict view are rolled back
+        self.assertEqual(MLRequest.objects.count(), 0)
+
+    def test_load_workload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            workload = os.path.join(directory, "requests.jsonl")
+            with open(workload, "w") as workload_file:
+                workload_file.write('{"input_data": {"age": 37}}\n\n{"age": 38}\n[1, 2]\n')
+
+            with self.assertRaisesRegex(CommandError, "line 4"):
+                load_workload(workload)
+            self.assertEqual([{"age": 37}, {"age": 38}], load_workload(workload, limit=2))
+
+    def test_alias_table(self):
+        table = AliasTable(["a", "b", "c"], [3, 1, 0])
+
+        # The uniform numbers of a fine grid are split by the weights
+        steps = 10000
+        choices = [table.choose((step + 0.5) / steps) for step in range(steps)]
+        self.assertAlmostEqual(choices.count("a") / steps, 0.75, places=3)
+        self.assertAlmostEqual(choices.count("b") / steps, 0.25, places=3)
+        self.assertEqual(choices.count("c"), 0)
+
+        # A client key always gets the same item, the keys follow the weights
+        self.assertEqual(
+            {table.choose_sticky("client-1") for _ in range(10)}, {table.choose_sticky("client-1")}
+        )
+        sticky = [table.choose_sticky("client-{}".format(i)) for i in range(4000)]
+        self.assertAlmostEqual(sticky.count("a") / 4000, 0.75, delta=0.03)
+
+        self.assertEqual(AliasTable([7]).choose_random(), 7)
+        for items, weights in (([], None), (["a"], [0]), (["a", "b"], [1])):
+            with self.assertRaises(ValueError):
+                AliasTable(items, weights)
@@ -0,0 +1,86 @@
+'''
+Weighted traffic splitting between the algorithms of an A/B test.
+
+The weights are precomputed into an alias table (Vose's method), so an
+algorithm is chosen in O(1) time with one uniform number, whatever the
+number of algorithms. The number comes from random.random(), or from the
+hash of a client key so that a client always gets the same algorithm
+while the weights do not change.
+'''
+
+# Imports
+import hashlib
+import random
+
+class AliasTable:
+    '''
+    Attributes:
+        items: the items to choose from
+        probabilities: the probability of keeping the item of a column
+        aliases: the index of the other item of a column
+        salt: the prefix of the hashed client keys, so that the same client
+            is not always in the same share of traffic of every split
+    '''
+
+    def __init__(self, items, weights=None):
+        if not items:
+            raise ValueError("An alias table needs at least one item.")
+
+        if weights is None:
+            weights = [1.0] * len(items)
+        if len(weights) != len(items) or any(weight < 0 for weight in weights):
+            raise ValueError("Expected one non-negative weight per item.")
+
+        total = float(sum(weights))
+        if total <= 0:
+            raise ValueError("At least one weight must be positive.")
+
+        self.items = tuple(items)
+        self.salt = ",".join(str(item) for item in self.items).encode("utf-8")
+
+        count = len(self.items)
+        scaled = [weight * count / total for weight in weights]
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+
+        small = [index for index, value in enumerate(scaled) if value < 1.0]
+        large = [index for index, value in enumerate(scaled) if value >= 1.0]
+
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+
+            # The large item gives the rest of the column to the small one
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+        # The remaining columns are full, up to rounding errors
+        for index in small + large:
+            self.probabilities[index] = 1.0
+
+    def choose(self, uniform):
+        '''
+        Returns the item of a uniform number in [0, 1)
+        '''
+        position = uniform * len(self.items)
+        column = min(int(position), len(self.items) - 1)
+        if position - column < self.probabilities[column]:
+            return self.items[column]
+        return self.items[self.aliases[column]]
+
+    def choose_random(self):
+        return self.choose(random.random())
+
+    def choose_sticky(self, key):
+        '''
+        Returns the item of a client key, the same key always gets the
+        same item
+        '''
+        digest = hashlib.blake2b(
+            self.salt + b":" + str(key).encode("utf-8"), digest_size=8
+        ).digest()
+        return self.choose(int.from_bytes(digest, "big") / 2.0 ** 64)
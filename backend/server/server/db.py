@@ -0,0 +1,66 @@
+'''
+Database tuning and read replicas.
+
+The SQLite connections are switched to WAL mode when they are opened, so
+readers do not block the writer, with synchronous=NORMAL (WAL is durable
+at checkpoints) and a busy timeout instead of immediate "database is
+locked" errors. The pragmas are set with the SQLITE_PRAGMAS setting.
+
+The read replicas are the databases whose alias starts with "replica".
+The reads and the writes go to the default database, so every request
+sees its own writes, and the list and export views read from a replica
+with get_replica_alias.
+'''
+
+# Imports
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+REPLICA_PREFIX = "replica"
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute("PRAGMA {} = {}".format(pragma, value))
+
+def get_replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith(REPLICA_PREFIX)]
+
+def get_replica_alias():
+    '''
+    Returns the alias of a random read replica, or the default database if
+    there are no replicas
+    '''
+    replicas = get_replica_aliases()
+    if not replicas:
+        return DEFAULT_DB_ALIAS
+    return random.choice(replicas)
+
+class PrimaryReplicaRouter:
+    '''
+    Writes and migrates the default database only, the replicas are copies
+    of it, so objects read from any of them can be related
+    '''
+
+    def db_for_read(self, model, **hints):
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return not db.startswith(REPLICA_PREFIX)
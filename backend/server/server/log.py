@@ -0,0 +1,134 @@
+'''
+Structured, sampled and non-blocking logging, configured with the LOGGING
+setting.
+
+JsonFormatter writes every record as one JSON object with the fields given
+in extra. SamplingFilter keeps a share of the records of the configured
+loggers, records at WARNING and above are always kept. QueueStreamHandler
+only queues the records in the request thread, they are formatted and
+written to the stream by a background thread, and dropped when the queue
+is full.
+'''
+
+# Imports
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+# The attributes of every LogRecord, the other attributes come from extra
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        fields = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        if record.exc_info:
+            fields["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            fields["exception"] = record.exc_text
+
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES and not name.startswith("_"):
+                fields[name] = value
+
+        return json.dumps(fields, default=str)
+
+class SamplingFilter(logging.Filter):
+    '''
+    Attributes:
+        rates: maps logger name to the share of its records that are kept,
+            it applies to the child loggers too, the records of the other
+            loggers are all kept
+        always_level: the records at this level and above are always kept
+    '''
+
+    def __init__(self, rates=None, always_level=logging.WARNING):
+        super().__init__()
+        self.rates = rates or {}
+        self.always_level = always_level
+
+        # Maps logger name to the rate of its closest configured parent
+        self.logger_rates = {}
+
+    def get_rate(self, name):
+        rate = self.logger_rates.get(name)
+        if rate is None:
+            rate = 1.0
+            parent = name
+            while parent:
+                if parent in self.rates:
+                    rate = self.rates[parent]
+                    break
+                parent = parent.rpartition(".")[0]
+            self.logger_rates[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= self.always_level:
+            return True
+
+        rate = self.get_rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+class QueueStreamHandler(logging.handlers.QueueHandler):
+    '''
+    Attributes:
+        stream: the stream of the records, sys.stderr by default
+        max_queue_size: the maximum number of queued records, the records
+            are dropped when the queue is full
+        dropped: the number of dropped records
+    '''
+
+    def __init__(self, stream=None, max_queue_size=10000):
+        super().__init__(queue.Queue(maxsize=max_queue_size))
+        self.stream_handler = logging.StreamHandler(stream)
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+
+    def setFormatter(self, fmt):
+        # The records are formatted by the background thread
+        self.stream_handler.setFormatter(fmt)
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(self.queue, self.stream_handler)
+        self.listener.start()
+        self.pid = os.getpid()
+
+    def enqueue(self, record):
+        # Forked worker processes start their own thread
+        if self.pid != os.getpid():
+            self.start()
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # The message is merged with its arguments in the calling thread,
+        # the extra fields and the exception are kept for the formatter
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def close(self):
+        if self.listener is not None and self.pid == os.getpid():
+            # Writes the queued records and stops the thread
+            self.listener.stop()
+        self.listener = None
+        self.stream_handler.close()
+        super().close()
@@ -0,0 +1,101 @@
+'''
+Adds ML Algorithms to the registry when the server starts. The registry is
+created by both the WSGI and the ASGI applications.
+
+The algorithms are created by their factories on first use or by the 
+warm-up configured with the ML_REGISTRY setting.
+'''
+
+import functools
+import inspect
+import logging
+
+from django.conf import settings
+
+from apps.ml.cache import PredictionCache, SharedPredictionCache
+from apps.ml.registry import MLRegistry
+from apps.ml.income_classifier.random_forest import RandomForestClassifier
+from apps.ml.income_classifier.extra_trees import ExtraTreesClassifier
+
+logger = logging.getLogger(__name__)
+
+# Cache the predictions of repeated records if configured
+prediction_cache = None
+if settings.ML_PREDICTION_CACHE.get("ENABLED", False):
+    shared_cache = None
+    if settings.ML_PREDICTION_CACHE.get("SHARED_CACHE"):
+        shared_cache = SharedPredictionCache(
+            settings.ML_PREDICTION_CACHE["SHARED_CACHE"],
+            ttl=settings.ML_PREDICTION_CACHE.get("TTL", 300)
+        )
+    prediction_cache = PredictionCache(
+        max_size=settings.ML_PREDICTION_CACHE.get("MAX_SIZE", 10000),
+        ttl=settings.ML_PREDICTION_CACHE.get("TTL", 300),
+        shared=shared_cache
+    )
+
+# Create a registry instance, the routes are reloaded after the ttl so 
+# that status changes made in other worker processes are picked up
+registry = MLRegistry(
+    route_ttl=settings.ML_REGISTRY.get("ROUTE_TTL"),
+    prediction_cache=prediction_cache
+)
+
+try:
+    # Adding the Random Forest Classifier
+    registry.add_algorithm(
+        endpoint_name="income_classifier",
+        algorithm_object=None,
+        algorithm_name="random forest",
+        algorithm_status="production",
+        algorithm_version="0.0.1",
+        owner="TR",
+        algorithm_description="Random forest with simple pre- and post- processing",
+        algorithm_code=inspect.getsource(RandomForestClassifier),
+        algorithm_factory=functools.partial(
+            RandomForestClassifier,
+            unseen_category=settings.ML_REGISTRY.get("UNSEEN_CATEGORY", "error"),
+            inference_engine=settings.ML_REGISTRY.get("INFERENCE_ENGINE", "sklearn")
+        ),
+        inference_backend=settings.ML_REGISTRY.get("INFERENCE_BACKEND"),
+        inference_processes=settings.ML_REGISTRY.get("INFERENCE_PROCESSES", 2),
+        inference_timeout=settings.ML_REGISTRY.get("INFERENCE_TIMEOUT", 10)
+    )
+
+    # Adding the Extra Trees Classifier
+    registry.add_algorithm(
+        endpoint_name="income_classifier",
+        algorithm_object=None,
+        algorithm_name="extra trees",
+        algorithm_status="testing",
+        algorithm_version="0.0.1",
+        owner="TR",
+        algorithm_description="Extra Trees with simple pre- and post-processing",
+        algorithm_code=inspect.getsource(ExtraTreesClassifier),
+        algorithm_factory=functools.partial(
+            ExtraTreesClassifier,
+            unseen_category=settings.ML_REGISTRY.get("UNSEEN_CATEGORY", "error"),
+            inference_engine=settings.ML_REGISTRY.get("INFERENCE_ENGINE", "sklearn")
+        ),
+        inference_backend=settings.ML_REGISTRY.get("INFERENCE_BACKEND"),
+        inference_processes=settings.ML_REGISTRY.get("INFERENCE_PROCESSES", 2),
+        inference_timeout=settings.ML_REGISTRY.get("INFERENCE_TIMEOUT", 10)
+    )
+
+except Exception:
+    logger.exception("Exception while loading the algorithms to the registry")
+
+# Coalesce concurrent predictions into batches for the configured endpoints
+for endpoint_name, config in settings.ML_MICRO_BATCHING.items():
+    registry.configure_micro_batching(
+        endpoint_name,
+        max_batch_size=config.get("MAX_BATCH_SIZE", 32),
+        max_latency_ms=config.get("MAX_LATENCY_MS", 5)
+    )
+
+# Load the algorithms before the first request if configured
+warm_up = settings.ML_REGISTRY.get("WARM_UP", "background")
+if warm_up == "eager":
+    registry.warm_up()
+elif warm_up == "background":
+    registry.warm_up(background=True)
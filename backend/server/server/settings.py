@@ -10,12 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 # BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-print(BASE_DIR)
 
 
 # Quick-start development settings - unsuitable for production
@@ -80,11 +80,216 @@ WSGI_APPLICATION = 'server.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# The database is configured with environment variables: DB_ENGINE (the 
+# SQLite file by default), DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT,
+# DB_CONN_MAX_AGE (the number of seconds a connection is reused) and 
+# DB_REPLICA_HOSTS, a comma separated list of the hosts of read replicas 
+# of a server database. Put a pooler such as PgBouncer in front of a 
+# server database with many worker processes.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'django.db.backends.sqlite3')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # Seconds to wait for the write lock
+                'timeout': 20,
+            },
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.environ.get('DB_NAME', 'server'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+
+    for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+        DATABASES['replica_{}'.format(index)] = dict(
+            DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'}
+        )
+
+DATABASE_ROUTERS = ['server.db.PrimaryReplicaRouter']
+
+# Set on every new SQLite connection, see server/db.py
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+}
+
+
+# ML registry
+# WARM_UP sets when the algorithms are loaded: "eager" while the server 
+# starts, "background" in a thread after the server starts, or "lazy" on 
+# first use. ROUTE_TTL is the number of seconds after which a route is 
+# reloaded from the database, None keeps routes until they are invalidated.
+# INFERENCE_BACKEND "process" runs the inference in a pool of 
+# INFERENCE_PROCESSES worker processes per web worker, None runs it in the 
+# request thread. A pool that does not answer within INFERENCE_TIMEOUT 
+# seconds is restarted and the prediction is computed in the web worker.
+# INFERENCE_ENGINE "sklearn" always uses predict_proba, the opt-in 
+# "packed" evaluates single records and small batches with the trees packed
+# into NumPy arrays, see apps/ml/forest_engine.py.
+# UNSEEN_CATEGORY "error" rejects the records with missing or unseen 
+# categories, "mode" encodes them as the most frequent training category.
+
+ML_REGISTRY = {
+    'WARM_UP': 'background',
+    'ROUTE_TTL': 60,
+    'INFERENCE_BACKEND': None,
+    'INFERENCE_PROCESSES': 2,
+    'INFERENCE_TIMEOUT': 10,
+    'INFERENCE_ENGINE': 'sklearn',
+    'UNSEEN_CATEGORY': 'error',
+}
+
+
+# ML micro-batching
+# Maps endpoint name to the micro-batching configuration. Concurrent single 
+# record predictions are collected for up to MAX_LATENCY_MS or until 
+# MAX_BATCH_SIZE records are queued and computed with one predict_proba 
+# call. It only helps when a process serves concurrent requests (threaded 
+# workers or the ASGI application), for example:
+#     'income_classifier': {'MAX_BATCH_SIZE': 32, 'MAX_LATENCY_MS': 5},
+
+ML_MICRO_BATCHING = {}
+
+
+# ML prediction cache
+# Caches up to MAX_SIZE successful predictions per process for TTL seconds,
+# keyed by the algorithm and the preprocessed record, see 
+# apps/ml/cache.py. SHARED_CACHE is the alias of an optional cache in 
+# CACHES (for example a FileBasedCache) that is shared by the worker 
+# processes. The cache is cleared when the status of an algorithm changes.
+
+ML_PREDICTION_CACHE = {
+    'ENABLED': False,
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'SHARED_CACHE': None,
+}
+
+
+# Async predict view
+# MAX_WORKERS is the number of threads that run the inference for the 
+# predict_async view of the ASGI application
+
+ML_ASYNC_PREDICT = {
+    'MAX_WORKERS': 4,
+}
+
+
+# Shadow inference
+# The production requests of an endpoint are scored again by its algorithms
+# with the shadow status in a pool of MAX_WORKERS threads, after the 
+# response is computed. The shadow requests are saved with the request_id 
+# of the production request in paired_request_id. At most MAX_PENDING 
+# requests wait for the pool, the others are not scored. Without ASYNC 
+# the shadow algorithms score in the request path.
+
+ML_SHADOW = {
+    'ASYNC': True,
+    'MAX_WORKERS': 2,
+    'MAX_PENDING': 1000,
+}
+
+
+# ML request logging
+# The MLRequest objects are buffered and saved in a background thread with 
+# bulk_create, see apps/endpoints/request_writer.py
+
+ML_REQUEST_LOGGING = {
+    'ASYNC': True,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_QUEUE_SIZE': 10000,
+    'ENQUEUE_TIMEOUT': 1.0,
+}
+
+
+# A/B testing
+# The arms of the running A/B tests count their requests and feedback, see
+# apps/endpoints/ab_testing.py. The best arm is significantly better than 
+# the second best when the sequential p-value of their accuracies is at most
+# ALPHA and every arm has MIN_LABELED labeled requests. The p-value stays 
+# valid although it is recomputed whenever feedback arrives, so with 
+# EARLY_STOPPING the test is stopped as soon as the difference is 
+# significant. MIXTURE_VARIANCE is the variance of the expected differences
+# of accuracy, the test is quickest for differences of about its square root.
+
+ML_AB_TESTING = {
+    'EARLY_STOPPING': False,
+    'ALPHA': 0.05,
+    'MIN_LABELED': 100,
+    'MIXTURE_VARIANCE': 0.0025,
+}
+
+
+# Logging
+# The records are written as JSON lines to stdout by a background thread,
+# see server/log.py. SAMPLE_RATES keeps a share of the records of the 
+# loggers below WARNING: apps.endpoints.requests logs one record per 
+# prediction request, and the request payloads at DEBUG level with 
+# ML_LOG_PAYLOADS. The payloads hold the raw inputs of the clients, so 
+# they are kept out of the logs unless it is turned on.
+
+ML_LOG_SAMPLE_RATES = {
+    'apps.endpoints.requests': 0.01,
+}
+
+ML_LOG_PAYLOADS = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'server.log.JsonFormatter',
+        },
+    },
+    'filters': {
+        'sampling': {
+            '()': 'server.log.SamplingFilter',
+            'rates': ML_LOG_SAMPLE_RATES,
+        },
+    },
+    'handlers': {
+        'queue': {
+            'class': 'server.log.QueueStreamHandler',
+            'stream': 'ext://sys.stdout',
+            'max_queue_size': 10000,
+            'formatter': 'json',
+            'filters': ['sampling'],
+        },
+    },
+    'loggers': {
+        'apps': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'server': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'apps.endpoints.requests': {
+            'level': 'DEBUG' if ML_LOG_PAYLOADS else 'INFO',
+        },
+    },
 }
 
 
@@ -15,44 +15,5 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 
 application = get_wsgi_application()
 
-'''
-Adds ML Algorithms to the registry when the server starts
-'''
-
-import inspect
-from apps.ml.registry import MLRegistry
-from apps.ml.income_classifier.random_forest import RandomForestClassifier
-from apps.ml.income_classifier.extra_trees import ExtraTreesClassifier
-
-try:
-    # Create a registry instance
-    registry = MLRegistry()
-
-    # Adding the Random Forest Classifier
-    rf = RandomForestClassifier()
-    registry.add_algorithm(
-        endpoint_name="income_classifier",
-        algorithm_object=rf,
-        algorithm_name="random forest",
-        algorithm_status="production",
-        algorithm_version="0.0.1",
-        owner="TR",
-        algorithm_description="Random forest with simple pre- and post- processing",
-        algorithm_code=inspect.getsource(RandomForestClassifier)
-    )
-
-    # Adding the Extra Trees Classifier
-    et = ExtraTreesClassifier
-    registry.add_algorithm(
-        endpoint_name="income_classifier",
-        algorithm_object=et,
-        algorithm_name="extra trees",
-        algorithm_status="testing",
-        algorithm_version="0.0.1",
-        owner="TR",
-        algorithm_description="Extra Trees with simple pre- and post-processing",
-        algorithm_code=inspect.getsource(RandomForestClassifier)
-    )
-
-except Exception as e:
-    print("Exception while loading the algorithms to the registry,", str(e))
\ No newline at end of file
+# Adds ML Algorithms to the registry when the server starts
+from server.registry import registry